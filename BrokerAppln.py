@@ -38,11 +38,12 @@ from topic_selector import TopicSelector
 from CS6381_MW.BrokerMW import BrokerMW
 # We also need the message formats to handle incoming responses.
 from CS6381_MW import discovery_pb2
+from CS6381_MW.Common import Backoff, endpoint
 
 # import any other packages you need.
 from enum import Enum  # for an enumeration we are using to describe what state we are in
 
-from kazoo.client import KazooClient
+from CS6381_MW.Coordination import make_coordinator
 
 class BrokerAppln():
 
@@ -69,6 +70,9 @@ class BrokerAppln():
         self.addr = None  # our advertised IP address
         self.port = None  # port num where we are going to publish our topics
 
+        self.backoff = Backoff(cap=5.0)  # spacing of our is ready retries
+        self.retry = None  # armed is ready retry, a fallback to the announcement
+
     def configure(self, args):
         ''' Initialize the object '''
 
@@ -84,8 +88,9 @@ class BrokerAppln():
             self.zkIPAddr = args.zkIPAddr
             self.zkPort = args.zkPort
             hosts = self.zkIPAddr + str(":") + str(self.zkPort)
-            self.zk = KazooClient(hosts)
-            self.zk.start()
+            # the session timeout bounds how long a dead leader goes unnoticed
+            self.coord = make_coordinator(hosts, self.logger, timeout=args.zkTimeout)
+            self.coord.start()
 
             # set our current state to CONFIGURE state
             self.state = self.State.CONFIGURE
@@ -111,16 +116,15 @@ class BrokerAppln():
             self.logger.debug("BrokerAppln::configure - initialize the middleware object")
             self.mw_obj = BrokerMW(self.logger)
 
-            if self.zk.exists("/curDiscovery"):
-
-                # Now acquire the value and stats of that znode
-                # value,stat = self.zk.get (self.zkName, watch=self.watch)
-                value, stat = self.zk.get("/curDiscovery")
+            # served from the cache, which start has loaded. Without a discovery
+            # leader yet, we start with the one we were told about and move over
+            # once the leader advertises itself
+            bindstring = endpoint(*args.discovery.rsplit(":", 1))
+            value = self.coord.get("/curDiscovery")
+            if value is not None:
                 bindstring = value.decode("utf-8")
 
 
-            self.update_brokerlist()
-
             self.mw_obj.configure(args, bindstring)  # pass remainder of the args to the m/w object
 
             self.logger.info("BrokerAppln::configure - configuration complete")
@@ -149,6 +153,9 @@ class BrokerAppln():
             self.logger.debug("BrokerAppln::driver - upcall handle")
             self.mw_obj.set_upcall_handle(self)
 
+            # we only get going once elected; until then the event loop just waits
+            self.mw_obj.start_election()
+
             # the next thing we should be doing is to register with the discovery
             # service. But because we are simply delegating everything to an event loop
             # that will call us back, we will need to know when we get called back as to
@@ -220,18 +227,30 @@ class BrokerAppln():
         try:
             self.logger.info("BrokerAppln::isready_response")
 
-            # Notice how we get that loop effect with the sleep (10)
+            if self.state != self.State.ISREADY:
+                # we have gone ahead already, so this is old news
+                return None
+
+            # Notice how we get that loop effect with a timer
             # by an interaction between the event loop and these
             # upcall methods.
             if isready_resp.status == discovery_pb2.STATUS_FAILURE:
-                # discovery service is not ready yet
+                # discovery service is not ready yet and will announce it when it is.
+                # As a fallback we ask again after a backoff so that we don't make
+                # excessive calls; the event loop keeps running in the meantime.
                 self.logger.debug("BrokerAppln::driver - Not ready yet; check again")
-                time.sleep(5)  # sleep between calls so that we don't make excessive calls
+                self.retry = self.mw_obj.schedule_upcall(self.backoff.next_delay())
+                return None
 
             else:
                 # we got the go ahead
                 # set the state to disseminate
                 self.logger.debug("BrokerAppln::driver - Add publishers")
+                self.backoff.reset()
+                if self.retry:
+                    # the go ahead may have been announced before our retry came due
+                    self.mw_obj.cancel_upcall(self.retry)
+                    self.retry = None
                 self.state = self.State.ADDPUBS
 
             # return timeout of 0 so event loop calls us back in the invoke_operation
@@ -246,12 +265,25 @@ class BrokerAppln():
 
         try:
             self.logger.info("BrokerAppln::pubslookup_response started")
-            for tup in pubslookup_resp.array:
-                addr = tup.addr
-                port = tup.port
-                self.mw_obj.lookup_bind(addr, port)
+            if pubslookup_resp.delta:
+                # just what changed since we last asked
+                for tup in pubslookup_resp.removed:
+                    self.mw_obj.lookup_unbind(tup.addr, tup.port)
+
+                for tup in pubslookup_resp.array:
+                    addr = tup.addr
+                    port = tup.port
+                    self.mw_obj.lookup_bind(addr, port)
+            else:
+                # the full list; we connect to the new ones and drop whoever is
+                # not on it anymore
+                self.mw_obj.lookup_update([(tup.addr, tup.port) for tup in pubslookup_resp.array])
+
+            self.logger.info("BrokerAppln::pubslookup_response - receiving from {} publishers".format(self.mw_obj.fan_in()))
 
-            self.state = self.State.DISSEMINATION
+            if self.state == self.State.ADDPUBS:
+                # rather than, e.g., an answer we got while standing by
+                self.state = self.State.DISSEMINATION
 
             self.logger.info("BrokerAppln::pubslookup_response completed")
 
@@ -305,8 +337,10 @@ class BrokerAppln():
                 # self.mw_obj.event_loop()
 
                 self.logger.debug("BrokerAppln::invoke_operation - add publishers")
-                #self.mw_obj.request_pubs()
-                self.watch_znode_pubscount()
+                # discovery pushes us the publishers that come and go from here on.
+                # We subscribe before asking so that we miss none of them
+                self.mw_obj.watch_changes()
+                self.mw_obj.request_pubs()
 
                 return None
 
@@ -343,91 +377,18 @@ class BrokerAppln():
             raise e
 
 
-    def update_brokerlist(self):
-
-        try:
-            # Now we are going to check if the znode that we just created
-            # exists or not. Note that a watch can be set on create, exists
-            # and get/set methods
-            if self.zk.exists("/brokerlist"):
-
-                # Now acquire the value and stats of that znode
-                # value,stat = self.zk.get (self.zkName, watch=self.watch)
-                value = self.zk.get("/brokerlist")[0]
-                value = value.decode("utf-8")
-
-                add = str(self.addr) + " " + str(self.port) + ","
-
-                new_string = value + add
-
-                new_string = bytes(new_string, 'utf-8')
-                self.zk.set("/brokerlist", new_string)
-
-
-            else:
-                print("{} znode does not exist, why?".format("/brokerlist"))
-
-        except Exception as e:
-            raise e
-
-
-    def watch_znode_pubscount(self):
-
-        @self.zk.DataWatch("/numPubs")
-        def dump_data_change(data, stat):
-            print("\n*********** Inside watch_znode_pubscount_change *********")
-            self.mw_obj.request_pubs()
-
-
-    def leaderelection(self):
-
-        try:
-
-            if self.zk.exists("/brokerlist"):
-
-                # Now acquire the value and stats of that znode
-                # value,stat = self.zk.get (self.zkName, watch=self.watch)
-                value = self.zk.get("/brokerlist")[0]
-                ret = value.decode("utf-8")
-
-                if ret.endswith(","):
-                    ret = ret[:-1]
-
-                arr = ret.split(',')
-                arr.pop(0)
-
-                if arr:
-                    new_broker = arr[0]
-
-                    if self.zk.exists("/curbroker"):
-                        new_bytes = bytes(new_broker, 'utf-8')
-                        self.zk.set("/curbroker", new_bytes)
-
-                else:
-                    print("BrokerAppln: LEADER ELECTION NOT AVAILABLE - not enough discoveries available")
-
-
-                listToStr = ','.join([str(elem) for elem in arr])
-                new_bytes_list = bytes(listToStr, 'utf-8')
-                self.zk.set("/brokerlist", new_bytes_list)
-
-
-            else:
-                print("{} znode does not exist, why?".format("/brokerlist"))
-
-        except Exception as e:
-            raise e
-
-
     def exitfunc(self):
-        self.leaderelection()
+        # closing our session drops our election znode and /curbroker right
+        # away, so the next broker in line takes over without waiting for a timeout
+        self.mw_obj.stepdown.set()
+        self.coord.stop()
         print ("Broker has successfully ended")
 
 
 
 
 
-def parseCmdLineArgs():
+def parseCmdLineArgs(argv=None):
   # instantiate a ArgumentParser object
   parser = argparse.ArgumentParser(description="Broker Application")
 
@@ -445,6 +406,9 @@ def parseCmdLineArgs():
   parser.add_argument("-p", "--port", type=int, default=5570,
                       help="Port number on which our underlying publisher ZMQ service runs, default=5570")
 
+  parser.add_argument("-ap", "--advertise_port", type=int, default=None,
+                      help="Port number to advertise instead of --port, e.g., that of an impair.py proxy in front of us, default: --port")
+
   parser.add_argument("-d", "--discovery", default="localhost:5555",
                       help="IP Addr:Port combo for the discovery service, default localhost:5555")
 
@@ -460,13 +424,28 @@ def parseCmdLineArgs():
                       choices=[logging.DEBUG, logging.INFO, logging.WARNING, logging.ERROR, logging.CRITICAL],
                       help="logging level, choices 10,20,30,40,50: default 20=logging.INFO")
 
+  parser.add_argument("-rs", "--resync", type=float, default=30,
+                      help="Seconds between requests catching up on missed publisher changes, 0 to disable, default 30")
+
+  parser.add_argument("-rb", "--replay", type=int, default=100,
+                      help="Number of the latest messages a standby keeps to replay once elected, default 100")
+
+  parser.add_argument("-cu", "--catchup", type=float, default=2,
+                      help="Seconds at most to wait for the subscribers to follow us once elected before replaying, default 2")
+
+  parser.add_argument("-gf", "--gapfill", type=float, default=2,
+                      help="Seconds to wait for the publishers to fill us in once elected, default 2")
+
+  parser.add_argument("-zt", "--zkTimeout", type=float, default=10.0,
+                      help="ZooKeeper session timeout in seconds, which bounds the failover time, default 10")
+
   parser.add_argument("-zkp", "--zkPort", type=int, default=2181,
                       help="Port number on which our underlying publisher ZMQ service runs, default=5555")
 
   parser.add_argument("-zka", "--zkIPAddr", type=str, default="127.0.0.1",
-                      help="ZooKeeper server port, default 2181")
+                      help="ZooKeeper server IP address, default 127.0.0.1, or local for the in-process stand-in")
 
-  return parser.parse_args()
+  return parser.parse_args(argv)
 
 
 ###################################
@@ -14,7 +14,7 @@
 # and accordingly design things for the broker side of things.
 #
 # As mentioned earlier, a broker serves as a proxy and hence has both
-# publisher and subscriber roles. So in addition to the REQ socket to talk to the
+# publisher and subscriber roles. So in addition to the DEALER socket to talk to the
 # Discovery service, it will have both PUB and SUB sockets as it must work on
 # behalf of the real publishers and subscribers. So this will have the logic of
 # both publisher and subscriber middleware.
@@ -23,30 +23,72 @@
 import os  # for OS functions
 import sys  # for syspath and system exception
 import time  # for sleep
+import random  # for jitter
+import threading  # the election runs in a thread of its own
+import collections  # for the replay buffer
+import json  # gap-fill requests
 import logging  # for logging. Use it in place of print statements.
 import zmq  # ZMQ sockets
 
 # import serialization logic
 from CS6381_MW import discovery_pb2
 
+# timer facility shared by all the middleware event loops
+from CS6381_MW.Common import TimerQueue, ConnectionManager, BROKER_ELECTION, GAPFILL_PORT_OFFSET, Inbox
+from CS6381_MW.Common import bind_endpoint, split_endpoint
+
+from kazoo.client import KazooState
+
+# our requests to the discovery service
+from CS6381_MW.DiscoveryClient import DiscoveryClient
+
 
 class BrokerMW():
 
+    # seconds without a subscriber joining after which a newly elected broker
+    # takes it that those following /curbroker are all with it
+    CATCHUP_SETTLE = 0.1
+
     ########################################
     # constructor
     ########################################
     def __init__(self, logger):
         self.logger = logger  # internal logger for print statements
-        self.req = None  # will be a ZMQ REQ socket to talk to Discovery service
-        self.pub = None  # will be a ZMQ PUB socket for dissemination
+        self.disc = None  # will be a DiscoveryClient to talk to Discovery service
+        self.pub = None  # will be a ZMQ XPUB socket for dissemination, telling us who joins
         self.sub = None
         self.poller = None  # used to wait on incoming replies
         self.addr = None  # our advertised IP address
-        self.port = None  # port num where we are going to publish our topics
+        self.port = None  # port num we advertise for our topics
+        self.bind_port = None  # port num we bind to, behind a proxy it is not the one we advertise
         self.upcall_obj = None  # handle to appln obj to handle appln-specific data
         self.handle_events = True  # in general we keep going thru the event loop
+        self.notify = None  # SUB socket on which the discovery service announces events
+        self.ready_announced = False  # has discovery announced that the system is ready
         self.topiclist = None
         self.curbindstring = None
+        self.pubs_version = None  # registry version up to which we know every change to the publishers
+        self.catching_up = False  # asking for the publishers after having missed a change
+        self.publishers = None  # ConnectionManager of the endpoints our SUB socket is connected to
+        self.notify_endpoint = None  # where the discovery service announces events
+        self.notify_keys = set()  # the announcements we are subscribed to
+        self.resync = None  # seconds between lookups catching up on missed changes
+        self.resync_timer = None  # the next such lookup
+        self.watching = False  # do we follow the registry changes
+        self.timers = TimerQueue()  # retries without sleeping in the event loop
+        self.inbox = Inbox()  # watch handlers posted to us from ZooKeeper's threads
+        self.context = None  # the election thread needs it for the inproc pipe
+        self.leader_pipe = None  # inproc PULL socket on which we hear we have been elected
+        self.leading = False  # have we been elected
+        self.election = None  # our candidacy among the brokers
+        self.stepdown = threading.Event()  # set when we must stop leading
+        self.replay = None  # the latest messages received while standing by
+        self.catchup_wait = None  # seconds at most we hold the replay once elected
+        self.catchup = None  # timer of the replay, armed while we hold it
+        self.catchup_deadline = None  # when we stop holding it, joins or not
+        self.last_seen = {}  # publisher name -> last sequence number received from it
+        self.gapfills = {}  # DEALER socket of each gap-fill request outstanding -> its timer
+        self.gapfill_timeout = None  # seconds we wait for the publishers to answer one
 
 
     ########################################
@@ -60,45 +102,64 @@ class BrokerMW():
             self.logger.info("BrokerMW::configure")
 
             # First retrieve our advertised IP addr and the publication port num
-            self.port = args.port
+            # Those reaching us through a proxy, e.g., impair.py, are told its port
+            self.bind_port = args.port
+            self.port = args.advertise_port if args.advertise_port else args.port
             self.addr = args.addr
+            self.resync = args.resync
+            self.replay = collections.deque(maxlen=args.replay)
+            self.catchup_wait = args.catchup
+            self.gapfill_timeout = args.gapfill
 
             # Next get the ZMQ context
             self.logger.debug("BrokerMW::configure - obtain ZMQ context")
-            context = zmq.Context()  # returns a singleton object
+            context = zmq.Context.instance()  # returns a singleton object
+            self.context = context
 
             # get the ZMQ poller object
             self.logger.debug("BrokerMW::configure - obtain the poller")
             self.poller = zmq.Poller()
 
-            # Now acquire the REQ and PUB/SUB sockets
-            self.logger.debug("BrokerMW::configure - obtain REQ and PUB sockets")
-            self.req = context.socket(zmq.REQ)
-            self.pub = context.socket(zmq.PUB)
+            # our inbox wakes us up when a watch has posted something
+            self.poller.register(self.inbox.fd, zmq.POLLIN)
+
+            # Now acquire the PUB/SUB sockets. The PUB side is an XPUB, which
+            # is a PUB that also hands us the subscriptions of whoever
+            # connects, every one of them rather than just the first per topic
+            self.logger.debug("BrokerMW::configure - obtain XPUB and SUB sockets")
+            self.pub = context.socket(zmq.XPUB)
+            self.pub.setsockopt(zmq.XPUB_VERBOSE, 1)
             self.sub = context.socket(zmq.SUB)
+            self.publishers = ConnectionManager(self.sub, self.logger, name="SUB")
 
-            # Since are using the event loop approach, register the REQ socket for incoming events
+            # Since are using the event loop approach, register the SUB socket for incoming events
             # Note that nothing ever will be received on the PUB socket and so it does not make
             # any sense to register it with the poller for an incoming message.
-            self.logger.debug("BrokerMW::configure - register the REQ socket for incoming replies")
-            self.poller.register(self.req, zmq.POLLIN)
+            self.logger.debug("BrokerMW::configure - register the SUB socket for incoming data")
             self.poller.register(self.sub, zmq.POLLIN)
+            self.poller.register(self.pub, zmq.POLLIN)
+
+            # the election thread tells us here that we have been elected
+            self.leader_pipe = context.socket(zmq.PULL)
+            self.leader_pipe.bind(self.leader_endpoint())
+            self.poller.register(self.leader_pipe, zmq.POLLIN)
 
             # Now connect ourselves to the discovery service. Recall that the IP/port were
-            # supplied in our argument parsing. Best practices of ZQM suggest that the
-            # one who maintains the REQ socket should do the "connect"
+            # supplied in our argument parsing. The discovery client registers its DEALER
+            # socket with our poller for incoming replies.
             self.logger.debug("BrokerMW::configure - connect to Discovery service")
             # For our assignments we will use TCP. The connect string is made up of
             # tcp:// followed by IP addr:port number.
             self.curbindstring = bindstring
             connect_str = bindstring
-            self.req.connect(connect_str)
+            self.disc = DiscoveryClient(self.logger, self.poller, self.timers, locate=self.get_disc_value)
+            self.disc.connect(context, connect_str)
 
             self.logger.debug("BrokerMW::configure - bind to the pub socket")
             # note that we publish on any interface hence the * followed by port number.
             # We always use TCP as the transport mechanism (at least for these assignments)
             # Since port is an integer, we convert it to string to make it part of the URL
-            bind_string = "tcp://*:" + str(self.port)
+            bind_string = bind_endpoint(self.addr, self.bind_port)
             self.pub.bind(bind_string)
 
 
@@ -119,61 +180,265 @@ class BrokerMW():
             # True but can be set out of band to False in order to exit this forever
             # loop
 
-            file = "/curbroker"
-            value, stat = self.upcall_obj.zk.get(file)
-            curbroker = value.decode("utf-8")
-
-            cur = str(self.addr) + " " + str(self.port)
-
-            iters = 0
-
-            while (curbroker != cur):
-
-                iters += 1
-
-                if (iters % 5 == 0):
-                    self.logger.info("BrokerAppln::invoke_operation - waiting to become leader")
-
-                file = "/curbroker"
-                value, stat = self.upcall_obj.zk.get(file)
-
-                curbroker = value.decode("utf-8")
-                cur = str(self.addr) + " " + str(self.port)
-
-                time.sleep(2)
-
+            # we drive the application state machine only once we are the leader.
+            # Until then we wait to hear from the election thread, warmed up.
+            start_timeout, timeout = timeout, None
+            if not self.leading:
+                self.warm_up()
 
             while self.handle_events:  # it starts with a True value
-                # poll for events. We give it an infinite timeout.
+                # poll for events. We never wait past the earliest armed timer.
                 # The return value is a socket to event mask mapping
-                events = dict(self.poller.poll(timeout=timeout))
+                events = dict(self.poller.poll(timeout=self.timers.poll_timeout(timeout)))
+
+                # a timer is due, e.g., a retry of the is ready request. It is
+                # handled like an upcall and tells us the next timeout to use.
+                # Any socket events are picked up in the next iteration.
+                if self.timers.expired():
+                    timeout = self.timers.run_expired(timeout)
 
                 # check if a timeout has occurred. We know this is the case when
                 # the event mask is empty
-                if not events:
+                elif not events:
                     # timeout has occurred so it is time for us to make appln-level
                     # method invocation. Make an upcall to the generic "invoke_operation"
                     # which takes action depending on what state the application
                     # object is in.
                     timeout = self.upcall_obj.invoke_operation()
 
-                elif self.req in events:  # this is the only socket on which we should be receiving replies
+                elif self.disc.socket in events:  # replies from the discovery service
 
                     # handle the incoming reply from remote entity and return the result
-                    timeout = self.handle_reply()
+                    timeout = self.handle_reply(timeout)
+
+                elif self.inbox.fd in events:  # a ZooKeeper watch fired
+                    self.inbox.run()
+
+                elif self.notify in events:  # an announcement from the discovery service
+                    timeout = self.handle_notification(timeout)
+
+                elif self.leader_pipe in events:  # we won the election
+                    self.leader_pipe.recv()
+                    if not self.leading:
+                        # hand the event loop the timeout it was originally started
+                        # with so the application gets its first upcall
+                        self.logger.info("BrokerMW::event_loop - we are now the leader")
+                        timeout = start_timeout
+                        self.take_over()
 
                 elif self.sub in events:
-                    message = self.sub.recv_string()
-                    print (message)
-                    self.pub.send(bytes(message, "utf-8"))
+                    self.forward(self.sub.recv_string())
+
+                elif self.pub in events:  # a subscriber joining or leaving
+                    self.handle_subscription()
 
 
+                elif self.gapfills.keys() & events.keys():  # publishers filling us in
+                    for sock in self.gapfills.keys() & events.keys():
+                        self.handle_gapfill(sock)
+
                 else:
                     raise Exception("Unknown event after poll")
 
         except Exception as e:
             raise e
 
+    ########################################
+    # where the election thread tells us we have been elected
+    #
+    # named after us, since all the brokers of a simulation share one
+    # ZMQ context
+    ########################################
+    def leader_endpoint(self):
+        return "inproc://broker-leader-{}:{}".format(self.addr, self.port)
+
+    ########################################
+    # take over from the old leader
+    #
+    # the subscribers following /curbroker connect to us only once they
+    # see us there, and a PUB socket drops what is sent before they have.
+    # So we hold the replay, and the gap fill that follows it, until they
+    # have joined, i.e., until no more subscriptions come in for a moment,
+    # but no longer than catchup_wait. What comes in meanwhile we forward
+    # right away as ever.
+    ########################################
+    def take_over(self):
+        ''' lead, replaying once the subscribers have followed us '''
+
+        self.leading = True
+        self.catchup_deadline = time.monotonic() + self.catchup_wait
+        self.catchup = self.timers.schedule(self.catchup_wait, self.catch_up)
+
+    ########################################
+    # a subscription or its withdrawal on our XPUB socket
+    #
+    # the first byte is 1 for a subscription, 0 for a withdrawal
+    ########################################
+    def handle_subscription(self):
+        ''' note a subscriber joining '''
+
+        frame = self.pub.recv()
+        if self.catchup is not None and frame[:1] == b"\x01":
+            # somebody is still arriving; give the rest a moment too
+            self.timers.cancel(self.catchup)
+            delay = min(self.CATCHUP_SETTLE, max(0, self.catchup_deadline - time.monotonic()))
+            self.catchup = self.timers.schedule(delay, self.catch_up)
+
+    def catch_up(self):
+        ''' replay what the old leader may not have got out before it went '''
+
+        self.catchup = None
+        self.logger.info("BrokerMW::catch_up - replaying {} messages".format(len(self.replay)))
+        while self.replay:
+            self.pub.send(bytes(self.replay.popleft(), "utf-8"))
+
+        # and what we missed ourselves, e.g., from publishers we had
+        # not got around to connecting to yet
+        self.request_gapfill()
+        return TimerQueue.KEEP
+
+    ########################################
+    # pass a publication on to the subscribers
+    ########################################
+    def forward(self, message):
+        ''' forward a publication received on our SUB socket '''
+
+        # the header ends in the publisher's name and sequence number
+        header = message.rsplit(":", 2)
+        if len(header) == 3:
+            # a gap fill may bring in older ones after newer ones
+            seq = int(header[2])
+            if seq > self.last_seen.get(header[1], -1):
+                self.last_seen[header[1]] = seq
+        if self.leading:
+            print (message)
+        else:
+            # standing by; keep the latest in case we take over
+            self.replay.append(message)
+
+        # standbys forward too, which only reaches the subscribers
+        # that take a second path through us
+        self.pub.send(bytes(message, "utf-8"))
+
+    ########################################
+    # ask the publishers for what we missed
+    #
+    # each publisher we are connected to gets the last sequence numbers we
+    # received, by publisher name, over a DEALER socket of its own, and
+    # answers with what it still has after its own. We forward all of it
+    # as is; the subscribers drop what they got already.
+    ########################################
+    def request_gapfill(self):
+        ''' gap-fill request to every publisher '''
+
+        request = bytes(json.dumps(self.last_seen), "utf-8")
+        for endpoint in list(self.publishers.connected):
+            addr, port = split_endpoint(endpoint)
+            sock = self.context.socket(zmq.DEALER)
+            sock.connect(ConnectionManager.endpoint(addr, port + GAPFILL_PORT_OFFSET))
+            sock.send(request)
+            self.poller.register(sock, zmq.POLLIN)
+
+            # a publisher that went away in the meantime never answers
+            self.gapfills[sock] = self.timers.schedule(self.gapfill_timeout, self.end_gapfill, sock)
+
+        self.logger.info("BrokerMW::request_gapfill - asked {} publishers".format(len(self.gapfills)))
+
+    def handle_gapfill(self, sock):
+        ''' forward what a publisher sent us to fill in a gap '''
+
+        frames = [frame for frame in sock.recv_multipart() if frame]
+        self.logger.info("BrokerMW::handle_gapfill - forwarding {} publications".format(len(frames)))
+        for frame in frames:
+            self.pub.send(frame)
+
+        self.timers.cancel(self.gapfills[sock])
+        self.end_gapfill(sock)
+
+    def end_gapfill(self, sock):
+        ''' done with a gap-fill request, answered or not '''
+
+        self.poller.unregister(sock)
+        sock.close(linger=0)
+        del self.gapfills[sock]
+        return TimerQueue.KEEP
+
+    ########################################
+    # run for leader of the brokers
+    #
+    # kazoo's election recipe queues every broker up as an ephemeral
+    # sequential znode, each one watching just the one ahead of it, so
+    # nobody reads anything from ZooKeeper while waiting. The winner
+    # advertises itself in the ephemeral /curbroker and tells our event
+    # loop over an inproc pipe, which is when we get going. Should the
+    # leader die, its znodes go away with its session and the next in
+    # line is woken up right then.
+    ########################################
+    def start_election(self):
+        ''' enter the election in the background '''
+
+        self.election = self.upcall_obj.coord.election(BROKER_ELECTION, "{} {}".format(self.addr, self.port))
+        self.upcall_obj.coord.add_listener(self.zk_state_change)
+        threading.Thread(target=self.campaign, daemon=True).start()
+
+    # stand for election until we exit; we lead for as long as lead runs
+    def campaign(self):
+        while self.handle_events:
+            try:
+                self.stepdown.clear()
+                self.election.run(self.lead)
+
+            except Exception as e:
+                # e.g., no connection to ZooKeeper right now; try again shortly
+                self.logger.warning("BrokerMW::campaign - {}".format(e))
+                time.sleep(1)
+
+    def lead(self):
+        ''' what we do for as long as we are the leader '''
+
+        self.logger.info("BrokerMW::lead - we are the leader")
+
+        # replacing whatever is there in one step, so nobody looking sees it
+        # missing in between
+        self.upcall_obj.coord.claim("/curbroker", bytes("{} {}".format(self.addr, self.port), "utf-8"))
+
+        # sockets belong to the event loop thread, so we just wake it up
+        push = self.context.socket(zmq.PUSH)
+        push.connect(self.leader_endpoint())
+        push.send(b"elected")
+        push.close()
+
+        self.stepdown.wait()
+        self.logger.info("BrokerMW::lead - stepping down")
+
+    ########################################
+    # get ready to take over while we stand by
+    #
+    # we connect to all the publishers and follow the changes to them just
+    # like the leader does, keeping the latest of what they send. Once we
+    # are elected all that is left to do is to forward.
+    ########################################
+    def warm_up(self):
+        ''' connect to the publishers ahead of being elected '''
+
+        self.logger.info("BrokerMW::warm_up - standing by")
+
+        # take what the publishers send from the start, so that our replay
+        # buffer and last_seen are current by the time we are elected
+        self.topiclist = self.upcall_obj.topiclist
+        for item in self.topiclist:
+            self.sub.setsockopt(zmq.SUBSCRIBE, bytes(item, "utf-8"))
+
+        self.watch_changes()
+        self.request_pubs()
+
+    def zk_state_change(self, state):
+        if state == KazooState.LOST:
+            # our session and with it our znodes are gone, and another broker
+            # may well be leading by now; we stand again
+            self.logger.warning("BrokerMW::zk_state_change - session lost")
+            self.stepdown.set()
+
     ########################################
     # register with the discovery service
     ########################################
@@ -197,8 +462,6 @@ class BrokerMW():
                 reg_info.port = self.port  # port on which we are subscribing
                 self.logger.debug("BrokerMW::register - done populating the Registrant Info")
 
-                self.topiclist = topiclist
-
                 # Next build a RegisterReq message
                 self.logger.debug("BrokerMW::register - populate the nested register req")
                 register_req = discovery_pb2.RegisterReq()  # allocate
@@ -219,9 +482,6 @@ class BrokerMW():
                 disc_req.register_req.CopyFrom(register_req)
                 self.logger.debug("BrokerMW::register - done building the outer message")
 
-                for item in self.topiclist:
-                    self.sub.setsockopt(zmq.SUBSCRIBE, bytes(item, "utf-8"))
-
                 # now let us stringify the buffer and print it. This is actually a sequence of bytes and not
                 # a real string
                 buf2send = disc_req.SerializeToString()
@@ -229,7 +489,7 @@ class BrokerMW():
 
                 # now send this to our discovery service
                 self.logger.debug("BrokerMW::register - send stringified buffer to Discovery service")
-                self.req.send(buf2send)  # we use the "send" method of ZMQ that sends the bytes
+                self.disc.send(disc_req)  # tagged with a request id, so others may be outstanding too
 
                 # now go to our event loop to receive a response to this request
                 self.logger.debug("BrokerMW::register - now wait for reply")
@@ -281,7 +541,7 @@ class BrokerMW():
 
             # now send this to our discovery service
             self.logger.debug("BrokerMW::is_ready - send stringified buffer to Discovery service")
-            self.req.send(buf2send)  # we use the "send" method of ZMQ that sends the bytes
+            self.disc.send(disc_req)  # tagged with a request id, so others may be outstanding too
 
             # now go to our event loop to receive a response to this request
             self.logger.info("BrokerMW::is_ready - request sent and now wait for reply")
@@ -294,6 +554,9 @@ class BrokerMW():
         ''' Request publishers from discovery '''
 
         pubs_req = discovery_pb2.RegisterPubsReq()
+        if self.pubs_version is not None:
+            # we only need to hear what changed since we last asked
+            pubs_req.since_version = self.pubs_version
 
         disc_req = discovery_pb2.DiscoveryReq()
         disc_req.msg_type = discovery_pb2.TYPE_LOOKUP_ALL_PUBS
@@ -307,7 +570,7 @@ class BrokerMW():
 
         # now send this to our discovery service
         self.logger.debug("BrokerMW::request_pubs - send stringified buffer to Discovery service")
-        self.req.send(buf2send)  # we use the "send" method of ZMQ that sends the bytes
+        self.disc.send(disc_req)  # tagged with a request id, so others may be outstanding too
 
         # now go to our event loop to receive a response to this request
         self.logger.info("BrokerMW::request_pubs - request sent and now wait for reply")
@@ -316,14 +579,17 @@ class BrokerMW():
     #################################################################
     # handle an incoming reply
     #################################################################
-    def handle_reply(self):
+    def handle_reply(self, timeout):
         ''' Handle an incoming reply '''
 
         try:
             self.logger.info("BrokerMW::handle_reply")
 
             # let us first receive all the bytes
-            bytesRcvd = self.req.recv()
+            bytesRcvd = self.disc.recv()
+            if bytesRcvd is None:
+                # a late reply to a request that was already answered or given up
+                return timeout
 
             # now use protobuf to deserialize the bytes
             # The way to do this is to first allocate the space for the
@@ -343,9 +609,29 @@ class BrokerMW():
                 timeout = self.upcall_obj.register_response(disc_resp.register_resp)
             elif (disc_resp.msg_type == discovery_pb2.TYPE_ISREADY):
                 # this is a response to is ready request
+                if disc_resp.isready_resp.HasField("notify_endpoint"):
+                    self.listen(disc_resp.isready_resp.notify_endpoint)
+
+                if self.ready_announced:
+                    # we went ahead on the announcement already, which
+                    # supersedes whatever this reply says
+                    return timeout
+                elif disc_resp.isready_resp.status == discovery_pb2.STATUS_FAILURE:
+                    # not ready yet; wait for discovery to announce it
+                    self.subscribe(b"ready")
+                else:
+                    # the go ahead; an announcement still on its way is old news
+                    self.mark_ready()
                 timeout = self.upcall_obj.isready_response(disc_resp.isready_resp)
             elif (disc_resp.msg_type == discovery_pb2.TYPE_LOOKUP_ALL_PUBS):
-                # this is a response to is ready request
+                # this is a response to our request for the publishers
+                if disc_resp.pubs_resp.HasField("notify_endpoint"):
+                    # e.g., a new discovery leader, whose changes we follow from now on
+                    self.listen(disc_resp.pubs_resp.notify_endpoint)
+                self.pubs_version = disc_resp.pubs_resp.version or None
+                self.catching_up = False
+                if self.watching:
+                    self.arm_resync(self.resync)
                 timeout = self.upcall_obj.pubslookup_response(disc_resp.pubs_resp)
 
             else:  # anything else is unrecognizable by this object
@@ -362,7 +648,174 @@ class BrokerMW():
     # handle a SUB socket binding to publishers
     ##################################################################
     def lookup_bind(self, addr, port):
-        self.sub.connect("tcp://{}:{}".format(addr, port))
+        # lookups may well hand out the same one again; we connect just once
+        self.publishers.add(ConnectionManager.endpoint(addr, port))
+
+    # stop receiving from a publisher that has gone away
+    def lookup_unbind(self, addr, port):
+        self.publishers.remove(ConnectionManager.endpoint(addr, port))
+
+    # be connected to just the given (addr, port) endpoints, e.g., after a full lookup
+    def lookup_update(self, endpoints):
+        self.publishers.update([ConnectionManager.endpoint(addr, port) for addr, port in endpoints])
+
+    # number of endpoints we receive from
+    def fan_in(self):
+        return self.publishers.fan_in()
+
+
+    #################################################################
+    # listen to the announcements of the discovery service
+    #################################################################
+    def listen(self, endpoint):
+        ''' connect to the notification socket of the discovery service '''
+
+        if self.notify is None:
+            self.notify = zmq.Context.instance().socket(zmq.SUB)
+            for key in self.notify_keys:  # asked for before we knew where to listen
+                self.notify.setsockopt(zmq.SUBSCRIBE, key)
+            self.poller.register(self.notify, zmq.POLLIN)
+
+        elif self.notify_endpoint != endpoint:
+            # a new discovery leader; stop listening to the old one
+            self.notify.disconnect(self.notify_endpoint)
+
+        else:
+            return
+
+        self.logger.info("BrokerMW::listen - listening on {}".format(endpoint))
+        self.notify_endpoint = endpoint
+        self.notify.connect(endpoint)
+
+    # hear the announcements whose key starts with key
+    def subscribe(self, key):
+        if key not in self.notify_keys:
+            self.notify_keys.add(key)
+            if self.notify is not None:
+                self.notify.setsockopt(zmq.SUBSCRIBE, key)
+
+    # no longer hear them
+    def unsubscribe(self, key):
+        if key in self.notify_keys:
+            self.notify_keys.discard(key)
+            if self.notify is not None:
+                self.notify.setsockopt(zmq.UNSUBSCRIBE, key)
+
+    #################################################################
+    # follow the changes discovery makes to the publishers
+    #
+    # we relay every topic so all the changes pushed under "pub/" are of
+    # interest to us. A lookup every resync seconds (or when discovery
+    # asks us to) catches up on any we miss.
+    #################################################################
+    def watch_changes(self):
+        ''' subscribe to the registry changes '''
+
+        self.watching = True
+        self.subscribe(b"pub/")
+        self.subscribe(b"resync")
+
+    # apply a change to the registry pushed by discovery
+    #
+    # a change whose predecessor we do not know of tells us we missed one,
+    # so we ask for what changed since the last version we know all of
+    def apply_change(self, change):
+        if self.pubs_version is None or change.version <= self.pubs_version:
+            return  # already part of what we know, e.g., a copy under another topic
+
+        if change.previous > self.pubs_version:
+            if not self.catching_up:
+                self.logger.info("BrokerMW::apply_change - missed changes after {}".format(self.pubs_version))
+                self.catching_up = True
+                self.request_pubs()
+            return
+
+        old = (change.before.addr, change.before.port) if change.before_topics else None
+        new = (change.after.addr, change.after.port) if change.after_topics else None
+        if old != new:
+            self.logger.info("BrokerMW::apply_change - {} -> {}".format(old, new))
+            if old is not None:
+                self.lookup_unbind(*old)
+            if new is not None:
+                self.lookup_bind(*new)
+
+        self.pubs_version = change.version
+
+    # ask for the publishers again after about delay seconds, jittered so
+    # that we do not ask at the same time as everyone else
+    def arm_resync(self, delay):
+        if self.resync_timer is not None:
+            self.timers.cancel(self.resync_timer)
+            self.resync_timer = None
+
+        if delay:
+            self.resync_timer = self.timers.schedule(random.uniform(0.5, 1.0) * delay, self.resync_pubs)
+
+    # a timer callback; the timeout of the event loop is left alone
+    def resync_pubs(self):
+        self.resync_timer = None
+        self.request_pubs()
+        return TimerQueue.KEEP
+
+    #################################################################
+    # the system is ready as far as we are concerned
+    #
+    # whichever of the is ready reply and the announcement tells us first
+    # is handed to the application; the other one is ignored
+    #################################################################
+    def mark_ready(self):
+        self.ready_announced = True
+        self.unsubscribe(b"ready")
+
+    #################################################################
+    # handle an announcement from the discovery service
+    #
+    # returns the timeout to use for the next poll, which stays what it
+    # was unless the announcement is handed to the application
+    #################################################################
+    def handle_notification(self, timeout):
+        ''' handle an incoming notification '''
+
+        try:
+            key, bytesRcvd = self.notify.recv_multipart()
+
+            disc_resp = discovery_pb2.DiscoveryResp()
+            disc_resp.ParseFromString(bytesRcvd)
+
+            if key == b"ready" and not self.ready_announced:
+                self.logger.info("BrokerMW::handle_notification - system is ready")
+                self.mark_ready()
+
+                # the announcement answers any is ready request of ours still out
+                self.disc.cancel(discovery_pb2.TYPE_ISREADY)
+                return self.upcall_obj.isready_response(disc_resp.isready_resp)
+
+            elif key.startswith(b"pub/") and disc_resp.HasField("change"):
+                self.apply_change(disc_resp.change)
+
+            elif key == b"resync":
+                # discovery lost track of its changes; ask again soon
+                self.logger.info("BrokerMW::handle_notification - asked to resync")
+                self.arm_resync(1.0)
+
+            return timeout
+
+        except Exception as e:
+            raise e
+
+    ########################################
+    # arrange for invoke_operation to be upcalled after delay seconds
+    #
+    # used by the application instead of sleeping inside an upcall so that
+    # our sockets keep being serviced in the meantime
+    ########################################
+    def schedule_upcall(self, delay):
+        ''' schedule an upcall to invoke_operation '''
+        return self.timers.schedule(delay, self.upcall_obj.invoke_operation)
+
+    def cancel_upcall(self, entry):
+        ''' cancel an upcall scheduled earlier '''
+        self.timers.cancel(entry)
 
 
     ########################################
@@ -393,12 +846,9 @@ class BrokerMW():
             # Now we are going to check if the znode that we just created
             # exists or not. Note that a watch can be set on create, exists
             # and get/set methods
-            if self.upcall_obj.zk.exists("/curDiscovery"):
-
-                # Now acquire the value and stats of that znode
-                # value,stat = self.zk.get (self.zkName, watch=self.watch)
-                value, stat = self.upcall_obj.zk.get("/curDiscovery")
-
+            # served from the cache of the Coordinator, without a round trip
+            value = self.upcall_obj.coord.get("/curDiscovery")
+            if value is not None:
                 ret = value.decode("utf-8")
                 return ret
 
@@ -412,12 +862,15 @@ class BrokerMW():
 
     def watch_znode_disc_change(self):
 
-        @self.upcall_obj.zk.DataWatch("/curDiscovery")
-        def dump_data_change(data, stat):
+        def dump_data_change(data):
             print("\n*********** Inside watch_znode_disc_change *********")
-            self.req.disconnect(self.curbindstring)
+            if data is None:
+                return  # no leader at the moment; wait for the next one
 
-            self.logger.info("BrokerMW::disc watch - connecting to new discovery")
-            new_disc_str = self.get_disc_value()
+            # posted to our event loop, so we switch over right away
+            self.logger.info("BrokerMW::disc watch - redirecting to new discovery")
+            new_disc_str = data.decode("utf-8")
             self.curbindstring = new_disc_str
-            self.req.connect(new_disc_str)
\ No newline at end of file
+            self.disc.reconnect(new_disc_str)
+
+        self.upcall_obj.coord.watch_data("/curDiscovery", dump_data_change, self.inbox)
@@ -24,11 +24,29 @@ import argparse
 # to ZooKeeper
 from kazoo.client import KazooClient   # client API
 from kazoo.client import KazooState    # for the state machine
+from kazoo.exceptions import NodeExistsError, NoNodeError
+
+# registrations are kept in ZooKeeper as JSON
+import json
 
 # to avoid any warning about no handlers for logging purposes, we
 # do the following
 import logging
 
+# needed by the timer facility shared by the middleware event loops
+import heapq
+import itertools
+import math
+import random
+import time
+
+# the connection manager is also used from ZooKeeper watch threads
+import threading
+
+# the inbox of an event loop
+import os
+import collections
+
 def listener4state (state):
     if state == KazooState.LOST:
         print ("Current state is now = LOST")
@@ -40,6 +58,371 @@ def listener4state (state):
         print ("Current state now = UNKNOWN !! Cannot happen")
 
 
+##################################
+#       Registrations in ZooKeeper
+##################################
+# every registrant leaves an ephemeral znode of its own under one of these,
+# named after it and holding its whereabouts and topics in JSON. It goes
+# away with the registrant's session, so standby discovery instances learn
+# of arrivals and departures from ZooKeeper one at a time.
+REGISTRY_PUBS = "/registry/publishers"
+REGISTRY_SUBS = "/registry/subscribers"
+
+# every live publisher and subscriber has an ephemeral child of its own
+# under one of these. The count is the number of children, which stays
+# exact however many join or leave at once, or crash.
+MEMBERS_PUBS = "/numPubs"
+MEMBERS_SUBS = "/numSubs"
+
+# the candidates for leader queue up under these
+DISCOVERY_ELECTION = "/election/discovery"
+BROKER_ELECTION = "/election/broker"
+
+# the persistent znodes the above live under, laid out by zkadmin.py
+SCHEMA_PATHS = (REGISTRY_PUBS, REGISTRY_SUBS, MEMBERS_PUBS, MEMBERS_SUBS, DISCOVERY_ELECTION, BROKER_ELECTION)
+
+# publishers answer the gap-fill requests of a newly elected broker on
+# this port above the one they publish on
+GAPFILL_PORT_OFFSET = 1000
+
+# these all take the Coordinator of the process, which skips the writes
+# that would leave things as they are, e.g., when a request was resent
+def advertise_registration(coord, parent, name, addr, port, topiclist):
+    ''' create (or refresh) the ephemeral znode of a registrant '''
+    value = bytes(json.dumps({"addr": addr, "port": int(port), "topics": list(topiclist)}), "utf-8")
+    coord.put_ephemeral(parent + "/" + name, value)
+
+def withdraw_registration(coord, parent, name):
+    ''' remove the znode of a registrant '''
+    coord.delete(parent + "/" + name)
+
+def join_membership(coord, parent, name):
+    ''' count ourselves in '''
+    coord.put_ephemeral(parent + "/" + name)
+
+def sign_off(coord, name, *parents):
+    ''' withdraw our registration and membership at once '''
+    coord.delete_all([parent + "/" + name for parent in parents])
+
+
+##################################
+#       Endpoints
+##################################
+# our endpoints are TCP, except when all the entities run as threads of a
+# single process (see simulate.py). They then all share one ZMQ context
+# and talk over inproc endpoints instead, named after the address and port
+# the TCP ones would have, so that nothing else needs to tell them apart
+TRANSPORT = {"name": "tcp"}
+
+def use_inproc():
+    ''' have every endpoint from now on be inproc '''
+    TRANSPORT["name"] = "inproc"
+
+def endpoint(addr, port):
+    ''' the endpoint to connect to addr:port '''
+    return "{}://{}:{}".format(TRANSPORT["name"], addr, port)
+
+def bind_endpoint(addr, port):
+    ''' the endpoint to bind to in order to be reached at addr:port '''
+    if TRANSPORT["name"] == "inproc":
+        return endpoint(addr, port)
+    return "tcp://*:{}".format(port)  # on all of our interfaces
+
+def split_endpoint(endpoint):
+    ''' the (addr, port) an endpoint is made of '''
+    addr, port = endpoint.split("://", 1)[1].rsplit(":", 1)
+    return addr, int(port)
+
+
+##################################
+#       Timer facility
+##################################
+class TimerQueue():
+    """ A heap of one-shot timers serviced by a middleware event loop """
+
+    # returned by housekeeping callbacks, e.g., a resend of a request, that
+    # have no say in what the application wants the next timeout to be
+    KEEP = object()
+
+    ########################################
+    # constructor
+    ########################################
+    def __init__(self):
+        self.heap = []  # entries of the form [deadline, seq, callback, args]
+        self.counter = itertools.count()  # tie breaker so callbacks are never compared
+
+    ########################################
+    # arm a timer
+    #
+    # the callback is invoked from the event loop just like any other upcall
+    # and so its return value is the timeout for the next iteration of the poll.
+    # The returned entry is the handle used to cancel the timer.
+    ########################################
+    def schedule(self, delay, callback, *args):
+        ''' fire callback (*args) after delay seconds '''
+        entry = [time.monotonic() + delay, next(self.counter), callback, args]
+        heapq.heappush(self.heap, entry)
+        return entry
+
+    ########################################
+    # disarm a timer
+    #
+    # cancelled entries stay in the heap and are dropped once they surface
+    ########################################
+    def cancel(self, entry):
+        ''' cancel a previously scheduled timer '''
+        entry[2] = None
+
+    def discard_cancelled(self):
+        ''' drop cancelled timers sitting at the top of the heap '''
+        while self.heap and self.heap[0][2] is None:
+            heapq.heappop(self.heap)
+
+    ########################################
+    # combine the poll timeout (in msec) requested by the application
+    # with the earliest timer deadline
+    ########################################
+    def poll_timeout(self, timeout):
+        ''' timeout to hand to the poller '''
+        self.discard_cancelled()
+        if not self.heap:
+            return timeout
+
+        due = max(0, math.ceil((self.heap[0][0] - time.monotonic()) * 1000))
+        return due if timeout is None else min(timeout, due)
+
+    def expired(self):
+        ''' is the earliest timer due '''
+        self.discard_cancelled()
+        return bool(self.heap) and self.heap[0][0] <= time.monotonic()
+
+    ########################################
+    # fire all the timers that are due
+    #
+    # returns the timeout asked for by the last timer that fired, or the
+    # current one if none of them cared
+    ########################################
+    def run_expired(self, timeout=None):
+        ''' fire expired timers '''
+        now = time.monotonic()
+        while self.heap and self.heap[0][0] <= now:
+            deadline, seq, callback, args = heapq.heappop(self.heap)
+            if callback is not None:
+                result = callback(*args)
+                if result is not TimerQueue.KEEP:
+                    timeout = result
+
+        return timeout
+
+
+class Backoff():
+    """ Exponential backoff with jitter for retry timers """
+
+    def __init__(self, base=0.05, cap=2.0, factor=2.0):
+        self.base = base  # first delay in seconds
+        self.cap = cap  # we never wait longer than this
+        self.factor = factor  # growth of the delay per attempt
+        self.attempt = 0
+
+    def next_delay(self):
+        ''' delay in seconds before the next attempt '''
+        delay = min(self.cap, self.base * (self.factor ** self.attempt))
+        self.attempt += 1
+
+        # half of the delay is fixed and the other half random so that
+        # entities started together do not retry in lockstep
+        return random.uniform(delay / 2, delay)
+
+    def reset(self):
+        ''' start over after a success '''
+        self.attempt = 0
+
+
+##################################
+#       Inbox of an event loop
+##################################
+class Inbox():
+    """ Work posted to an event loop by other threads """
+
+    ########################################
+    # constructor
+    #
+    # ZooKeeper watches fire on kazoo's threads, but ZMQ sockets may only
+    # be used by the thread that owns them. So a watch posts its handler
+    # here and the event loop, which polls our fd along with its sockets,
+    # runs it. The queue is a deque, whose appends and pops need no lock,
+    # and a byte down a pipe wakes the loop up.
+    ########################################
+    def __init__(self):
+        self.queue = collections.deque()  # (callback, args) posted so far
+        self.fd, self.wakeup = os.pipe()  # the loop polls the read end
+        os.set_blocking(self.fd, False)
+        os.set_blocking(self.wakeup, False)
+
+    ########################################
+    # hand the event loop a callback, from any thread
+    ########################################
+    def post(self, callback, *args):
+        ''' have the event loop invoke callback (*args) '''
+        self.queue.append((callback, args))
+        try:
+            os.write(self.wakeup, b"\0")
+        except BlockingIOError:
+            pass  # the pipe is full of wake ups already
+
+    ########################################
+    # run what has been posted; called by the event loop when fd is readable
+    #
+    # we empty the pipe before the queue, so that whatever is posted while
+    # we are at it wakes the loop up once more
+    ########################################
+    def run(self):
+        ''' invoke the callbacks posted so far '''
+        try:
+            while os.read(self.fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+        while self.queue:
+            callback, args = self.queue.popleft()
+            callback(*args)
+
+
+##################################
+#       Connection manager
+##################################
+class ConnectionManager():
+    """ The endpoints a socket is connected to, kept in step with what is wanted """
+
+    ########################################
+    # constructor
+    #
+    # ZMQ happily connects a socket to the same endpoint twice, after
+    # which everything published there is delivered twice. So all the
+    # connects and disconnects of the socket go through us.
+    ########################################
+    def __init__(self, socket, logger=None, name="socket"):
+        self.socket = socket  # the ZMQ socket we manage
+        self.logger = logger  # internal logger for print statements
+        self.name = name  # what the socket is, for the logs
+        self.lock = threading.Lock()  # watches change the set from other threads
+        self.connected = set()  # endpoints the socket is connected to
+
+    ########################################
+    # the endpoint string for an address and port
+    ########################################
+    @staticmethod
+    def endpoint(addr, port):
+        ''' endpoint of addr:port '''
+        return endpoint(addr, port)
+
+    ########################################
+    # connect to an endpoint unless we already are
+    ########################################
+    def add(self, endpoint):
+        ''' connect to endpoint '''
+        return self.update(add=[endpoint])
+
+    ########################################
+    # disconnect from an endpoint if we are connected to it
+    ########################################
+    def remove(self, endpoint):
+        ''' disconnect from endpoint '''
+        return self.update(remove=[endpoint])
+
+    ########################################
+    # apply a diff to the connections
+    #
+    # with endpoints given we end up connected to exactly those, otherwise
+    # the ones in add are connected and those in remove disconnected.
+    # Returns the (added, removed) endpoints that made a difference.
+    ########################################
+    def update(self, endpoints=None, add=(), remove=()):
+        ''' connect and disconnect so as to match what is wanted '''
+
+        with self.lock:
+            if endpoints is not None:
+                wanted = set(endpoints)
+            else:
+                wanted = (self.connected | set(add)) - set(remove)
+
+            added = wanted - self.connected
+            removed = self.connected - wanted
+            for endpoint in removed:
+                self.socket.disconnect(endpoint)
+            for endpoint in added:
+                self.socket.connect(endpoint)
+            self.connected = wanted
+
+        if (added or removed) and self.logger:
+            self.logger.info("ConnectionManager::update - {} +{} -{}, fan-in now {}".format(
+                self.name, sorted(added), sorted(removed), len(wanted)))
+
+        return added, removed
+
+    ########################################
+    # number of endpoints the socket is connected to
+    ########################################
+    def fan_in(self):
+        ''' how many we are connected to '''
+        return len(self.connected)
+
+
+##################################
+#       Duplicate suppression
+##################################
+class DedupWindow():
+    """ Sequence numbers of one publisher seen lately, as a sliding bitmap """
+
+    ########################################
+    # constructor
+    #
+    # bit seq % size stands for seq as long as seq is one of the size
+    # latest, i.e., above top - size. The bitmap is allocated once and
+    # every check is a handful of integer operations; sliding forward
+    # clears each bit once, and a jump past the whole window clears them
+    # all in one copy.
+    ########################################
+    def __init__(self, size=1024):
+        self.size = (size + 7) // 8 * 8  # number of sequence numbers we remember
+        self.bits = bytearray(self.size // 8)  # the bitmap itself
+        self.zeros = bytes(self.size // 8)  # to clear it without allocating
+        self.top = -1  # highest sequence number seen so far
+
+    ########################################
+    # check a sequence number in
+    #
+    # returns True the first time we see seq and False for a duplicate.
+    # Anything that fell behind the window is taken as a duplicate too,
+    # since we can no longer tell.
+    ########################################
+    def accept(self, seq):
+        ''' is seq new to us '''
+
+        if seq > self.top:
+            # slide forward, forgetting what falls out of the window
+            if seq - self.top >= self.size:
+                self.bits[:] = self.zeros
+            else:
+                old = self.top + 1
+                while old <= seq:
+                    self.bits[(old % self.size) >> 3] &= ~(1 << (old & 7))
+                    old += 1
+            self.top = seq
+
+        elif seq <= self.top - self.size:
+            return False
+
+        idx = seq % self.size
+        mask = 1 << (idx & 7)
+        if self.bits[idx >> 3] & mask:
+            return False
+
+        self.bits[idx >> 3] |= mask
+        return True
+
+
 class ZK_Driver():
     """ The ZooKeeper Driver Class """
 
@@ -0,0 +1,301 @@
+###############################################
+#
+# Purpose: Our connection to ZooKeeper, with what is in there cached locally
+#
+# Created: Spring 2023
+#
+###############################################
+
+# This grew out of the ZK_Driver in Common.py. Every entity used to create a
+# KazooClient of its own and read a znode by first asking whether it exists
+# and then getting it, i.e., two round trips for every read.
+#
+# Instead, each process now has a single Coordinator. Its session is chrooted
+# to /cs6381, so all our paths, e.g., /curDiscovery, live under there, and a
+# TreeCache keeps a watched copy of that whole subtree in memory. Reads are
+# served from the copy without going to the server at all, watches are fed
+# from the changes the cache sees, and writes to the same znode in quick
+# succession are coalesced into one. In steady state, when nothing changes,
+# we send ZooKeeper nothing but the session pings.
+#
+# The entities use nothing but the methods of the Coordinator, i.e.,
+#   start, stop, add_listener        the session
+#   get, exists, children            reads
+#   watch_data, watch_children       watches
+#   ensure_path, put_ephemeral, set, delete, claim, delete_all
+#                                    writes
+#   election                         kazoo's Election recipe
+# so that LocalCoordination.py can stand in for ZooKeeper with the same
+# methods. make_coordinator picks one or the other given the hosts.
+
+import threading  # the cache is kept up to date from kazoo's threads
+import functools  # to post watch callbacks to an inbox
+
+from kazoo.client import KazooClient
+from kazoo.recipe.cache import TreeCache, TreeEvent
+from kazoo.exceptions import NodeExistsError, NoNodeError
+
+# everything of ours lives under here
+ROOT = "/cs6381"
+
+# zkadmin.py leaves the version of the layout of our subtree here. Bump it
+# whenever the layout changes in a way older entities would trip over
+SCHEMA = "/schema"
+SCHEMA_VERSION = 1
+
+# hosts of this name get the in-process stand-in rather than ZooKeeper,
+# e.g., -zka local
+LOCAL = "local"
+
+
+def make_coordinator(hosts, logger=None, timeout=10.0):
+    ''' a Coordinator for hosts, in-process if they are LOCAL '''
+    if hosts.split(":")[0] == LOCAL:
+        # imported here since it builds on the Coordinator below
+        from CS6381_MW.LocalCoordination import LocalCoordinator
+        return LocalCoordinator(hosts, logger, timeout=timeout)
+
+    return Coordinator(hosts, logger, timeout=timeout)
+
+
+class Coordinator():
+    """ A ZooKeeper session with our subtree cached locally """
+
+    ########################################
+    # constructor
+    ########################################
+    def __init__(self, hosts, logger=None, timeout=10.0, linger=0.05):
+        self.hosts = hosts + ROOT  # chrooted, so that our paths are relative to ROOT
+        self.logger = logger  # internal logger for print statements
+        self.timeout = timeout  # session timeout in seconds
+        self.linger = linger  # seconds we hold on to a write in case another one follows
+        self.zk = None  # the KazooClient
+        self.cache = None  # TreeCache of our subtree
+        self.initialized = threading.Event()  # set once the cache has been loaded
+        self.lock = threading.Lock()  # watches and writes come from several threads
+        self.data_watches = {}  # path -> callbacks taking the data of the znode
+        self.children_watches = {}  # path -> callbacks taking the names of its children
+        self.pending = {}  # path -> value of the writes not flushed yet
+        self.flusher = None  # timer flushing them
+
+    ########################################
+    # connect and load the cache
+    ########################################
+    def start(self):
+        ''' start the session and the cache '''
+
+        self.zk = KazooClient(self.hosts, timeout=self.timeout)
+        self.zk.start()
+
+        # on a fresh server this creates ROOT itself
+        self.zk.ensure_path("/")
+
+        self.cache = TreeCache(self.zk, "/")
+        self.cache.listen(self.dispatch)
+        self.cache.start()
+
+        if not self.initialized.wait(self.timeout) and self.logger:
+            self.logger.warning("Coordinator::start - cache not loaded after {} s".format(self.timeout))
+
+        # we get along without it since we create what we need as we go,
+        # but somebody forgot to run zkadmin.py
+        schema = self.get(SCHEMA)
+        if schema != bytes(str(SCHEMA_VERSION), "utf-8") and self.logger:
+            self.logger.warning("Coordinator::start - expected schema {}, found {}; run zkadmin.py".format(
+                SCHEMA_VERSION, None if schema is None else schema.decode("utf-8")))
+
+    ########################################
+    # flush what is pending and close the session
+    #
+    # closing the session drops our ephemeral znodes right away
+    ########################################
+    def stop(self):
+        ''' stop the cache and the session '''
+
+        self.flush()
+        self.cache.close()
+        self.zk.stop()
+        self.zk.close()
+
+    def add_listener(self, listener):
+        ''' call listener (state) whenever the session changes state '''
+        self.zk.add_listener(listener)
+
+    ########################################
+    # reads, all served from the cache
+    ########################################
+    def get(self, path):
+        ''' data of the znode at path, None if there is no such znode '''
+        node = self.cache.get_data(path)
+        return None if node is None else node.data
+
+    def exists(self, path):
+        ''' is there a znode at path '''
+        return self.cache.get_data(path) is not None
+
+    def children(self, path):
+        ''' names of the children of the znode at path '''
+        return sorted(self.cache.get_children(path, ()))
+
+    ########################################
+    # watches
+    #
+    # like kazoo's DataWatch and ChildrenWatch, the callback is invoked
+    # right away and then every time the znode, or the set of its children,
+    # changes. A DataWatch callback gets None once the znode is gone.
+    #
+    # given the Inbox of an event loop, the callback is posted there rather
+    # than invoked on whichever thread noticed the change, so that it may
+    # use the sockets of that loop
+    ########################################
+    def watch_data(self, path, callback, inbox=None):
+        ''' call callback (data) whenever the znode at path changes '''
+        if inbox is not None:
+            callback = functools.partial(inbox.post, callback)
+        with self.lock:
+            self.data_watches.setdefault(path, []).append(callback)
+        callback(self.get(path))
+
+    def watch_children(self, path, callback, inbox=None):
+        ''' call callback (children) whenever the children of path change '''
+        if inbox is not None:
+            callback = functools.partial(inbox.post, callback)
+        with self.lock:
+            self.children_watches.setdefault(path, []).append(callback)
+        callback(self.children(path))
+
+    # the cache tells us, on its own thread, what changed
+    def dispatch(self, event):
+        if event.event_type == TreeEvent.INITIALIZED:
+            self.initialized.set()
+            return
+
+        if event.event_type not in (TreeEvent.NODE_ADDED, TreeEvent.NODE_UPDATED, TreeEvent.NODE_REMOVED):
+            return
+
+        path = event.event_data.path
+        data = None if event.event_type == TreeEvent.NODE_REMOVED else event.event_data.data
+        parent = path.rsplit("/", 1)[0] or "/"
+        with self.lock:
+            data_watches = list(self.data_watches.get(path, ()))
+            children_watches = list(self.children_watches.get(parent, ()))
+
+        for callback in data_watches:
+            callback(data)
+
+        if event.event_type != TreeEvent.NODE_UPDATED and children_watches:
+            children = self.children(parent)
+            for callback in children_watches:
+                callback(children)
+
+    ########################################
+    # writes
+    ########################################
+    def ensure_path(self, path):
+        ''' create the persistent znode at path and its parents, if need be '''
+        if not self.exists(path):
+            self.zk.ensure_path(path)
+
+    def put_ephemeral(self, path, value=b""):
+        ''' have the ephemeral znode at path hold value '''
+
+        if self.get(path) == value:
+            return  # nothing to do, e.g., we ask again after a retry
+
+        try:
+            self.zk.create(path, value=value, ephemeral=True, makepath=True)
+        except NodeExistsError:
+            self.set(path, value)
+
+    def delete(self, path):
+        ''' remove the znode at path, if there is one '''
+        try:
+            self.zk.delete(path)
+        except NoNodeError:
+            pass
+
+    ########################################
+    # several writes as one
+    #
+    # ZooKeeper applies all the operations of a transaction or none of
+    # them, in a single round trip, so nobody ever sees half of them done.
+    # The versions we check against come from the cache; should it be
+    # behind, the transaction fails as a whole and we try again with what
+    # the server says.
+    ########################################
+    def claim(self, path, value):
+        ''' make the ephemeral znode at path ours, holding value '''
+
+        node = self.cache.get_data(path)
+        stat = None if node is None else node.stat
+        for attempt in range(2):
+            transaction = self.zk.transaction()
+            if stat is not None:
+                # one created by hand, since those of a leader go away with
+                # its session before the next one is elected. We remove just
+                # the one we know of, not one created since
+                transaction.delete(path, version=stat.version)
+            transaction.create(path, value, ephemeral=True)
+
+            results = transaction.commit()
+            failures = [result for result in results if isinstance(result, Exception)]
+            if not failures:
+                return
+
+            stat = self.zk.exists(path)
+
+        raise failures[0]
+
+    def delete_all(self, paths):
+        ''' remove the znodes at paths, as far as there are any '''
+
+        paths = [path for path in paths if self.exists(path)]
+        if not paths:
+            return
+
+        transaction = self.zk.transaction()
+        for path in paths:
+            transaction.delete(path)
+
+        if any(isinstance(result, Exception) for result in transaction.commit()):
+            # some of them were gone already; the rest go one by one
+            for path in paths:
+                self.delete(path)
+
+    ########################################
+    # set the data of a znode
+    #
+    # the write goes out after linger seconds, by which time a burst of
+    # writes to the same znode has come down to the last of them. Values
+    # the znode holds already are not written at all.
+    ########################################
+    def set(self, path, value):
+        ''' write value to the znode at path '''
+        with self.lock:
+            self.pending[path] = value
+            if self.flusher is None:
+                self.flusher = threading.Timer(self.linger, self.flush)
+                self.flusher.daemon = True
+                self.flusher.start()
+
+    def flush(self):
+        ''' send the pending writes, all at once '''
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            if self.flusher is not None:
+                self.flusher.cancel()
+                self.flusher = None
+
+        results = [self.zk.set_async(path, value) for path, value in pending.items() if self.get(path) != value]
+        for result in results:
+            try:
+                result.get(timeout=self.timeout)
+            except NoNodeError:
+                pass  # gone in the meantime, e.g., with the session that created it
+
+    ########################################
+    # recipes
+    ########################################
+    def election(self, path, identifier=None):
+        ''' an election among the candidates queuing up under path '''
+        return self.zk.Election(path, identifier)
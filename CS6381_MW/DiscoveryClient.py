@@ -0,0 +1,180 @@
+###############################################
+#
+# Purpose: Client side of the conversation with the discovery service,
+# shared by the publisher, subscriber and broker middleware
+#
+# Created: Spring 2023
+#
+###############################################
+
+# The middleware objects used to talk to discovery over a REQ socket. REQ allows
+# only one outstanding request and, if discovery dies before replying, the socket
+# is stuck for good since it will neither send nor receive anything else.
+#
+# Here we use a DEALER socket instead. Every request carries an id in its own frame
+# which discovery echoes back in the reply, so several requests may be in flight
+# and a reply is matched to its request regardless of the order they come back in.
+# A request that is not answered in time is sent again, after having looked up
+# who the discovery leader now is, and a reply to a request that is no longer
+# outstanding (e.g., one that crossed paths with its resend) is simply dropped.
+
+import itertools
+import struct
+import zmq  # ZMQ sockets
+
+from CS6381_MW.Common import TimerQueue
+from CS6381_MW.Common import Backoff
+
+
+class DiscoveryClient():
+    """ Pipelined requests to the discovery service with timeouts and resends """
+
+    ########################################
+    # constructor
+    #
+    # the poller and timers are those of the middleware event loop that
+    # services us. locate, when given, is called to find the endpoint of
+    # the current discovery leader whenever a request times out.
+    ########################################
+    def __init__(self, logger, poller, timers, timeout=2.0, locate=None):
+        self.logger = logger  # internal logger for print statements
+        self.poller = poller  # we register our socket with it
+        self.timers = timers  # arms the per request timeouts
+        self.timeout = timeout  # seconds to wait for a reply before resending
+        self.locate = locate  # finds the endpoint of the discovery leader
+        self.socket = None  # will be a ZMQ DEALER socket
+        self.endpoint = None  # the discovery service we are connected to
+        self.ids = itertools.count(1)  # request ids
+        self.pending = {}  # request id -> [msg type, frames, timer, backoff]
+
+    ########################################
+    # connect to the discovery service
+    ########################################
+    def connect(self, context, endpoint):
+        ''' create the DEALER socket and connect it to discovery '''
+
+        self.logger.debug("DiscoveryClient::connect - {}".format(endpoint))
+        self.socket = context.socket(zmq.DEALER)
+        self.socket.setsockopt(zmq.LINGER, 0)  # nothing to flush when we go away
+        self.poller.register(self.socket, zmq.POLLIN)
+        self.endpoint = endpoint
+        self.socket.connect(endpoint)
+
+    ########################################
+    # move to another discovery service
+    #
+    # everything still outstanding is sent again to the new one
+    ########################################
+    def reconnect(self, endpoint):
+        ''' switch over to a new discovery leader '''
+
+        if endpoint == self.endpoint:
+            return
+
+        self.logger.info("DiscoveryClient::reconnect - {} -> {}".format(self.endpoint, endpoint))
+        self.socket.disconnect(self.endpoint)
+        self.endpoint = endpoint
+        self.socket.connect(endpoint)
+
+        for reqid in list(self.pending):
+            self.resend(reqid)
+
+    ########################################
+    # send a request
+    #
+    # returns the request id. The reply is handed out by recv
+    ########################################
+    def send(self, disc_req):
+        ''' send a DiscoveryReq '''
+
+        reqid = next(self.ids)
+        frames = [b"", struct.pack("!Q", reqid), disc_req.SerializeToString()]
+        self.pending[reqid] = [disc_req.msg_type, frames, None, Backoff(base=self.timeout, cap=8 * self.timeout)]
+
+        self.logger.debug("DiscoveryClient::send - request {}".format(reqid))
+        self.socket.send_multipart(frames)
+        self.arm(reqid)
+        return reqid
+
+    ########################################
+    # receive a reply
+    #
+    # returns the serialized DiscoveryResp or None if the reply is of
+    # no interest anymore
+    ########################################
+    def recv(self):
+        ''' receive a reply and match it to its request '''
+
+        frames = self.socket.recv_multipart()
+        if len(frames) != 3:
+            self.logger.warning("DiscoveryClient::recv - malformed reply of {} frames".format(len(frames)))
+            return None
+
+        reqid = struct.unpack("!Q", frames[1])[0]
+        entry = self.pending.pop(reqid, None)
+        if entry is None:
+            self.logger.debug("DiscoveryClient::recv - dropping stale reply to request {}".format(reqid))
+            return None
+
+        self.timers.cancel(entry[2])
+        return frames[2]
+
+    ########################################
+    # is a request of the given type outstanding
+    ########################################
+    def outstanding(self, msg_type):
+        ''' any request of msg_type awaiting a reply '''
+        return any(entry[0] == msg_type for entry in self.pending.values())
+
+    ########################################
+    # give up on the outstanding requests of the given type
+    #
+    # any reply that still shows up for them is dropped
+    ########################################
+    def cancel(self, msg_type):
+        ''' forget about the requests of msg_type '''
+
+        for reqid, entry in list(self.pending.items()):
+            if entry[0] == msg_type:
+                self.timers.cancel(entry[2])
+                del self.pending[reqid]
+
+    ########################################
+    # arm the timeout of a request
+    ########################################
+    def arm(self, reqid):
+        entry = self.pending[reqid]
+        entry[2] = self.timers.schedule(entry[3].next_delay(), self.expire, reqid)
+
+    ########################################
+    # a request was not answered in time
+    #
+    # a timer callback and so it returns the timeout for the event loop,
+    # which it leaves alone
+    ########################################
+    def expire(self, reqid):
+        if reqid not in self.pending:
+            return TimerQueue.KEEP
+
+        self.logger.warning("DiscoveryClient::expire - no reply to request {} from {}".format(reqid, self.endpoint))
+
+        # discovery may have failed over in the meantime
+        endpoint = self.locate() if self.locate is not None else None
+
+        if endpoint and endpoint != self.endpoint:
+            self.reconnect(endpoint)  # resends everything outstanding
+        else:
+            self.resend(reqid)
+
+        return TimerQueue.KEEP
+
+    ########################################
+    # send an outstanding request once more under the same id
+    ########################################
+    def resend(self, reqid):
+        entry = self.pending[reqid]
+        self.timers.cancel(entry[2])
+
+        self.logger.debug("DiscoveryClient::resend - request {} to {}".format(reqid, self.endpoint))
+        self.socket.send_multipart(entry[1])
+        self.arm(reqid)
@@ -12,28 +12,45 @@
 # Designing the logic is left as an exercise for the student.
 #
 # The discovery service is a server. So at the middleware level, we will maintain
-# a REP socket binding it to the port on which we expect to receive requests.
+# a ROUTER socket binding it to the port on which we expect to receive requests.
 #
-# There will be a forever event loop waiting for requests. Each request will be parsed
-# and the application logic asked to handle the request. To that end, an upcall will need
-# to be made to the application logic.
+# There will be a forever event loop waiting for requests. Rather than handling them
+# one at a time, each request is handed over an inproc DEALER to a pool of worker
+# threads. A worker parses the request and asks the application logic to handle it.
+# To that end, an upcall will need to be made to the application logic, which must
+# therefore be safe to call from several workers at once.
 
 import zmq  # ZMQ sockets
 import sys
+import threading
 
 # import serialization logic
 from CS6381_MW import discovery_pb2
+from CS6381_MW.Common import endpoint, bind_endpoint, Inbox
 from kazoo.client import KazooClient
 
 
 class DiscoveryMW():
 
+    # ms a worker waits for a request before checking whether to stop
+    WORKER_POLL = 500
+
     ########################################
     # constructor
     ########################################
     def __init__(self, logger):
         self.logger = logger  # internal logger for print statements
-        self.rep = None  # will be a ZMQ REP socket to talk to Discovery service
+        self.router = None  # will be a ZMQ ROUTER socket on which clients reach us
+        self.backend = None  # will be an inproc DEALER socket feeding our workers
+        self.notify_pipe = None  # will be an inproc PULL socket collecting the workers' notifications
+        self.pub = None  # will be a ZMQ PUB socket on which we announce system events
+        self.context = None  # inproc endpoints only work within one context
+        self.num_workers = None  # size of the worker pool
+        self.workers = []  # the worker threads
+        self.local = threading.local()  # per worker sockets
+        self.inbox = Inbox()  # work posted to the event loop by other threads, e.g., ZooKeeper's
+        self.loop_thread = None  # the thread running our event loop, the only one to use pub
+        self.notify_endpoint = None  # advertised endpoint of our PUB socket
         self.poller = None  # used to wait on incoming replies
         self.addr = None  # our advertised IP address
         self.port = None  # port num where we are going to publish our topics
@@ -54,28 +71,53 @@ class DiscoveryMW():
 
             # First retrieve our advertised IP addr and the publication port num
             self.port = args.port
-            self.addr = "10.0.0.1:5555"
+            self.addr = args.addr
 
             # Next get the ZMQ context
             self.logger.debug("DiscoveryMW::configure - obtain ZMQ context")
-            context = zmq.Context()  # returns a singleton object
+            context = zmq.Context.instance()  # returns a singleton object
+            self.context = context
 
             # get the ZMQ poller object
             self.logger.debug("DiscoveryMW::configure - obtain the poller")
             self.poller = zmq.Poller()
 
-            # Now acquire the REP sockets
-            self.logger.debug("DiscoveryMW::configure - obtain REP socket")
-            self.rep = context.socket(zmq.REP)
-
-            bind_string = "tcp://*:" + str(self.port)
-            self.rep.bind(bind_string)
-
-            # Since are using the event loop approach, register the REQ socket for incoming events
+            # Now acquire the ROUTER socket. Unlike REP it does not force us to reply
+            # to one request before reading the next one.
+            self.logger.debug("DiscoveryMW::configure - obtain ROUTER socket")
+            self.router = context.socket(zmq.ROUTER)
+
+            bind_string = bind_endpoint(args.addr, self.port)
+            self.router.bind(bind_string)
+
+            # The workers connect to these inproc endpoints: one to receive requests
+            # and hand back replies, the other to hand us notifications since only
+            # our thread may touch the PUB socket
+            self.logger.debug("DiscoveryMW::configure - bind the inproc sockets for the workers")
+            self.num_workers = args.workers
+            self.backend = context.socket(zmq.DEALER)
+            self.backend.bind(self.inproc_endpoint("workers"))
+            self.notify_pipe = context.socket(zmq.PULL)
+            self.notify_pipe.bind(self.inproc_endpoint("notify"))
+
+            # The PUB socket lets entities wait for events such as the system being
+            # ready without polling us. Its whereabouts are handed out in our
+            # responses to the is ready request.
+            self.logger.debug("DiscoveryMW::configure - obtain and bind the notification PUB socket")
+            notify_port = args.notify_port if args.notify_port else self.port + 1000
+            self.pub = context.socket(zmq.PUB)
+            self.pub.bind(bind_endpoint(args.addr, notify_port))
+            self.notify_endpoint = endpoint(args.addr, notify_port)
+
+            # Since are using the event loop approach, register the ROUTER socket for incoming
+            # requests and the inproc sockets for what the workers send back.
             # Note that nothing ever will be received on the PUB socket and so it does not make
             # any sense to register it with the poller for an incoming message.
-            self.logger.debug("DiscoveryMW::configure - register the REQ socket for incoming replies")
-            self.poller.register(self.rep, zmq.POLLIN)
+            self.logger.debug("DiscoveryMW::configure - register the ROUTER and inproc sockets for incoming events")
+            self.poller.register(self.router, zmq.POLLIN)
+            self.poller.register(self.backend, zmq.POLLIN)
+            self.poller.register(self.notify_pipe, zmq.POLLIN)
+            self.poller.register(self.inbox.fd, zmq.POLLIN)
 
             print("DiscoveryMW::configure - saving the KazooClient object")
             self.zkIPAddr = args.zkIPAddr
@@ -93,37 +135,124 @@ class DiscoveryMW():
 
         try:
             self.logger.info("DiscoveryMW::event_loop - run the event loop")
+            self.loop_thread = threading.current_thread()
+
+            # start the worker pool that does the actual handling of requests
+            for idx in range(self.num_workers):
+                worker = threading.Thread(target=self.worker, args=(idx,), daemon=True)
+                worker.start()
+                self.workers.append(worker)
 
             # we are using a class variable called "handle_events" which is set to
             # True but can be set out of band to False in order to exit this forever
-            # loop
+            # loop. All we do here is shuttle messages, which never blocks for long.
 
             while self.handle_events:  # it starts with a True value
-                # poll for events. We give it an infinite timeout.
+                # poll for events. Nothing of ours is driven by a timeout
                 # The return value is a socket to event mask mapping
                 events = dict(self.poller.poll(timeout=timeout))
+                timeout = None
+
+                if self.router in events:
+                    # a request; the DEALER hands it to the next available worker.
+                    # The frames carry the client's identity so the reply finds its way back
+                    self.backend.send_multipart(self.router.recv_multipart())
 
-                timeout = self.handle_request()
+                if self.backend in events:
+                    # a worker's reply, routed back to the client by its identity frame
+                    self.router.send_multipart(self.backend.recv_multipart())
 
+                    # the request may have changed the registry. We are the only
+                    # thread to publish those changes so they go out in order
+                    self.upcall_obj.publish_changes()
 
+                if self.notify_pipe in events:
+                    # a notification raised by a worker
+                    self.pub.send_multipart(self.notify_pipe.recv_multipart())
+
+                if self.inbox.fd in events:
+                    # e.g., the registry changed by a ZooKeeper watch
+                    self.inbox.run()
 
             self.logger.info("DiscoveryMW::event_loop - out of the event loop")
 
+            # the workers close their sockets on their way out; then we close
+            # ours, so that nothing holds up terminating the context
+            for worker in self.workers:
+                worker.join(self.WORKER_POLL / 1000.0 * 2)
+            for sock in (self.router, self.backend, self.notify_pipe, self.pub):
+                sock.close(linger=0)
+
         except Exception as e:
             raise e
 
 
+    #################################################################
+    # the inproc endpoints between us and our workers
+    #
+    # named after us, since all the discovery instances of a simulation
+    # share one ZMQ context
+    ##################################################################
+    def inproc_endpoint(self, purpose):
+        return "inproc://discovery-{}-{}:{}".format(purpose, self.addr, self.port)
+
 
     #################################################################
-    # handle an incoming reply
+    # a worker of the pool
+    #
+    # each worker owns a REP socket, which strips and restores the routing
+    # envelope for us, and a PUSH socket to hand notifications to the event
+    # loop. It checks every WORKER_POLL ms whether it is to stop, and closes
+    # both on its way out.
     ##################################################################
-    def handle_request(self):
+    def worker(self, idx):
+        ''' handle requests handed to us by the event loop '''
+
+        self.local.rep = self.context.socket(zmq.REP)
+        self.local.rep.connect(self.inproc_endpoint("workers"))
+        self.local.push = self.context.socket(zmq.PUSH)
+        self.local.push.connect(self.inproc_endpoint("notify"))
+        self.logger.debug("DiscoveryMW::worker - worker {} started".format(idx))
 
         try:
-                self.logger.debug("DiscoveryMW::handle_request")
+            while self.handle_events:
+                if not self.local.rep.poll(self.WORKER_POLL):
+                    continue
+
+                # clients tag each request with an id in a frame of its own, which
+                # goes back with the reply so that they can match the two up
+                frames = self.local.rep.recv_multipart()
+                self.local.tag = frames[:-1]
+                bytesRcvd = frames[-1]
+                self.local.replied = False
+
+                try:
+                    self.handle_request(bytesRcvd)
+
+                except Exception as e:
+                    # keep the worker alive; the rest of the system is unaffected
+                    self.logger.exception("DiscoveryMW::worker - failed to handle request - {}".format(e))
+
+                if not self.local.replied:
+                    # the REP socket must reply before it can take the next request
+                    self.local.rep.send_multipart(self.local.tag + [discovery_pb2.DiscoveryResp().SerializeToString()])
+
+        except zmq.ContextTerminated:
+            pass  # the process is going away
+
+        finally:
+            self.local.rep.close(linger=0)
+            self.local.push.close(linger=0)
+            self.logger.debug("DiscoveryMW::worker - worker {} stopped".format(idx))
 
-                # let us first receive all the bytes
-                bytesRcvd = self.rep.recv()
+
+    #################################################################
+    # handle an incoming request (in a worker)
+    ##################################################################
+    def handle_request(self, bytesRcvd):
+
+        try:
+                self.logger.debug("DiscoveryMW::handle_request")
 
                 # now use protobuf to deserialize the bytes
                 disc_resp = discovery_pb2.DiscoveryReq()
@@ -145,11 +274,14 @@ class DiscoveryMW():
                     timeout = self.upcall_obj.isready_response(disc_resp.isready_req)
 
                 elif (disc_resp.msg_type == discovery_pb2.TYPE_LOOKUP_ALL_PUBS):
-                    timeout = self.upcall_obj.pubslookup_response(disc_resp.isready_req)
+                    timeout = self.upcall_obj.pubslookup_response(disc_resp.pubs_req)
 
                 elif (disc_resp.msg_type == discovery_pb2.TYPE_LOOKUP_PUB_BY_TOPIC):
                     timeout = self.upcall_obj.lookup_response(disc_resp.lookup_req)
 
+                elif (disc_resp.msg_type == discovery_pb2.TYPE_DEREGISTER):
+                    timeout = self.upcall_obj.deregister_request(disc_resp.deregister_req)
+
                 else:  # anything else is unrecognizable by this object
                     # raise an exception here
                     raise Exception("Unrecognized response message")
@@ -162,9 +294,47 @@ class DiscoveryMW():
     # handle an outgoing response
     ##################################################################
     def handle_response(self, resp):
+        self.handle_serialized_response(resp.SerializeToString())
+
+    # for a response serialized already, e.g., one taken from a cache
+    def handle_serialized_response(self, buf2send):
+        # just the size; formatting the whole of a large response costs as
+        # much as building it, whether or not the message is logged
+        self.logger.debug("DiscoveryMW::handle_serialized_response - {} bytes".format(len(buf2send)))
+        self.local.rep.send_multipart(self.local.tag + [buf2send])  # reply on the socket of the worker handling the request
+        self.local.replied = True
+
+
+    #################################################################
+    # publish a notification to everyone listening on our PUB socket
+    #
+    # the key is the subscription prefix, e.g., "ready" for the
+    # announcement that the system is ready
+    ##################################################################
+    def notify(self, key, resp):
         buf2send = resp.SerializeToString()
-        self.logger.info("Stringified serialized buf = {}".format(buf2send))
-        self.rep.send(buf2send)  # we use the "send" method of ZMQ that sends the bytes
+        self.logger.debug("DiscoveryMW::notify - {}".format(key))
+
+        # workers go through the event loop; anyone else owns no sockets of
+        # its own and so must be on the event loop thread already, e.g., by
+        # having posted to our inbox
+        sock = getattr(self.local, "push", None)
+        if sock is None:
+            if threading.current_thread() is not self.loop_thread:
+                raise Exception("DiscoveryMW::notify - called off the event loop thread")
+            sock = self.pub
+        sock.send_multipart([bytes(key, "utf-8"), buf2send])
+
+
+    #################################################################
+    # let the event loop know that the registry changed outside of a
+    # request, so that it publishes the change
+    #
+    # may be called from any thread, e.g., one of ZooKeeper's; the event
+    # loop picks it up from our inbox, so no socket of ours leaves it
+    ##################################################################
+    def registry_changed(self):
+        self.inbox.post(self.upcall_obj.publish_changes)
 
 
     ########################################
@@ -186,3 +356,4 @@ class DiscoveryMW():
     def disable_event_loop(self):
         ''' disable event loop '''
         self.handle_events = False
+        self.inbox.post(lambda: None)  # wake it up to find out
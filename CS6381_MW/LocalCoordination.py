@@ -0,0 +1,333 @@
+###############################################
+#
+# Purpose: An in-process stand-in for ZooKeeper behind the Coordinator
+# interface
+#
+# Created: Spring 2023
+#
+###############################################
+
+# Everything that uses ZooKeeper does so through a Coordinator (see
+# Coordination.py). A LocalCoordinator offers the very same methods, but the
+# znodes live in a LocalEnsemble in the memory of the process instead of on
+# a ZooKeeper server. All the LocalCoordinators of a process given the same
+# hosts share one ensemble, so that entities run as threads of a single
+# process, e.g., for tests and benchmarks, see each other's znodes and
+# elect their leaders among themselves without a server to start first.
+#
+# The semantics follow ZooKeeper where we rely on them:
+#  - ephemeral znodes go away with the session, i.e., when stop is called
+#  - sequential znodes get a 10 digit sequence number appended, increasing
+#    per parent
+#  - multi-znode writes (claim, delete_all) are applied all or nothing
+#  - the watches are fed the same TreeCache events a Coordinator sees, on a
+#    thread of the ensemble rather than that of the writer, one at a time
+#    and in the order of the writes
+#
+# Sessions never get lost here, so the listeners added are never called.
+
+import threading  # the ensemble is shared by the threads of the process
+import queue  # hands the events to the thread that delivers them
+import itertools  # session ids
+import uuid  # names of the election candidates, as kazoo makes them
+
+from kazoo.recipe.cache import TreeEvent, NodeData
+from kazoo.exceptions import NodeExistsError, NoNodeError, BadVersionError, NotEmptyError
+from kazoo.exceptions import NoChildrenForEphemeralsError
+
+from CS6381_MW.Coordination import Coordinator
+
+
+class LocalEnsemble():
+    """ The znodes of the LocalCoordinators of a process """
+
+    ########################################
+    # constructor
+    ########################################
+    def __init__(self):
+        self.nodes = {"/": [b"", 0, None]}  # path -> [data, version, session owning it or None]
+        self.children = {"/": set()}  # path -> names of its children
+        self.sequences = {}  # path -> next sequence number of its children
+        self.sessions = itertools.count(1)  # session ids
+        self.members = {}  # session id -> its LocalCoordinator
+        self.changed = threading.Condition()  # guards all of the above; notified on every change
+        self.events = queue.Queue()  # (coordinators, event) to deliver
+        self.delivery = threading.Thread(target=self.deliver, daemon=True)
+        self.delivery.start()
+
+    ########################################
+    # sessions
+    ########################################
+    def join(self, coord):
+        ''' open a session for coord '''
+        with self.changed:
+            session = next(self.sessions)
+            self.members[session] = coord
+            return session
+
+    def leave(self, session):
+        ''' close the session, its ephemeral znodes go with it '''
+        with self.changed:
+            owned = [path for path, node in self.nodes.items() if node[2] == session]
+            for path in owned:
+                self.remove(path)
+            del self.members[session]
+
+    ########################################
+    # reads
+    ########################################
+    def get(self, path):
+        with self.changed:
+            node = self.nodes.get(path)
+            return None if node is None else node[0]
+
+    def version(self, path):
+        with self.changed:
+            node = self.nodes.get(path)
+            return None if node is None else node[1]
+
+    def get_children(self, path):
+        with self.changed:
+            return sorted(self.children.get(path, ()))
+
+    ########################################
+    # writes
+    #
+    # the callers hold changed, so that several of these may be applied
+    # as one
+    ########################################
+    def add(self, path, value=b"", session=None, sequence=False, makepath=False):
+        parent, name = path.rsplit("/", 1)
+        parent = parent or "/"
+        if parent not in self.nodes:
+            if not makepath:
+                raise NoNodeError(parent)
+            self.add(parent, makepath=True)
+
+        if self.nodes[parent][2] is not None:
+            raise NoChildrenForEphemeralsError(parent)
+
+        if sequence:
+            number = self.sequences.get(parent, 0)
+            self.sequences[parent] = number + 1
+            path, name = path + "{:010d}".format(number), name + "{:010d}".format(number)
+
+        if path in self.nodes:
+            raise NodeExistsError(path)
+
+        self.nodes[path] = [value, 0, session]
+        self.children[path] = set()
+        self.children[parent].add(name)
+        self.publish(TreeEvent.NODE_ADDED, path, value)
+        return path
+
+    def update(self, path, value, version=-1):
+        node = self.nodes.get(path)
+        if node is None:
+            raise NoNodeError(path)
+        if version != -1 and version != node[1]:
+            raise BadVersionError(path)
+
+        node[0], node[1] = value, node[1] + 1
+        self.publish(TreeEvent.NODE_UPDATED, path, value)
+
+    def remove(self, path, version=-1):
+        node = self.nodes.get(path)
+        if node is None:
+            raise NoNodeError(path)
+        if version != -1 and version != node[1]:
+            raise BadVersionError(path)
+        if self.children[path]:
+            raise NotEmptyError(path)
+
+        parent, name = path.rsplit("/", 1)
+        del self.nodes[path]
+        del self.children[path]
+        self.children[parent or "/"].discard(name)
+        self.publish(TreeEvent.NODE_REMOVED, path, None)
+
+    ########################################
+    # tell every coordinator, the way its TreeCache would
+    ########################################
+    def publish(self, event_type, path, value):
+        self.events.put((list(self.members.values()), TreeEvent.make(event_type, NodeData.make(path, value, None))))
+        self.changed.notify_all()
+
+    def deliver(self):
+        while True:
+            coords, event = self.events.get()
+            for coord in coords:
+                coord.dispatch(event)
+
+
+# the ensembles of this process, by hosts
+ensembles = {}
+ensembles_lock = threading.Lock()
+
+
+def ensemble(hosts):
+    ''' the ensemble shared by the coordinators given hosts '''
+    with ensembles_lock:
+        if hosts not in ensembles:
+            ensembles[hosts] = LocalEnsemble()
+        return ensembles[hosts]
+
+
+class LocalCoordinator(Coordinator):
+    """ A Coordinator whose znodes live in a LocalEnsemble """
+
+    ########################################
+    # constructor
+    ########################################
+    def __init__(self, hosts, logger=None, timeout=10.0, linger=0.05):
+        super().__init__(hosts, logger, timeout=timeout, linger=linger)
+        self.ensemble = ensemble(hosts)
+        self.session = None  # our session in the ensemble
+        self.listeners = []  # session state listeners, which never hear anything
+
+    ########################################
+    # the session
+    ########################################
+    def start(self):
+        ''' start the session, there is no cache to load '''
+        self.session = self.ensemble.join(self)
+        self.initialized.set()
+
+    def stop(self):
+        ''' close the session, which drops our ephemeral znodes right away '''
+        self.flush()
+        self.ensemble.leave(self.session)
+
+    def add_listener(self, listener):
+        ''' call listener (state) whenever the session changes state '''
+        self.listeners.append(listener)
+
+    ########################################
+    # reads
+    ########################################
+    def get(self, path):
+        ''' data of the znode at path, None if there is no such znode '''
+        return self.ensemble.get(path)
+
+    def exists(self, path):
+        ''' is there a znode at path '''
+        return self.ensemble.version(path) is not None
+
+    def children(self, path):
+        ''' names of the children of the znode at path '''
+        return self.ensemble.get_children(path)
+
+    ########################################
+    # writes
+    ########################################
+    def ensure_path(self, path):
+        ''' create the persistent znode at path and its parents, if need be '''
+        with self.ensemble.changed:
+            if path not in self.ensemble.nodes:
+                self.ensemble.add(path, makepath=True)
+
+    def put_ephemeral(self, path, value=b""):
+        ''' have the ephemeral znode at path hold value '''
+        with self.ensemble.changed:
+            if path not in self.ensemble.nodes:
+                self.ensemble.add(path, value, self.session, makepath=True)
+            elif self.ensemble.nodes[path][0] != value:
+                self.ensemble.update(path, value)
+
+    def delete(self, path):
+        ''' remove the znode at path, if there is one '''
+        with self.ensemble.changed:
+            if path in self.ensemble.nodes:
+                self.ensemble.remove(path)
+
+    def claim(self, path, value):
+        ''' make the ephemeral znode at path ours, holding value '''
+        with self.ensemble.changed:
+            if path in self.ensemble.nodes:
+                self.ensemble.remove(path)
+            self.ensemble.add(path, value, self.session)
+
+    def delete_all(self, paths):
+        ''' remove the znodes at paths, as far as there are any '''
+        with self.ensemble.changed:
+            for path in paths:
+                if path in self.ensemble.nodes:
+                    self.ensemble.remove(path)
+
+    def flush(self):
+        ''' apply the pending writes '''
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            if self.flusher is not None:
+                self.flusher.cancel()
+                self.flusher = None
+
+        with self.ensemble.changed:
+            for path, value in pending.items():
+                if path in self.ensemble.nodes and self.ensemble.nodes[path][0] != value:
+                    self.ensemble.update(path, value)
+
+    ########################################
+    # recipes
+    ########################################
+    def election(self, path, identifier=None):
+        ''' an election among the candidates queuing up under path '''
+        return LocalElection(self, path, identifier)
+
+
+class LocalElection():
+    """ kazoo's Election, with candidates queuing up in a LocalEnsemble """
+
+    ########################################
+    # constructor
+    ########################################
+    def __init__(self, coord, path, identifier=None):
+        self.coord = coord  # whose session the candidate belongs to
+        self.path = path  # where the candidates queue up
+        self.identifier = bytes(identifier or "", "utf-8")  # what contenders reports for us
+        self.prefix = uuid.uuid4().hex + "__lock__"  # named like kazoo's, so that they sort alike
+        self.cancelled = False
+
+    ########################################
+    # contend for the leadership
+    #
+    # blocks until cancelled or elected; when elected, func is called and
+    # we stand down once it returns
+    ########################################
+    def run(self, func, *args, **kwargs):
+        ''' call func once elected '''
+        ensemble = self.coord.ensemble
+        with ensemble.changed:
+            self.cancelled = False
+            self.coord.ensure_path(self.path)
+            node = ensemble.add(self.path + "/" + self.prefix, self.identifier, self.coord.session, sequence=True)
+
+            # we lead once ours is the first of the candidates
+            while not self.cancelled and node in ensemble.nodes and self.candidates()[0] != node:
+                ensemble.changed.wait()
+
+            if self.cancelled or node not in ensemble.nodes:
+                self.coord.delete(node)
+                return
+
+        try:
+            func(*args, **kwargs)
+        finally:
+            self.coord.delete(node)
+
+    def cancel(self):
+        ''' stop contending, unless we lead already '''
+        with self.coord.ensemble.changed:
+            self.cancelled = True
+            self.coord.ensemble.changed.notify_all()
+
+    def contenders(self):
+        ''' identifiers of the candidates, the leader first '''
+        ensemble = self.coord.ensemble
+        with ensemble.changed:
+            return [ensemble.nodes[node][0].decode("utf-8") for node in self.candidates()]
+
+    # paths of the candidates in the order of their sequence numbers
+    def candidates(self):
+        names = sorted(self.coord.children(self.path), key=lambda name: name[-10:])
+        return [self.path + "/" + name for name in names]
@@ -14,7 +14,7 @@
 # sockets and knows how to talk to Discovery service, etc.
 #
 # Here is what this middleware should do
-# (1) it must maintain the ZMQ sockets, one in the REQ role to talk to the Discovery service
+# (1) it must maintain the ZMQ sockets, one in the DEALER role to talk to the Discovery service
 # and one in the PUB role to disseminate topics
 # (2) It must, on behalf of the application logic, register the publisher application with the
 # discovery service. To that end, it must use the protobuf-generated serialization code to
@@ -27,12 +27,21 @@
 import os  # for OS functions
 import sys  # for syspath and system exception
 import time  # for sleep
+import json  # gap-fill requests
+import collections  # for the retransmit rings
 import logging  # for logging. Use it in place of print statements.
 import zmq  # ZMQ sockets
 
 # import serialization logic
 from CS6381_MW import discovery_pb2
 
+# timer facility shared by all the middleware event loops
+from CS6381_MW.Common import TimerQueue, GAPFILL_PORT_OFFSET, Inbox, bind_endpoint
+from CS6381_MW.Common import REGISTRY_PUBS, advertise_registration, withdraw_registration
+
+# our requests to the discovery service
+from CS6381_MW.DiscoveryClient import DiscoveryClient
+
 import time
 
 
@@ -50,18 +59,29 @@ class PublisherMW():
     ########################################
     def __init__(self, logger):
         self.logger = logger  # internal logger for print statements
-        self.req = None  # will be a ZMQ REQ socket to talk to Discovery service
+        self.disc = None  # will be a DiscoveryClient to talk to Discovery service
         self.pub = None  # will be a ZMQ PUB socket for dissemination
         self.poller = None  # used to wait on incoming replies
         self.topiclist = None
         self.addr = None  # our advertised IP address
-        self.port = None  # port num where we are going to publish our topics
+        self.port = None  # port num we advertise for our topics
+        self.bind_port = None  # port num we bind to, behind a proxy it is not the one we advertise
         self.upcall_obj = None  # handle to appln obj to handle appln-specific data
         self.handle_events = True  # in general we keep going thru the event loop
+        self.notify = None  # SUB socket on which the discovery service announces events
+        self.ready_announced = False  # has discovery announced that the system is ready
         self.zkIPAddr = None  # ZK server IP address
         self.zkPort = None  # ZK server port num
         self.zk = None
         self.curbindstring = None
+        self.notify_endpoint = None  # where the discovery service announces events
+        self.registration = None  # (name, topics) we last registered with
+        self.timers = TimerQueue()  # retries and periodic work without sleeping in the loop
+        self.inbox = Inbox()  # watch handlers posted to us from ZooKeeper's threads
+        self.seq = None  # sequence number of our next publication
+        self.gapfill = None  # will be a ZMQ ROUTER socket on which brokers ask for what they missed
+        self.retransmit = None  # number of publications kept per topic
+        self.rings = {}  # topic -> deque of the latest (seq, publication)
 
 
 
@@ -76,39 +96,45 @@ class PublisherMW():
             self.logger.info("PublisherMW::configure")
 
             # First retrieve our advertised IP addr and the publication port num
-            self.port = args.port
+            # Those reaching us through a proxy, e.g., impair.py, are told its port
+            self.bind_port = args.port
+            self.port = args.advertise_port if args.advertise_port else args.port
             self.addr = args.addr
 
+            # Subscribers drop the duplicates redundant brokers deliver by our
+            # sequence numbers. We start them off the clock so that, should we be
+            # restarted, ours keep going up rather than starting over at zero.
+            self.seq = int(time.time() * 1000) << 20
+            self.retransmit = args.retransmit
+
             # Next get the ZMQ context
             self.logger.debug("PublisherMW::configure - obtain ZMQ context")
-            context = zmq.Context()  # returns a singleton object
+            context = zmq.Context.instance()  # returns a singleton object
 
             # get the ZMQ poller object
             self.logger.debug("PublisherMW::configure - obtain the poller")
             self.poller = zmq.Poller()
 
-            # Now acquire the REQ and PUB sockets
-            # REQ is needed because we are the client of the Discovery service
-            # PUB is needed because we publish topic data
-            self.logger.debug("PublisherMW::configure - obtain REQ and PUB sockets")
-            self.req = context.socket(zmq.REQ)
+            # our inbox wakes us up when a watch has posted something
+            self.poller.register(self.inbox.fd, zmq.POLLIN)
+
+            # Now acquire the PUB socket, which is needed because we publish topic data.
+            # Our socket to the Discovery service, whose client we are, comes below
+            self.logger.debug("PublisherMW::configure - obtain PUB socket")
             self.pub = context.socket(zmq.PUB)
 
-            # Since are using the event loop approach, register the REQ socket for incoming events
+            # Now connect ourselves to the discovery service. Recall that the IP/port were
+            # supplied in our argument parsing. The discovery client registers its DEALER
+            # socket with our poller for incoming replies since we use the event loop approach.
             # Note that nothing ever will be received on the PUB socket and so it does not make
             # any sense to register it with the poller for an incoming message.
-            self.logger.debug("PublisherMW::configure - register the REQ socket for incoming replies")
-            self.poller.register(self.req, zmq.POLLIN)
-
-            # Now connect ourselves to the discovery service. Recall that the IP/port were
-            # supplied in our argument parsing. Best practices of ZQM suggest that the
-            # one who maintains the REQ socket should do the "connect"
             self.logger.debug("PublisherMW::configure - connect to Discovery service")
             # For our assignments we will use TCP. The connect string is made up of
             # tcp:// followed by IP addr:port number.
             self.curbindstring = bindstring
             connect_str = bindstring
-            self.req.connect(connect_str)
+            self.disc = DiscoveryClient(self.logger, self.poller, self.timers, locate=self.get_disc_value)
+            self.disc.connect(context, connect_str)
 
             # Since we are the publisher, the best practice as suggested in ZMQ is for us to
             # "bind" the PUB socket
@@ -116,9 +142,16 @@ class PublisherMW():
             # note that we publish on any interface hence the * followed by port number.
             # We always use TCP as the transport mechanism (at least for these assignments)
             # Since port is an integer, we convert it to string to make it part of the URL
-            bind_string = "tcp://*:" + str(self.port)
+            bind_string = bind_endpoint(self.addr, self.bind_port)
             self.pub.bind(bind_string)
 
+            # A broker that has just been elected asks us here for what it may
+            # have missed while the brokers switched over
+            self.logger.debug("PublisherMW::configure - bind the gap-fill ROUTER socket")
+            self.gapfill = context.socket(zmq.ROUTER)
+            self.gapfill.bind(bind_endpoint(self.addr, self.bind_port + GAPFILL_PORT_OFFSET))
+            self.poller.register(self.gapfill, zmq.POLLIN)
+
             self.logger.info("PublisherMW::configure - saving the KazooClient object")
             self.zkIPAddr = args.zkIPAddr
             self.zkPort = args.zkPort
@@ -137,12 +170,9 @@ class PublisherMW():
             # Now we are going to check if the znode that we just created
             # exists or not. Note that a watch can be set on create, exists
             # and get/set methods
-            if self.upcall_obj.zk.exists("/curDiscovery"):
-
-                # Now acquire the value and stats of that znode
-                # value,stat = self.zk.get (self.zkName, watch=self.watch)
-                value, stat = self.upcall_obj.zk.get("/curDiscovery")
-
+            # served from the cache of the Coordinator, without a round trip
+            value = self.upcall_obj.coord.get("/curDiscovery")
+            if value is not None:
                 ret = value.decode("utf-8")
                 return ret
 
@@ -155,15 +185,18 @@ class PublisherMW():
 
     def watch_znode_disc_change(self):
 
-        @self.upcall_obj.zk.DataWatch("/curDiscovery")
-        def dump_data_change(data, stat):
+        def dump_data_change(data):
             print("\n*********** Inside watch_znode_disc_change *********")
-            self.req.disconnect(self.curbindstring)
+            if data is None:
+                return  # no leader at the moment; wait for the next one
 
-            self.logger.info("PublisherMW::disc watch - connecting to new discovery")
-            new_disc_str = self.get_disc_value()
+            # posted to our event loop, so we switch over right away
+            self.logger.info("PublisherMW::disc watch - redirecting to new discovery")
+            new_disc_str = data.decode("utf-8")
             self.curbindstring = new_disc_str
-            self.req.connect(new_disc_str)
+            self.disc.reconnect(new_disc_str)
+
+        self.upcall_obj.coord.watch_data("/curDiscovery", dump_data_change, self.inbox)
 
 
 
@@ -179,28 +212,43 @@ class PublisherMW():
             # True but can be set out of band to False in order to exit this forever
             # loop
             while self.handle_events:  # it starts with a True value
-                # poll for events. We give it an infinite timeout.
+                # poll for events. We never wait past the earliest armed timer.
                 # The return value is a socket to event mask mapping
-                events = dict(self.poller.poll(timeout=timeout))
+                events = dict(self.poller.poll(timeout=self.timers.poll_timeout(timeout)))
 
                 # Unlike the previous starter code, here we are never returning from
                 # the event loop but handle everything in the same locus of control
                 # Notice, also that after handling the event, we retrieve a new value
                 # for timeout which is used in the next iteration of the poll
 
+                # a timer is due, e.g., a retry of the is ready request. It is
+                # handled like an upcall and tells us the next timeout to use.
+                # Any socket events are picked up in the next iteration.
+                if self.timers.expired():
+                    timeout = self.timers.run_expired(timeout)
+
                 # check if a timeout has occurred. We know this is the case when
                 # the event mask is empty
-                if not events:
+                elif not events:
                     # timeout has occurred so it is time for us to make appln-level
                     # method invocation. Make an upcall to the generic "invoke_operation"
                     # which takes action depending on what state the application
                     # object is in.
                     timeout = self.upcall_obj.invoke_operation()
 
-                elif self.req in events:  # this is the only socket on which we should be receiving replies
+                elif self.disc.socket in events:  # replies from the discovery service
 
                     # handle the incoming reply from remote entity and return the result
-                    timeout = self.handle_reply()
+                    timeout = self.handle_reply(timeout)
+
+                elif self.inbox.fd in events:  # a ZooKeeper watch fired
+                    self.inbox.run()
+
+                elif self.notify in events:  # an announcement from the discovery service
+                    timeout = self.handle_notification(timeout)
+
+                elif self.gapfill in events:  # a broker catching up
+                    self.handle_gapfill()
 
                 else:
                     raise Exception("Unknown event after poll")
@@ -214,13 +262,16 @@ class PublisherMW():
     #################################################################
     # handle an incoming reply
     #################################################################
-    def handle_reply(self):
+    def handle_reply(self, timeout):
 
         try:
             self.logger.info("PublisherMW::handle_reply")
 
             # let us first receive all the bytes
-            bytesRcvd = self.req.recv()
+            bytesRcvd = self.disc.recv()
+            if bytesRcvd is None:
+                # a late reply to a request that was already answered or given up
+                return timeout
 
             # now use protobuf to deserialize the bytes
             # The way to do this is to first allocate the space for the
@@ -236,12 +287,30 @@ class PublisherMW():
             # Note also that we expect the return value to be the desired timeout to use
             # in the next iteration of the poll.
             if (disc_resp.msg_type == discovery_pb2.TYPE_REGISTER):
+                if disc_resp.register_resp.status == discovery_pb2.STATUS_SUCCESS:
+                    self.advertise()
+
                 # let the appln level object decide what to do
                 timeout = self.upcall_obj.register_response(disc_resp.register_resp)
             elif (disc_resp.msg_type == discovery_pb2.TYPE_ISREADY):
                 # this is a response to is ready request
+                if self.ready_announced:
+                    # we went ahead on the announcement already, which
+                    # supersedes whatever this reply says
+                    return timeout
+                elif disc_resp.isready_resp.status == discovery_pb2.STATUS_FAILURE:
+                    # not ready yet; wait for discovery to announce it
+                    self.listen_for_ready(disc_resp.isready_resp.notify_endpoint)
+                else:
+                    # the go ahead; an announcement still on its way is old news
+                    self.mark_ready()
                 timeout = self.upcall_obj.isready_response(disc_resp.isready_resp)
 
+            elif (disc_resp.msg_type == discovery_pb2.TYPE_DEREGISTER):
+                # nothing for the application to do once we are gone
+                self.logger.info("PublisherMW::handle_reply - deregistered with status {}".format(disc_resp.deregister_resp.status))
+                timeout = None
+
             else:  # anything else is unrecognizable by this object
                 # raise an exception here
                 raise ValueError("Unrecognized response message")
@@ -302,6 +371,8 @@ class PublisherMW():
             disc_req.register_req.CopyFrom(register_req)
             self.logger.debug("PublisherMW::register - done building the outer message")
 
+            self.registration = (name, list(topiclist))
+
             # now let us stringify the buffer and print it. This is actually a sequence of bytes and not
             # a real string
             buf2send = disc_req.SerializeToString()
@@ -309,7 +380,7 @@ class PublisherMW():
 
             # now send this to our discovery service
             self.logger.debug("PublisherMW::register - send stringified buffer to Discovery service")
-            self.req.send(buf2send)  # we use the "send" method of ZMQ that sends the bytes
+            self.disc.send(disc_req)  # tagged with a request id, so others may be outstanding too
 
             # now go to our event loop to receive a response to this request
             self.logger.info("PublisherMW::register - sent register message and now now wait for reply")
@@ -319,6 +390,55 @@ class PublisherMW():
 
 
 
+    ########################################
+    # leave our registration in ZooKeeper
+    #
+    # as an ephemeral znode of our own, from which standby discovery
+    # instances learn about us. It goes away with us, even if we crash.
+    ########################################
+    def advertise(self):
+        ''' create the znode holding our registration '''
+
+        try:
+            if self.registration is None:
+                return  # deregistered in the meantime
+
+            name, topiclist = self.registration
+            self.logger.debug("PublisherMW::advertise - {}".format(name))
+            advertise_registration(self.upcall_obj.coord, REGISTRY_PUBS, name, self.addr, self.port, topiclist)
+
+        except Exception as e:
+            raise e
+
+
+    ########################################
+    # deregister from the discovery service
+    #
+    # e.g., when we are done, so that we are no longer handed out in lookups
+    ########################################
+    def deregister(self, name):
+        ''' deregister the appln with the discovery service '''
+
+        try:
+            self.logger.info("PublisherMW::deregister")
+
+            # our znode goes first so that no standby discovery brings us back
+            withdraw_registration(self.upcall_obj.coord, REGISTRY_PUBS, name)
+            self.registration = None
+
+            dereg_req = discovery_pb2.DeregisterReq()  # allocate
+            dereg_req.info.id = name  # our id is all discovery needs
+
+            disc_req = discovery_pb2.DiscoveryReq()  # allocate
+            disc_req.msg_type = discovery_pb2.TYPE_DEREGISTER  # set message type
+            disc_req.deregister_req.CopyFrom(dereg_req)
+
+            self.disc.send(disc_req)
+
+        except Exception as e:
+            raise e
+
+
     ########################################
     # check if the discovery service gives us a green signal to proceed
     #
@@ -361,7 +481,7 @@ class PublisherMW():
 
             # now send this to our discovery service
             self.logger.debug("PublisherMW::is_ready - send stringified buffer to Discovery service")
-            self.req.send(buf2send)  # we use the "send" method of ZMQ that sends the bytes
+            self.disc.send(disc_req)  # tagged with a request id, so others may be outstanding too
 
             # now go to our event loop to receive a response to this request
             self.logger.info("PublisherMW::is_ready - request sent and now wait for reply")
@@ -388,7 +508,16 @@ class PublisherMW():
 
             # Now use the protobuf logic to encode the info and send it.  But for now
             # we are simply sending the string to make sure dissemination is working.
-            send_str = topic + ":" + data + ":" + str(time.time()) + ":"+ str(self.addr)
+            # The header ends in who we are and our sequence number, so that
+            # subscribers can tell the same publication coming in twice.
+            send_str = topic + ":" + data + ":" + str(time.time()) + ":"+ str(self.addr) + ":" + str(id) + ":" + str(self.seq)
+
+            # kept around in case a broker taking over asks for it again
+            ring = self.rings.get(topic)
+            if ring is None:
+                ring = self.rings[topic] = collections.deque(maxlen=self.retransmit)
+            ring.append((self.seq, send_str))
+            self.seq += 1
             self.logger.info("PublisherMW::disseminate - {}".format(send_str))
 
             # send the info as bytes. See how we are providing an encoding of utf-8
@@ -398,6 +527,113 @@ class PublisherMW():
         except Exception as e:
             raise e
 
+    #################################################################
+    # answer a gap-fill request
+    #
+    # the request holds, by publisher name, the last sequence number the
+    # broker got from each. We send back whatever we still have after
+    # ours, oldest first; with nothing from us it gets all we have. What
+    # it had already is dropped by the subscribers.
+    #################################################################
+    def handle_gapfill(self):
+        ''' resend what a broker missed '''
+
+        try:
+            identity, bytesRcvd = self.gapfill.recv_multipart()
+            last_seen = json.loads(bytesRcvd)
+            since = last_seen.get(self.registration[0], -1) if self.registration else -1
+
+            missed = []
+            for ring in self.rings.values():
+                # each ring is in sequence order, so we stop at the first one seen
+                for seq, send_str in reversed(ring):
+                    if seq <= since:
+                        break
+                    missed.append((seq, send_str))
+            missed.sort()
+
+            self.logger.info("PublisherMW::handle_gapfill - resending {} publications after {}".format(len(missed), since))
+            frames = [bytes(send_str, "utf-8") for seq, send_str in missed]
+            self.gapfill.send_multipart([identity] + (frames if frames else [b""]))
+
+        except Exception as e:
+            raise e
+
+    #################################################################
+    # subscribe to the readiness announcement of the discovery service
+    #################################################################
+    def listen_for_ready(self, endpoint):
+        ''' connect to the notification socket of the discovery service '''
+
+        if self.notify is None:
+            self.notify = zmq.Context.instance().socket(zmq.SUB)
+            self.notify.setsockopt(zmq.SUBSCRIBE, b"ready")
+            self.poller.register(self.notify, zmq.POLLIN)
+
+        elif self.notify_endpoint != endpoint:
+            # a new discovery leader; stop listening to the old one
+            self.notify.disconnect(self.notify_endpoint)
+
+        else:
+            return
+
+        self.logger.info("PublisherMW::listen_for_ready - waiting on {}".format(endpoint))
+        self.notify_endpoint = endpoint
+        self.notify.connect(endpoint)
+
+    #################################################################
+    # the system is ready as far as we are concerned
+    #
+    # whichever of the is ready reply and the announcement tells us first
+    # is handed to the application; the other one is ignored
+    #################################################################
+    def mark_ready(self):
+        self.ready_announced = True
+        if self.notify is not None:
+            self.notify.setsockopt(zmq.UNSUBSCRIBE, b"ready")
+
+    #################################################################
+    # handle an announcement from the discovery service
+    #
+    # returns the timeout to use for the next poll, which stays what it
+    # was unless the announcement is handed to the application
+    #################################################################
+    def handle_notification(self, timeout):
+        ''' handle an incoming notification '''
+
+        try:
+            key, bytesRcvd = self.notify.recv_multipart()
+
+            disc_resp = discovery_pb2.DiscoveryResp()
+            disc_resp.ParseFromString(bytesRcvd)
+
+            if key == b"ready" and not self.ready_announced:
+                self.logger.info("PublisherMW::handle_notification - system is ready")
+                self.mark_ready()
+
+                # the announcement answers any is ready request of ours still out
+                self.disc.cancel(discovery_pb2.TYPE_ISREADY)
+                return self.upcall_obj.isready_response(disc_resp.isready_resp)
+
+            return timeout
+
+        except Exception as e:
+            raise e
+
+    ########################################
+    # arrange for invoke_operation to be upcalled after delay seconds
+    #
+    # used by the application instead of sleeping inside an upcall so that
+    # our sockets keep being serviced in the meantime
+    ########################################
+    def schedule_upcall(self, delay):
+        ''' schedule an upcall to invoke_operation '''
+        return self.timers.schedule(delay, self.upcall_obj.invoke_operation)
+
+    def cancel_upcall(self, entry):
+        ''' cancel an upcall scheduled earlier '''
+        self.timers.cancel(entry)
+
     ########################################
     # set upcall handle
     #
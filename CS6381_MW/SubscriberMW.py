@@ -18,7 +18,7 @@
 # the ZMQ sockets and knows how to talk to Discovery service, etc.
 #
 # Here is what this middleware should do
-# (1) it must maintain the ZMQ sockets, one in the REQ role to talk to the Discovery service
+# (1) it must maintain the ZMQ sockets, one in the DEALER role to talk to the Discovery service
 # and one in the SUB role to receive topic data
 # (2) It must, on behalf of the application logic, register the subscriber application with the
 # discovery service. To that end, it must use the protobuf-generated serialization code to
@@ -43,12 +43,20 @@ import logging # for logging. Use it in place of print statements.
 import zmq  # ZMQ sockets
 import time
 import json
+import random
 
 from copy import deepcopy
 
 # import serialization logic
 from CS6381_MW import discovery_pb2
 
+# timer facility shared by all the middleware event loops
+from CS6381_MW.Common import TimerQueue, ConnectionManager, DedupWindow, BROKER_ELECTION, Inbox
+from CS6381_MW.Common import REGISTRY_SUBS, advertise_registration, withdraw_registration
+
+# our requests to the discovery service
+from CS6381_MW.DiscoveryClient import DiscoveryClient
+
 class SubscriberMW():
 
     ########################################
@@ -57,27 +65,50 @@ class SubscriberMW():
     def __init__(self, logger):
         self.logger = logger  # internal logger for print statements
         self.sub = None  # will be a ZMQ SUB socket for accepting dissemination
-        self.req = None  # will be a ZMQ REQ socket to talk to Discovery service
+        self.disc = None  # will be a DiscoveryClient to talk to Discovery service
         self.poller = None  # used to wait on incoming replies
         self.addr = None  # our advertised IP address
         self.port = None  # port num where we are going to publish our topics
         self.upcall_obj = None  # handle to appln obj to handle appln-specific data
         self.handle_events = True  # in general we keep going thru the event loop
+        self.notify = None  # SUB socket on which the discovery service announces events
+        self.ready_announced = False  # has discovery announced that the system is ready
 
         # used to track logging statistics
         self.toggle = None
         self.iters = 0
         self.logging_dict = {}
         self.filename = None
+        self.quota = None  # publications we take in before concluding
 
         self.zkIPAddr = None
         self.zkPort = None
         self.zk = None
 
         self.curbindstring = None
+        self.notify_endpoint = None  # where the discovery service announces events
+        self.notify_keys = set()  # the announcements we are subscribed to
+        self.registration = None  # (name, topics) we last registered with
 
         self.accepting = False
 
+        self.lookup_version = None  # registry version up to which we know every change to our topics
+        self.topic_versions = {}  # topic -> registry version up to which we know every change to it
+        self.applied_version = None  # version of the last change we applied
+        self.catching_up = False  # looking up after having missed a change
+        self.publishers = None  # ConnectionManager of the endpoints our SUB socket is connected to
+        self.resync = None  # seconds between lookups catching up on missed changes
+        self.resync_timer = None  # the next such lookup
+        self.watching = False  # do we follow the registry changes
+
+        self.paths = 1  # number of brokers we receive through at once
+        self.dedup = None  # sequence numbers remembered per publisher
+        self.windows = {}  # publisher name -> DedupWindow of what we have seen from it
+        self.duplicates = 0  # publications dropped for having come in already
+
+        self.timers = TimerQueue()  # retries without sleeping in the event loop
+        self.inbox = Inbox()  # watch handlers posted to us from ZooKeeper's threads
+
 
     ########################################
     # configure/initialize
@@ -96,33 +127,43 @@ class SubscriberMW():
             # used for logging
             self.toggle = args.toggle
             self.filename = args.filename
+            self.quota = args.quota
+
+            self.resync = args.resync
+
+            self.paths = args.paths
+            self.dedup = args.dedup
 
             # Next get the ZMQ context
             self.logger.debug("SubcriberMW::configure - obtain ZMQ context")
-            context = zmq.Context()  # returns a singleton object
+            context = zmq.Context.instance()  # returns a singleton object
 
             # get the ZMQ poller object
             self.logger.debug("SubcriberMW::configure - obtain the poller")
             self.poller = zmq.Poller()
 
-            # Now acquire the REQ and PUB sockets
-            self.logger.debug("SubcriberMW::configure - obtain REQ and SUB sockets")
-            self.req = context.socket(zmq.REQ)
+            # our inbox wakes us up when a watch has posted something
+            self.poller.register(self.inbox.fd, zmq.POLLIN)
+
+            # Now acquire the SUB socket
+            self.logger.debug("SubcriberMW::configure - obtain SUB socket")
             self.sub = context.socket(zmq.SUB)
+            self.publishers = ConnectionManager(self.sub, self.logger, name="SUB")
 
-            # register the REQ socket for incoming events
-            self.logger.debug("SubcriberMW::configure - register the REQ/SUB sockets for incoming replies")
-            self.poller.register(self.req, zmq.POLLIN)
+            # register the SUB socket for incoming events
+            self.logger.debug("SubcriberMW::configure - register the SUB socket for incoming data")
             self.poller.register(self.sub, zmq.POLLIN)
 
             # Now connect ourselves to the discovery service. Recall that the IP/port were
-            # supplied in our argument parsing.
+            # supplied in our argument parsing. The discovery client registers its socket
+            # with our poller for incoming replies.
             self.logger.debug("SubcriberMW::configure - connect to Discovery service")
             # For these assignments we use TCP. The connect string is made up of
             # tcp:// followed by IP addr:port number.
             self.curbindstring = bindstring
             connect_str = bindstring
-            self.req.connect(connect_str)
+            self.disc = DiscoveryClient(self.logger, self.poller, self.timers, locate=self.get_disc_value)
+            self.disc.connect(context, connect_str)
 
             print("SubcriberMW::configure - saving the KazooClient object")
             self.zkIPAddr = args.zkIPAddr
@@ -139,12 +180,9 @@ class SubscriberMW():
             # Now we are going to check if the znode that we just created
             # exists or not. Note that a watch can be set on create, exists
             # and get/set methods
-            if self.upcall_obj.zk.exists("/curDiscovery"):
-
-                # Now acquire the value and stats of that znode
-                # value,stat = self.zk.get (self.zkName, watch=self.watch)
-                value, stat = self.upcall_obj.zk.get("/curDiscovery")
-
+            # served from the cache of the Coordinator, without a round trip
+            value = self.upcall_obj.coord.get("/curDiscovery")
+            if value is not None:
                 ret = value.decode("utf-8")
                 return ret
 
@@ -158,15 +196,18 @@ class SubscriberMW():
 
     def watch_znode_disc_change(self):
 
-        @self.upcall_obj.zk.DataWatch("/curDiscovery")
-        def dump_data_change(data, stat):
+        def dump_data_change(data):
             print("\n*********** Inside watch_znode_disc_change *********")
-            self.req.disconnect(self.curbindstring)
+            if data is None:
+                return  # no leader at the moment; wait for the next one
 
-            self.logger.info("BrokerMW::disc watch - connecting to new discovery")
-            new_disc_str = self.get_disc_value()
+            # posted to our event loop, so we switch over right away
+            self.logger.info("SubscriberMW::disc watch - redirecting to new discovery")
+            new_disc_str = data.decode("utf-8")
             self.curbindstring = new_disc_str
-            self.req.connect(new_disc_str)
+            self.disc.reconnect(new_disc_str)
+
+        self.upcall_obj.coord.watch_data("/curDiscovery", dump_data_change, self.inbox)
 
 
 
@@ -174,19 +215,56 @@ class SubscriberMW():
     def watch_znode_curbroker_change(self):
 
         try:
+            if self.paths > 1:
+                return self.watch_znode_brokers_change()
 
-            @self.upcall_obj.zk.DataWatch("/curbroker")
-            def dump_data_change(data, stat):
+            def dump_data_change(data):
                 print("\n*********** Inside watch_znode_disc_change *********")
-                #self.sub.disconnect("tcp://*:*")
+                if data is None:
+                    return  # no broker at the moment; wait for the next one
 
                 self.logger.info("SubscriberMW::disc watch - connecting to new broker")
-                value = self.upcall_obj.zk.get("/curbroker")[0]
 
-                ret = value.decode("utf-8")
+                ret = data.decode("utf-8")
                 arr = ret.split()
 
-                self.lookup_bind(arr[0], arr[1])
+                # the new broker replaces the old one rather than adding to it
+                self.lookup_update([(arr[0], arr[1])])
+
+            # the SUB socket is ours, so the handler runs in our event loop
+            self.upcall_obj.coord.watch_data("/curbroker", dump_data_change, self.inbox)
+
+        except Exception as e:
+            raise e
+
+
+    ########################################
+    # receive through several brokers at once
+    #
+    # the standby brokers forward everything too, so we connect to the
+    # leader and the first ones in line after it. Should the leader go,
+    # we are receiving through its successor already and lose nothing;
+    # what comes in twice is dropped by sequence number.
+    ########################################
+    def watch_znode_brokers_change(self):
+
+        try:
+
+            coord = self.upcall_obj.coord
+
+            def dump_children_change(children):
+                # in the order of the election, i.e., the leader first. The
+                # candidates' znodes end in their sequence number
+                contenders = []
+                for child in sorted(children, key=lambda child: child[-10:]):
+                    value = coord.get(BROKER_ELECTION + "/" + child)
+                    if value:
+                        contenders.append(value.decode("utf-8"))
+                self.logger.info("SubscriberMW::brokers watch - brokers {}".format(contenders))
+
+                self.lookup_update([c.split() for c in contenders[:self.paths]])
+
+            coord.watch_children(BROKER_ELECTION, dump_children_change, self.inbox)
 
         except Exception as e:
             raise e
@@ -216,6 +294,7 @@ class SubscriberMW():
             self.logger.debug("SubcriberMW::register - done populating the Registrant Info")
 
             self.topiclist = topiclist
+            self.registration = (name, list(topiclist))
 
             # Next build a RegisterReq message
             self.logger.debug("SubcriberMW::register - populate the nested register req")
@@ -247,7 +326,7 @@ class SubscriberMW():
 
             # now send this to our discovery service
             self.logger.debug("SubcriberMW::register - send stringified buffer to Discovery service")
-            self.req.send(buf2send)  # we use the "send" method of ZMQ that sends the bytes
+            self.disc.send(disc_req)  # tagged with a request id, so others may be outstanding too
 
             # now go to our event loop to receive a response to this request
             self.logger.debug("SubcriberMW::register - now wait for reply")
@@ -258,6 +337,55 @@ class SubscriberMW():
 
 
 
+    ########################################
+    # leave our registration in ZooKeeper
+    #
+    # as an ephemeral znode of our own, from which standby discovery
+    # instances learn about us. It goes away with us, even if we crash.
+    ########################################
+    def advertise(self):
+        ''' create the znode holding our registration '''
+
+        try:
+            if self.registration is None:
+                return  # deregistered in the meantime
+
+            name, topiclist = self.registration
+            self.logger.debug("SubscriberMW::advertise - {}".format(name))
+            advertise_registration(self.upcall_obj.coord, REGISTRY_SUBS, name, self.addr, self.port, topiclist)
+
+        except Exception as e:
+            raise e
+
+
+    ########################################
+    # deregister from the discovery service
+    #
+    # e.g., when we are done, so that we are no longer handed out in lookups
+    ########################################
+    def deregister(self, name):
+        ''' deregister the appln with the discovery service '''
+
+        try:
+            self.logger.info("SubscriberMW::deregister")
+
+            # our znode goes first so that no standby discovery brings us back
+            withdraw_registration(self.upcall_obj.coord, REGISTRY_SUBS, name)
+            self.registration = None
+
+            dereg_req = discovery_pb2.DeregisterReq()  # allocate
+            dereg_req.info.id = name  # our id is all discovery needs
+
+            disc_req = discovery_pb2.DiscoveryReq()  # allocate
+            disc_req.msg_type = discovery_pb2.TYPE_DEREGISTER  # set message type
+            disc_req.deregister_req.CopyFrom(dereg_req)
+
+            self.disc.send(disc_req)
+
+        except Exception as e:
+            raise e
+
+
     ########################################
     # check if the discovery service gives us a green signal to proceed
     ########################################
@@ -297,7 +425,7 @@ class SubscriberMW():
 
             # now send this to our discovery service
             self.logger.debug("SubcriberMW::is_ready - send stringified buffer to Discovery service")
-            self.req.send(buf2send)  # we use the "send" method of ZMQ that sends the bytes
+            self.disc.send(disc_req)  # tagged with a request id, so others may be outstanding too
 
 
             # now go to our event loop to receive a response to this request
@@ -316,6 +444,9 @@ class SubscriberMW():
             lookup_req = discovery_pb2.LookupPubByTopicReq()
 
             lookup_req.topiclist[:] = topiclist
+            if self.lookup_version is not None:
+                # we only need to hear what changed since our last lookup
+                lookup_req.since_version = self.lookup_version
 
             disc_req = discovery_pb2.DiscoveryReq()
             disc_req.lookup_req.CopyFrom(lookup_req)
@@ -329,7 +460,7 @@ class SubscriberMW():
 
             # now send this to our discovery service
             self.logger.debug("SubcriberMW::plz_lookup - send stringified buffer to Discovery service")
-            self.req.send(buf2send)  # we use the "send" method of ZMQ that sends the bytes
+            self.disc.send(disc_req)  # tagged with a request id, so others may be outstanding too
 
 
             # now go to our event loop to receive a response to this request
@@ -349,68 +480,113 @@ class SubscriberMW():
             self.logger.debug("SubscriberMW::event_loop - run the event loop")
 
             while self.handle_events:  #starts with True value
-                # poll for events. We give it an infinite timeout.
+                # poll for events. We never wait past the earliest armed timer.
                 # The return value is a socket to event mask mapping
-                events = dict(self.poller.poll(timeout=timeout))
+                events = dict(self.poller.poll(timeout=self.timers.poll_timeout(timeout)))
 
-                if not events:
+                # a timer is due, e.g., a retry of the is ready request. It is
+                # handled like an upcall and tells us the next timeout to use.
+                # Any socket events are picked up in the next iteration.
+                if self.timers.expired():
+                    timeout = self.timers.run_expired(timeout)
+
+                elif not events:
                     # timeout has occurred so it is time for us to make appln-level
                     # method invocation. Make an upcall to the generic "invoke_operation"
                     # which takes action depending on what state the application
                     # object is in.
                     timeout = self.upcall_obj.invoke_operation()
 
-                elif self.req in events:  # this is the only socket on which we should be receiving replies
+                elif self.disc.socket in events:  # replies from the discovery service
                     # handle the incoming reply and return the result
-                    timeout = self.handle_reply()
+                    timeout = self.handle_reply(timeout)
+
+                elif self.inbox.fd in events:  # a ZooKeeper watch fired
+                    self.inbox.run()
+
+                elif self.notify in events:  # an announcement from the discovery service
+                    timeout = self.handle_notification(timeout)
 
                 elif self.sub in events:
-                    message = self.sub.recv_string()
-                    arr = message.split(":")
+                    self.handle_publication(self.sub.recv_string())
+
+                    if self.iters == self.quota:
+                        self.dump_latencies()
+
+                        self.logger.info("SubscriberMW::quota reached - {} duplicates dropped - program will now conclude".format(self.duplicates))
+
+                        quit()
 
-                    print (arr[0], arr[1])
 
-                    end = str(time.time())
-                    tot = float(end) - float(arr[2])
+            self.logger.info("SubscriberMW::event_loop - out of the event loop")
 
-                    tot *= 1000  #convert to ms
+        except Exception as e:
+            raise e
 
-                    t = arr[0]
-                    if t not in self.logging_dict:
-                        self.logging_dict[t] = [tot]
-                    else:
-                        self.logging_dict[t].append(tot)
 
-                    self.iters += 1
 
-                    if self.iters == 200:
-                        json_object = json.dumps(self.logging_dict, indent=4)
+    ########################################
+    # take in a publication
+    #
+    # drops the duplicates and records the latency of the rest
+    ########################################
+    def handle_publication(self, message):
+        ''' handle a publication received on our SUB socket '''
 
-                        with open(self.filename, "w") as outfile:
-                            outfile.write(json_object)
+        arr = message.split(":")
 
-                        self.logger.info("SubscriberMW::quota reached - program will now conclude")
+        # the same publication may come in through more than one
+        # broker, or again from a broker that just took over
+        if len(arr) > 5:
+            window = self.windows.get(arr[4])
+            if window is None:
+                window = self.windows[arr[4]] = DedupWindow(self.dedup)
 
-                        quit()
+            if not window.accept(int(arr[5])):
+                self.duplicates += 1
+                return
 
+        print (arr[0], arr[1])
 
-            self.logger.info("SubscriberMW::event_loop - out of the event loop")
+        end = str(time.time())
+        tot = float(end) - float(arr[2])
 
-        except Exception as e:
-            raise e
+        tot *= 1000  #convert to ms
+
+        t = arr[0]
+        if t not in self.logging_dict:
+            self.logging_dict[t] = [tot]
+        else:
+            self.logging_dict[t].append(tot)
+
+        self.iters += 1
+
+
+    ########################################
+    # write the latencies so far, in ms by topic
+    ########################################
+    def dump_latencies(self):
+        ''' write the latencies to our file '''
+
+        json_object = json.dumps(self.logging_dict, indent=4)
 
+        with open(self.filename, "w") as outfile:
+            outfile.write(json_object)
 
 
     #################################################################
     # handle an incoming reply
     #################################################################
-    def handle_reply(self):
+    def handle_reply(self, timeout):
         ''' Handle an incoming reply '''
         try:
             self.logger.info("SubcriberMW::handle_reply")
 
             # let us first receive all the bytes
-            bytesRcvd = self.req.recv()
+            bytesRcvd = self.disc.recv()
+            if bytesRcvd is None:
+                # a late reply to a request that was already answered or given up
+                return timeout
 
             # now use protobuf to deserialize the bytes
             # The way to do this is to first allocate the space for the
@@ -426,15 +602,45 @@ class SubscriberMW():
             # Note also that we expect the return value to be the desired timeout to use
             # in the next iteration of the poll.
             if (disc_resp.msg_type == discovery_pb2.TYPE_REGISTER):
+                if disc_resp.register_resp.status == discovery_pb2.STATUS_SUCCESS:
+                    self.advertise()
+
                 # let the appln level object decide what to do
                 timeout = self.upcall_obj.register_response(disc_resp.register_resp)
 
             elif (disc_resp.msg_type == discovery_pb2.TYPE_ISREADY):
+                if disc_resp.isready_resp.HasField("notify_endpoint"):
+                    self.listen(disc_resp.isready_resp.notify_endpoint)
+
+                if self.ready_announced:
+                    # we went ahead on the announcement already, which
+                    # supersedes whatever this reply says
+                    return timeout
+                elif disc_resp.isready_resp.status == discovery_pb2.STATUS_FAILURE:
+                    # not ready yet; wait for discovery to announce it
+                    self.subscribe(b"ready")
+                else:
+                    # the go ahead; an announcement still on its way is old news
+                    self.mark_ready()
                 timeout = self.upcall_obj.isready_response(disc_resp.isready_resp)
 
             elif (disc_resp.msg_type == discovery_pb2.TYPE_LOOKUP_PUB_BY_TOPIC):
+                if disc_resp.lookup_resp.HasField("notify_endpoint"):
+                    # e.g., a new discovery leader, whose changes we follow from now on
+                    self.listen(disc_resp.lookup_resp.notify_endpoint)
+                version = disc_resp.lookup_resp.version or None
+                self.lookup_version = self.applied_version = version
+                self.topic_versions = {topic: version for topic in self.topiclist} if version else {}
+                self.catching_up = False
+                if self.watching:
+                    self.arm_resync(self.resync)
                 timeout = self.upcall_obj.lookup_response(disc_resp.lookup_resp)
 
+            elif (disc_resp.msg_type == discovery_pb2.TYPE_DEREGISTER):
+                # nothing for the application to do once we are gone
+                self.logger.info("SubscriberMW::handle_reply - deregistered with status {}".format(disc_resp.deregister_resp.status))
+                timeout = None
+
             else:  # anything else is unrecognizable by this object
                 # raise an exception here
                 raise ValueError("Unrecognized response message")
@@ -452,14 +658,192 @@ class SubscriberMW():
     def handle_response(self, resp):
         buf2send = resp.SerializeToString()
         self.logger.debug("Stringified serialized buf = {}".format(buf2send))
-        self.req.send(buf2send)  # we use the "send" method of ZMQ that sends the bytes
+        self.disc.send(resp)  # tagged with a request id, so others may be outstanding too
 
 
     #################################################################
     # handle a SUB socket binding to publishers
     ##################################################################
     def lookup_bind(self, addr, port):
-        self.sub.connect("tcp://{}:{}".format(addr, port))
+        # lookups may well hand out the same one again; we connect just once
+        self.publishers.add(ConnectionManager.endpoint(addr, port))
+
+    # stop receiving from a publisher that has gone away
+    def lookup_unbind(self, addr, port):
+        self.publishers.remove(ConnectionManager.endpoint(addr, port))
+
+    # be connected to just the given (addr, port) endpoints, e.g., after a full lookup
+    def lookup_update(self, endpoints):
+        self.publishers.update([ConnectionManager.endpoint(addr, port) for addr, port in endpoints])
+
+    # number of endpoints we receive from
+    def fan_in(self):
+        return self.publishers.fan_in()
+
+
+    #################################################################
+    # listen to the announcements of the discovery service
+    #################################################################
+    def listen(self, endpoint):
+        ''' connect to the notification socket of the discovery service '''
+
+        if self.notify is None:
+            self.notify = zmq.Context.instance().socket(zmq.SUB)
+            for key in self.notify_keys:  # asked for before we knew where to listen
+                self.notify.setsockopt(zmq.SUBSCRIBE, key)
+            self.poller.register(self.notify, zmq.POLLIN)
+
+        elif self.notify_endpoint != endpoint:
+            # a new discovery leader; stop listening to the old one
+            self.notify.disconnect(self.notify_endpoint)
+
+        else:
+            return
+
+        self.logger.info("SubscriberMW::listen - listening on {}".format(endpoint))
+        self.notify_endpoint = endpoint
+        self.notify.connect(endpoint)
+
+    # hear the announcements whose key starts with key
+    def subscribe(self, key):
+        if key not in self.notify_keys:
+            self.notify_keys.add(key)
+            if self.notify is not None:
+                self.notify.setsockopt(zmq.SUBSCRIBE, key)
+
+    # no longer hear them
+    def unsubscribe(self, key):
+        if key in self.notify_keys:
+            self.notify_keys.discard(key)
+            if self.notify is not None:
+                self.notify.setsockopt(zmq.UNSUBSCRIBE, key)
+
+    #################################################################
+    # follow the changes discovery makes to the publishers of our topics
+    #
+    # rather than looking up again whenever a publisher comes or goes, we
+    # apply the changes discovery pushes under "pub/<topic>/". Should we
+    # miss any, a lookup every resync seconds (or when discovery asks us
+    # to) catches up on them.
+    #################################################################
+    def watch_changes(self):
+        ''' subscribe to the registry changes for our topics '''
+
+        self.watching = True
+        for topic in self.topiclist:
+            self.subscribe(bytes("pub/" + topic + "/", "utf-8"))
+        self.subscribe(b"resync")
+
+    # apply a change to the registry pushed by discovery under topic
+    #
+    # we follow every topic on its own: a change whose predecessor under the
+    # topic we do not know of tells us we missed one, so we look up what
+    # changed since the last version we know all of instead
+    def apply_change(self, topic, change):
+        known = self.topic_versions.get(topic)
+        if known is None or change.version <= known:
+            return  # already part of what we know
+
+        if change.previous_in_topic > known:
+            if not self.catching_up:
+                self.logger.info("SubscriberMW::apply_change - missed changes to {} after {}".format(topic, known))
+                self.catching_up = True
+                self.plz_lookup(self.topiclist)
+            return
+
+        self.topic_versions[topic] = change.version
+        self.lookup_version = min(self.topic_versions.values())
+
+        if change.version <= self.applied_version:
+            return  # a copy under another of our topics, applied already
+
+        topics = set(self.topiclist)
+        old = (change.before.addr, change.before.port) if topics & set(change.before_topics) else None
+        new = (change.after.addr, change.after.port) if topics & set(change.after_topics) else None
+        if old != new:
+            self.logger.info("SubscriberMW::apply_change - {} -> {}".format(old, new))
+            if old is not None:
+                self.lookup_unbind(*old)
+            if new is not None:
+                self.lookup_bind(*new)
+
+        self.applied_version = change.version
+
+    # look up again after about delay seconds, jittered so that not everyone
+    # asks at the same time
+    def arm_resync(self, delay):
+        if self.resync_timer is not None:
+            self.timers.cancel(self.resync_timer)
+            self.resync_timer = None
+
+        if delay:
+            self.resync_timer = self.timers.schedule(random.uniform(0.5, 1.0) * delay, self.resync_lookup)
+
+    # a timer callback; the timeout of the event loop is left alone
+    def resync_lookup(self):
+        self.resync_timer = None
+        self.plz_lookup(self.topiclist)
+        return TimerQueue.KEEP
+
+    #################################################################
+    # the system is ready as far as we are concerned
+    #
+    # whichever of the is ready reply and the announcement tells us first
+    # is handed to the application; the other one is ignored
+    #################################################################
+    def mark_ready(self):
+        self.ready_announced = True
+        self.unsubscribe(b"ready")
+
+    #################################################################
+    # handle an announcement from the discovery service
+    #
+    # returns the timeout to use for the next poll, which stays what it
+    # was unless the announcement is handed to the application
+    #################################################################
+    def handle_notification(self, timeout):
+        ''' handle an incoming notification '''
+
+        try:
+            key, bytesRcvd = self.notify.recv_multipart()
+
+            disc_resp = discovery_pb2.DiscoveryResp()
+            disc_resp.ParseFromString(bytesRcvd)
+
+            if key == b"ready" and not self.ready_announced:
+                self.logger.info("SubscriberMW::handle_notification - system is ready")
+                self.mark_ready()
+
+                # the announcement answers any is ready request of ours still out
+                self.disc.cancel(discovery_pb2.TYPE_ISREADY)
+                return self.upcall_obj.isready_response(disc_resp.isready_resp)
+
+            elif key.startswith(b"pub/") and disc_resp.HasField("change"):
+                self.apply_change(key[len(b"pub/"):-1].decode("utf-8"), disc_resp.change)
+
+            elif key == b"resync":
+                # discovery lost track of its changes; look up again soon
+                self.logger.info("SubscriberMW::handle_notification - asked to resync")
+                self.arm_resync(1.0)
+
+            return timeout
+
+        except Exception as e:
+            raise e
+
+    ########################################
+    # arrange for invoke_operation to be upcalled after delay seconds
+    #
+    # used by the application instead of sleeping inside an upcall so that
+    # our sockets keep being serviced in the meantime
+    ########################################
+    def schedule_upcall(self, delay):
+        ''' schedule an upcall to invoke_operation '''
+        return self.timers.schedule(delay, self.upcall_obj.invoke_operation)
+
+    def cancel_upcall(self, entry):
+        ''' cancel an upcall scheduled earlier '''
+        self.timers.cancel(entry)
 
 
     ########################################
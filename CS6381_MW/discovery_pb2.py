@@ -13,19 +13,19 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0f\x64iscovery.proto\"T\n\x0eRegistrantInfo\x12\n\n\x02id\x18\x01 \x01(\t\x12\x11\n\x04\x61\x64\x64r\x18\x02 \x01(\tH\x00\x88\x01\x01\x12\x11\n\x04port\x18\x03 \x01(\rH\x01\x88\x01\x01\x42\x07\n\x05_addrB\x07\n\x05_port\"T\n\x0bRegisterReq\x12\x13\n\x04role\x18\x01 \x01(\x0e\x32\x05.Role\x12\x1d\n\x04info\x18\x02 \x01(\x0b\x32\x0f.RegistrantInfo\x12\x11\n\ttopiclist\x18\x03 \x03(\t\"G\n\x0cRegisterResp\x12\x17\n\x06status\x18\x01 \x01(\x0e\x32\x07.Status\x12\x13\n\x06reason\x18\x02 \x01(\tH\x00\x88\x01\x01\x42\t\n\x07_reason\"\x0c\n\nIsReadyReq\"&\n\x0bIsReadyResp\x12\x17\n\x06status\x18\x01 \x01(\x0e\x32\x07.Status\"\x11\n\x0fRegisterPubsReq\"2\n\x10RegisterPubsResp\x12\x1e\n\x05\x61rray\x18\x01 \x03(\x0b\x32\x0f.RegistrantInfo\"(\n\x13LookupPubByTopicReq\x12\x11\n\ttopiclist\x18\x01 \x03(\t\"O\n\x14LookupPubByTopicResp\x12\x1e\n\x05\x61rray\x18\x01 \x03(\x0b\x32\x0f.RegistrantInfo\x12\x17\n\x06status\x18\x02 \x01(\x0e\x32\x07.Status\"\xd2\x01\n\x0c\x44iscoveryReq\x12\x1b\n\x08msg_type\x18\x01 \x01(\x0e\x32\t.MsgTypes\x12$\n\x0cregister_req\x18\x02 \x01(\x0b\x32\x0c.RegisterReqH\x00\x12\"\n\x0bisready_req\x18\x03 \x01(\x0b\x32\x0b.IsReadyReqH\x00\x12*\n\nlookup_req\x18\x04 \x01(\x0b\x32\x14.LookupPubByTopicReqH\x00\x12$\n\x08pubs_req\x18\x05 \x01(\x0b\x32\x10.RegisterPubsReqH\x00\x42\t\n\x07\x43ontent\"\xdb\x01\n\rDiscoveryResp\x12\x1b\n\x08msg_type\x18\x01 \x01(\x0e\x32\t.MsgTypes\x12&\n\rregister_resp\x18\x02 \x01(\x0b\x32\r.RegisterRespH\x00\x12$\n\x0cisready_resp\x18\x03 \x01(\x0b\x32\x0c.IsReadyRespH\x00\x12,\n\x0blookup_resp\x18\x04 \x01(\x0b\x32\x15.LookupPubByTopicRespH\x00\x12&\n\tpubs_resp\x18\x05 \x01(\x0b\x32\x11.RegisterPubsRespH\x00\x42\t\n\x07\x43ontent*P\n\x04Role\x12\x10\n\x0cROLE_UNKNOWN\x10\x00\x12\x12\n\x0eROLE_PUBLISHER\x10\x01\x12\x13\n\x0fROLE_SUBSCRIBER\x10\x02\x12\r\n\tROLE_BOTH\x10\x03*\\\n\x06Status\x12\x12\n\x0eSTATUS_UNKNOWN\x10\x00\x12\x12\n\x0eSTATUS_SUCCESS\x10\x01\x12\x12\n\x0eSTATUS_FAILURE\x10\x02\x12\x16\n\x12STATUS_CHECK_AGAIN\x10\x03*y\n\x08MsgTypes\x12\x10\n\x0cTYPE_UNKNOWN\x10\x00\x12\x11\n\rTYPE_REGISTER\x10\x01\x12\x10\n\x0cTYPE_ISREADY\x10\x02\x12\x1c\n\x18TYPE_LOOKUP_PUB_BY_TOPIC\x10\x03\x12\x18\n\x14TYPE_LOOKUP_ALL_PUBS\x10\x04\x62\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0f\x64iscovery.proto\"T\n\x0eRegistrantInfo\x12\n\n\x02id\x18\x01 \x01(\t\x12\x11\n\x04\x61\x64\x64r\x18\x02 \x01(\tH\x00\x88\x01\x01\x12\x11\n\x04port\x18\x03 \x01(\rH\x01\x88\x01\x01\x42\x07\n\x05_addrB\x07\n\x05_port\"T\n\x0bRegisterReq\x12\x13\n\x04role\x18\x01 \x01(\x0e\x32\x05.Role\x12\x1d\n\x04info\x18\x02 \x01(\x0b\x32\x0f.RegistrantInfo\x12\x11\n\ttopiclist\x18\x03 \x03(\t\"G\n\x0cRegisterResp\x12\x17\n\x06status\x18\x01 \x01(\x0e\x32\x07.Status\x12\x13\n\x06reason\x18\x02 \x01(\tH\x00\x88\x01\x01\x42\t\n\x07_reason\"\x0c\n\nIsReadyReq\"X\n\x0bIsReadyResp\x12\x17\n\x06status\x18\x01 \x01(\x0e\x32\x07.Status\x12\x1c\n\x0fnotify_endpoint\x18\x02 \x01(\tH\x00\x88\x01\x01\x42\x12\n\x10_notify_endpoint\"?\n\x0fRegisterPubsReq\x12\x1a\n\rsince_version\x18\x01 \x01(\x04H\x00\x88\x01\x01\x42\x10\n\x0e_since_version\"\xa6\x01\n\x10RegisterPubsResp\x12\x1e\n\x05\x61rray\x18\x01 \x03(\x0b\x32\x0f.RegistrantInfo\x12\x0f\n\x07version\x18\x02 \x01(\x04\x12\r\n\x05\x64\x65lta\x18\x03 \x01(\x08\x12 \n\x07removed\x18\x04 \x03(\x0b\x32\x0f.RegistrantInfo\x12\x1c\n\x0fnotify_endpoint\x18\x05 \x01(\tH\x00\x88\x01\x01\x42\x12\n\x10_notify_endpoint\"V\n\x13LookupPubByTopicReq\x12\x11\n\ttopiclist\x18\x01 \x03(\t\x12\x1a\n\rsince_version\x18\x02 \x01(\x04H\x00\x88\x01\x01\x42\x10\n\x0e_since_version\"\xc3\x01\n\x14LookupPubByTopicResp\x12\x1e\n\x05\x61rray\x18\x01 \x03(\x0b\x32\x0f.RegistrantInfo\x12\x17\n\x06status\x18\x02 \x01(\x0e\x32\x07.Status\x12\x0f\n\x07version\x18\x03 \x01(\x04\x12\r\n\x05\x64\x65lta\x18\x04 \x01(\x08\x12 \n\x07removed\x18\x05 \x03(\x0b\x32\x0f.RegistrantInfo\x12\x1c\n\x0fnotify_endpoint\x18\x06 \x01(\tH\x00\x88\x01\x01\x42\x12\n\x10_notify_endpoint\".\n\rDeregisterReq\x12\x1d\n\x04info\x18\x01 \x01(\x0b\x32\x0f.RegistrantInfo\")\n\x0e\x44\x65registerResp\x12\x17\n\x06status\x18\x01 \x01(\x0e\x32\x07.Status\"\xdb\x01\n\x0eRegistryChange\x12\x0f\n\x07version\x18\x01 \x01(\x04\x12$\n\x06\x62\x65\x66ore\x18\x02 \x01(\x0b\x32\x0f.RegistrantInfoH\x00\x88\x01\x01\x12\x15\n\rbefore_topics\x18\x03 \x03(\t\x12#\n\x05\x61\x66ter\x18\x04 \x01(\x0b\x32\x0f.RegistrantInfoH\x01\x88\x01\x01\x12\x14\n\x0c\x61\x66ter_topics\x18\x05 \x03(\t\x12\x10\n\x08previous\x18\x06 \x01(\x04\x12\x19\n\x11previous_in_topic\x18\x07 \x01(\x04\x42\t\n\x07_beforeB\x08\n\x06_after\"\xfc\x01\n\x0c\x44iscoveryReq\x12\x1b\n\x08msg_type\x18\x01 \x01(\x0e\x32\t.MsgTypes\x12$\n\x0cregister_req\x18\x02 \x01(\x0b\x32\x0c.RegisterReqH\x00\x12\"\n\x0bisready_req\x18\x03 \x01(\x0b\x32\x0b.IsReadyReqH\x00\x12*\n\nlookup_req\x18\x04 \x01(\x0b\x32\x14.LookupPubByTopicReqH\x00\x12$\n\x08pubs_req\x18\x05 \x01(\x0b\x32\x10.RegisterPubsReqH\x00\x12(\n\x0e\x64\x65register_req\x18\x06 \x01(\x0b\x32\x0e.DeregisterReqH\x00\x42\t\n\x07\x43ontent\"\xaa\x02\n\rDiscoveryResp\x12\x1b\n\x08msg_type\x18\x01 \x01(\x0e\x32\t.MsgTypes\x12&\n\rregister_resp\x18\x02 \x01(\x0b\x32\r.RegisterRespH\x00\x12$\n\x0cisready_resp\x18\x03 \x01(\x0b\x32\x0c.IsReadyRespH\x00\x12,\n\x0blookup_resp\x18\x04 \x01(\x0b\x32\x15.LookupPubByTopicRespH\x00\x12&\n\tpubs_resp\x18\x05 \x01(\x0b\x32\x11.RegisterPubsRespH\x00\x12*\n\x0f\x64\x65register_resp\x18\x06 \x01(\x0b\x32\x0f.DeregisterRespH\x00\x12!\n\x06\x63hange\x18\x07 \x01(\x0b\x32\x0f.RegistryChangeH\x00\x42\t\n\x07\x43ontent*P\n\x04Role\x12\x10\n\x0cROLE_UNKNOWN\x10\x00\x12\x12\n\x0eROLE_PUBLISHER\x10\x01\x12\x13\n\x0fROLE_SUBSCRIBER\x10\x02\x12\r\n\tROLE_BOTH\x10\x03*\\\n\x06Status\x12\x12\n\x0eSTATUS_UNKNOWN\x10\x00\x12\x12\n\x0eSTATUS_SUCCESS\x10\x01\x12\x12\n\x0eSTATUS_FAILURE\x10\x02\x12\x16\n\x12STATUS_CHECK_AGAIN\x10\x03*\xa8\x01\n\x08MsgTypes\x12\x10\n\x0cTYPE_UNKNOWN\x10\x00\x12\x11\n\rTYPE_REGISTER\x10\x01\x12\x10\n\x0cTYPE_ISREADY\x10\x02\x12\x1c\n\x18TYPE_LOOKUP_PUB_BY_TOPIC\x10\x03\x12\x18\n\x14TYPE_LOOKUP_ALL_PUBS\x10\x04\x12\x13\n\x0fTYPE_DEREGISTER\x10\x05\x12\x18\n\x14TYPE_REGISTRY_CHANGE\x10\x06\x62\x06proto3')
 
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, globals())
 _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'discovery_pb2', globals())
 if _descriptor._USE_C_DESCRIPTORS == False:
 
   DESCRIPTOR._options = None
-  _ROLE._serialized_start=947
-  _ROLE._serialized_end=1027
-  _STATUS._serialized_start=1029
-  _STATUS._serialized_end=1121
-  _MSGTYPES._serialized_start=1123
-  _MSGTYPES._serialized_end=1244
+  _ROLE._serialized_start=1757
+  _ROLE._serialized_end=1837
+  _STATUS._serialized_start=1839
+  _STATUS._serialized_end=1931
+  _MSGTYPES._serialized_start=1934
+  _MSGTYPES._serialized_end=2102
   _REGISTRANTINFO._serialized_start=19
   _REGISTRANTINFO._serialized_end=103
   _REGISTERREQ._serialized_start=105
@@ -35,17 +35,23 @@ if _descriptor._USE_C_DESCRIPTORS == False:
   _ISREADYREQ._serialized_start=264
   _ISREADYREQ._serialized_end=276
   _ISREADYRESP._serialized_start=278
-  _ISREADYRESP._serialized_end=316
-  _REGISTERPUBSREQ._serialized_start=318
-  _REGISTERPUBSREQ._serialized_end=335
-  _REGISTERPUBSRESP._serialized_start=337
-  _REGISTERPUBSRESP._serialized_end=387
-  _LOOKUPPUBBYTOPICREQ._serialized_start=389
-  _LOOKUPPUBBYTOPICREQ._serialized_end=429
-  _LOOKUPPUBBYTOPICRESP._serialized_start=431
-  _LOOKUPPUBBYTOPICRESP._serialized_end=510
-  _DISCOVERYREQ._serialized_start=513
-  _DISCOVERYREQ._serialized_end=723
-  _DISCOVERYRESP._serialized_start=726
-  _DISCOVERYRESP._serialized_end=945
+  _ISREADYRESP._serialized_end=366
+  _REGISTERPUBSREQ._serialized_start=368
+  _REGISTERPUBSREQ._serialized_end=431
+  _REGISTERPUBSRESP._serialized_start=434
+  _REGISTERPUBSRESP._serialized_end=600
+  _LOOKUPPUBBYTOPICREQ._serialized_start=602
+  _LOOKUPPUBBYTOPICREQ._serialized_end=688
+  _LOOKUPPUBBYTOPICRESP._serialized_start=691
+  _LOOKUPPUBBYTOPICRESP._serialized_end=886
+  _DEREGISTERREQ._serialized_start=888
+  _DEREGISTERREQ._serialized_end=934
+  _DEREGISTERRESP._serialized_start=936
+  _DEREGISTERRESP._serialized_end=977
+  _REGISTRYCHANGE._serialized_start=980
+  _REGISTRYCHANGE._serialized_end=1199
+  _DISCOVERYREQ._serialized_start=1202
+  _DISCOVERYREQ._serialized_end=1454
+  _DISCOVERYRESP._serialized_start=1457
+  _DISCOVERYRESP._serialized_end=1755
 # @@protoc_insertion_point(module_scope)
@@ -37,18 +37,25 @@ import configparser  # for configuration parsing
 import logging  # for logging. Use it in place of print statements.
 import atexit
 import json
-import copy
 import ast
+import threading
 
 # Import our topic selector. Feel free to use alternate way to
 # get your topics of interest
 from topic_selector import TopicSelector
 
+# the registry of publishers and subscribers
+from registry import Registry
+from registry import ResponseCache
+
 # Now import our CS6381 Middleware
 from CS6381_MW.DiscoveryMW import DiscoveryMW
 # We also need the message formats to handle incoming responses.
 from CS6381_MW import discovery_pb2
-from kazoo.client import KazooClient
+from CS6381_MW.Common import REGISTRY_PUBS, REGISTRY_SUBS, DISCOVERY_ELECTION
+from CS6381_MW.Common import MEMBERS_PUBS, MEMBERS_SUBS, endpoint
+from CS6381_MW.Coordination import make_coordinator
+from kazoo.client import KazooState
 
 # import any other packages you need.
 from enum import Enum  # for an enumeration we are using to describe what state we are in
@@ -58,29 +65,38 @@ from enum import Enum  # for an enumeration we are using to describe what state
 class DiscoveryAppln():
 
     def __init__(self, logger):
-        self.pubs = None
-        self.subs = None
+        self.pubs = None  # publishers expected before we are ready
+        self.subs = None  # subscribers expected before we are ready
+        self.members_pubs = 0  # publishers currently counted in membership
+        self.members_subs = 0  # subscribers currently counted in membership
         self.mw_obj = None  # handle to the underlying Middleware object
         self.logger = logger  # internal logger for print statements
         self.lookup = None
         self.dissemination = None
-        self.hm = {}  #for pubs
-
-        self.hm2 = {} #for subs
-        self.cur_pubs = 0
-        self.cur_subs = 0
-        self.pubset = set()
+        # who registered for which topics. Requests are handled by several
+        # middleware workers at once and the registry is safe for that.
+        self.registry = Registry()
+        self.cache = ResponseCache()  # serialized lookup responses per registry version
+        self.published = self.registry.version  # registry version our change feed is at
+        self.feed_floor = self.published  # version the receivers of our feed must know of at least
+        self.last_pushed = {}  # topic -> version of the last change pushed under it, "" for any
+        self.lock = threading.Lock()  # guards our own state, e.g., announced
 
         self.broker_addr = None
         self.broker_port = None
 
         self.isready = None
+        self.announced = False  # have we announced that the system is ready
         self.zkIPAddr = None  # ZK server IP address
         self.zkPort = None  # ZK server port num
-        self.zk = None
+        self.coord = None  # our Coordinator, caching what is in ZooKeeper
 
         self.port = None
+        self.endpoint = None  # where clients reach us, advertised once we lead
 
+        self.election = None  # our candidacy among the discovery replicas
+        self.stepdown = threading.Event()  # set when we must stop leading
+        self.exiting = False
 
     def configure(self, args):
         ''' Initialize the object '''
@@ -99,10 +115,13 @@ class DiscoveryAppln():
             self.zkIPAddr = args.zkIPAddr
             self.zkPort = args.zkPort
             hosts = self.zkIPAddr + str (":") + str (self.zkPort)
-            self.zk = KazooClient(hosts)
-            self.zk.start()
+            # the session timeout bounds how long a dead leader goes unnoticed
+            self.coord = make_coordinator(hosts, self.logger, timeout=args.zkTimeout)
+            self.coord.start()
+            self.coord.add_listener(self.zk_state_change)
 
             self.port = args.port
+            self.endpoint = endpoint(args.addr, args.port)
 
             # Now, get the configuration object
             self.logger.debug("DiscoveryAppln::configure - parsing config.ini")
@@ -115,11 +134,8 @@ class DiscoveryAppln():
             self.watch_znode_subs_change()
             self.watch_znode_pubs_change()
 
-            if self.zk.exists("/curbroker"):
-
-                # Now acquire the value and stats of that znode
-                # value,stat = self.zk.get (self.zkName, watch=self.watch)
-                value, stat = self.zk.get("/curbroker")
+            value = self.coord.get("/curbroker")
+            if value is not None:
                 ret = value.decode("utf-8")
                 arr = ret.split()
 
@@ -134,15 +150,11 @@ class DiscoveryAppln():
             self.mw_obj = DiscoveryMW(self.logger)
             self.mw_obj.configure(args)  # pass remainder of the args to the m/w object
 
-            self.get_pubsccount_value()
-            self.get_subsccount_value()
-
-            self.watch_znode_hm_change()
-            self.watch_znode_hm2_change()
-            self.watch_znode_pubset_change()
+            self.watch_znode_registry(REGISTRY_PUBS, discovery_pb2.ROLE_PUBLISHER)
+            self.watch_znode_registry(REGISTRY_SUBS, discovery_pb2.ROLE_SUBSCRIBER)
             self.watch_znode_curbroker_change()
 
-            self.update_disclist()
+            self.start_election()
 
         except Exception as e:
             raise e
@@ -154,11 +166,8 @@ class DiscoveryAppln():
             # Now we are going to check if the znode that we just created
             # exists or not. Note that a watch can be set on create, exists
             # and get/set methods
-            if self.zk.exists("/curDiscovery"):
-
-                # Now acquire the value and stats of that znode
-                # value,stat = self.zk.get (self.zkName, watch=self.watch)
-                value, stat = self.zk.get("/curDiscovery")
+            value = self.coord.get("/curDiscovery")
+            if value is not None:
                 ret = value.decode("utf-8")
 
             else:
@@ -170,222 +179,170 @@ class DiscoveryAppln():
 
 
     def exitfunc(self):
-        self.leaderelection()
-
-        #update hashmaps
-        if self.zk.exists("/dischm"):
-            string = json.dumps(self.hm)
-            new_bytes = bytes(string, 'utf-8')
-            self.zk.set("/dischm", new_bytes)
-
-
-        if self.zk.exists("/dischm2"):
-            string = json.dumps(self.hm2)
-            new_bytes = bytes(string, 'utf-8')
-            self.zk.set("/dischm2", new_bytes)
-
-
-        if self.zk.exists("/curpubset"):
-            string = json.dumps(list(self.pubset))
-            new_bytes = bytes(string, 'utf-8')
-            self.zk.set("/curpubset", new_bytes)
-
-
+        # closing our session drops our election znode and /curDiscovery right
+        # away, so the next in line takes over without waiting for a timeout.
+        # There is nothing to save; the registrations live in ZooKeeper already
+        self.exiting = True
+        self.stepdown.set()
+        self.coord.stop()
 
         print ("Discovery has successfully ended")
 
 
 
-    def leaderelection(self):
-
-        try:
-
-            if self.zk.exists("/disclist"):
-
-                # Now acquire the value and stats of that znode
-                # value,stat = self.zk.get (self.zkName, watch=self.watch)
-                value = self.zk.get("/disclist")[0]
-                ret = value.decode("utf-8")
-
-                arr = ret.split()
-                arr.pop(0)
-
-                if arr:
-                    new_disc = arr[0]
-
-                    if self.zk.exists("/curDiscovery"):
-                        new_bytes = bytes(new_disc, 'utf-8')
-                        self.zk.set("/curDiscovery", new_bytes)
-
-                else:
-                    print("DiscoverAppln: LEADER ELECTION NOT AVAILABLE - not enough discoveries available")
-
-
-                listToStr = ' '.join([str(elem) for elem in arr])
-                new_bytes_list = bytes(listToStr, 'utf-8')
-                self.zk.set("/disclist", new_bytes_list)
-
-
-            else:
-                print("{} znode does not exist, why?".format("/curDiscovery"))
-
-        except Exception as e:
-            raise e
-
-
-    def update_disclist(self):
-
-        try:
-            # Now we are going to check if the znode that we just created
-            # exists or not. Note that a watch can be set on create, exists
-            # and get/set methods
-            if self.zk.exists("/disclist"):
-
-                # Now acquire the value and stats of that znode
-                # value,stat = self.zk.get (self.zkName, watch=self.watch)
-                value = self.zk.get("/disclist")[0]
-                value = value.decode("utf-8")
-
-                add = " tcp://" + "localhost" + ":" + str(self.port)
-                new_string = value + add
-
-                new_string = bytes(new_string, 'utf-8')
-                self.zk.set("/disclist", new_string)
-
-            else:
-                print("{} znode does not exist, why?".format("/curDiscovery"))
-
-        except Exception as e:
-            raise e
-
-
+    ########################################
+    # run for leader of the discovery replicas
+    #
+    # kazoo's election recipe queues every candidate up as an ephemeral
+    # sequential znode, each one watching just the one ahead of it. The
+    # winner advertises itself in the ephemeral /curDiscovery. Should the
+    # leader die, even by kill -9, both of its znodes go away when its
+    # session expires and the next in line takes over.
+    ########################################
+    def start_election(self):
+        ''' enter the election in the background '''
 
-    def get_pubsccount_value(self):
+        self.election = self.coord.election(DISCOVERY_ELECTION, self.endpoint)
+        threading.Thread(target=self.campaign, daemon=True).start()
 
-        try:
-            if self.zk.exists("/numPubs"):
 
-                # Now acquire the value and stats of that znode
-                # value,stat = self.zk.get (self.zkName, watch=self.watch)
-                value, stat = self.zk.get("/numPubs")
+    # stand for election until we exit; we lead for as long as lead runs
+    def campaign(self):
+        while not self.exiting:
+            try:
+                self.stepdown.clear()
+                self.election.run(self.lead)
 
-                ret = value.decode("utf-8")
-                return int(ret)
+            except Exception as e:
+                # e.g., no connection to ZooKeeper right now; try again shortly
+                self.logger.warning("DiscoveryAppln::campaign - {}".format(e))
+                time.sleep(1)
 
-            else:
-                print("{} znode does not exist, why?".format("/numPubs"))
 
-        except Exception as e:
-            raise e
+    def lead(self):
+        ''' what we do for as long as we are the leader '''
 
+        self.logger.info("DiscoveryAppln::lead - we are the leader, advertising {}".format(self.endpoint))
+        # replacing whatever is there in one step, so nobody looking sees it
+        # missing in between
+        self.coord.claim("/curDiscovery", bytes(self.endpoint, "utf-8"))
 
+        # nothing more to do; we serve requests whether leading or not
+        self.stepdown.wait()
+        self.logger.info("DiscoveryAppln::lead - stepping down")
 
-    def get_subsccount_value(self):
 
-        try:
-            if self.zk.exists("/numSubs"):
+    def zk_state_change(self, state):
+        if state == KazooState.LOST:
+            # our session and with it our znodes are gone, and someone
+            # else may well be leading by now; we stand again
+            self.logger.warning("DiscoveryAppln::zk_state_change - session lost")
+            self.stepdown.set()
 
-                # Now acquire the value and stats of that znode
-                # value,stat = self.zk.get (self.zkName, watch=self.watch)
-                value, stat = self.zk.get("/numSubs")
-
-                ret = value.decode("utf-8")
-                return int(ret)
-
-            else:
-                print("{} znode does not exist, why?".format("/numSubs"))
-
-        except Exception as e:
-            raise e
 
 
+    ########################################
+    # follow the number of publishers and subscribers
+    #
+    # each one is an ephemeral child of the membership znode, so a single
+    # children watch hands us the count with no reads of our own. These only
+    # count the live members; the readiness barrier stays at the numbers we
+    # were given, as subscribers join only once they are ready
+    ########################################
     def watch_znode_pubs_change(self):
 
-        @self.zk.DataWatch("/numPubs")
-        def dump_data_change(data, stat):
-            print("\n*********** Inside watch_znode_pubs_change *********")
-
-            self.logger.info("DiscoverMW::disc watch - changing number of publishers")
-            new_pubs = self.get_pubsccount_value()
-            self.pubs = new_pubs
-
+        self.coord.ensure_path(MEMBERS_PUBS)
 
-    def watch_znode_subs_change(self):
-
-        @self.zk.DataWatch("/numSubs")
-        def dump_data_change(data, stat):
-            print("\n*********** Inside watch_znode_subs_change *********")
-
-            self.logger.info("DiscoverMW::disc watch - changing number of subscribers")
-            new_subs = self.get_subsccount_value()
-            self.subs = new_subs
+        def dump_children_change(children):
+            self.logger.info("DiscoveryAppln::members watch - {} publishers".format(len(children)))
+            self.members_pubs = len(children)
 
+        self.coord.watch_children(MEMBERS_PUBS, dump_children_change)
 
-    def watch_znode_hm_change(self):
 
-        @self.zk.DataWatch("/dischm")
-        def dump_data_change(data, stat):
-            print("\n*********** Inside watch_znode_hm_change *********")
-
-            self.logger.info("DiscoverMW::disc watch - changing hm")
+    def watch_znode_subs_change(self):
 
-            if self.zk.exists("/dischm"):
-                value, stat = self.zk.get("/dischm")
-                ret = value.decode("utf-8")
+        self.coord.ensure_path(MEMBERS_SUBS)
 
-                temp = json.loads(ret)
+        def dump_children_change(children):
+            self.logger.info("DiscoveryAppln::members watch - {} subscribers".format(len(children)))
+            self.members_subs = len(children)
 
-                self.hm = copy.deepcopy(temp)
+        self.coord.watch_children(MEMBERS_SUBS, dump_children_change)
 
 
-    def watch_znode_hm2_change(self):
+    ########################################
+    # follow the registrations kept in ZooKeeper
+    #
+    # every registrant has an ephemeral znode of its own under parent. We
+    # watch the children for arrivals and each child for its contents, so
+    # a change costs the cache a single znode read rather than the whole
+    # registry, and a registrant that dies is dropped as soon as its session
+    # expires.
+    # The leader gets the same registrations in requests too, which the
+    # registry takes as duplicates.
+    ########################################
+    def watch_znode_registry(self, parent, role):
 
-        @self.zk.DataWatch("/dischm2")
-        def dump_data_change(data, stat):
-            print("\n*********** Inside watch_znode_hm2_change *********")
+        watched = set()  # children with a watch of their own
+        self.coord.ensure_path(parent)
 
-            self.logger.info("DiscoverMW::disc watch - changing hm2")
+        def children_change(children):
+            for name in children:
+                if name not in watched:
+                    watched.add(name)
+                    self.watch_znode_registrant(parent + "/" + name, name, role)
 
-            if self.zk.exists("/dischm2"):
-                value, stat = self.zk.get("/dischm2")
-                ret = value.decode("utf-8")
-                temp = json.loads(ret)
+        self.coord.watch_children(parent, children_change)
 
-                self.hm2 = copy.deepcopy(temp)
 
+    def watch_znode_registrant(self, path, name, role):
 
-    def watch_znode_pubset_change(self):
+        def dump_data_change(data):
 
-        @self.zk.DataWatch("/curpubset")
-        def dump_data_change(data, stat):
-            print("\n*********** Inside watch_znode_curpubset_change *********")
+            if data is None:
+                # gone, be it by deregistering or by dying; should it come
+                # back, the watch is still in place
+                self.logger.info("DiscoveryAppln::registry watch - {} is gone".format(name))
+                changed = self.registry.deregister(name)
 
-            self.logger.info("DiscoverMW::disc watch - changing curpubset")
+            else:
+                self.logger.info("DiscoveryAppln::registry watch - {} registered".format(name))
+                entry = json.loads(data.decode("utf-8"))
+                changed = self.registry.register(role, (name, entry["addr"], entry["port"]), entry["topics"])
 
-            if self.zk.exists("/curpubset"):
-                value, stat = self.zk.get("/curpubset")
-                ret = value.decode("utf-8")
-                temp = {tuple(inner_list) for inner_list in json.loads(ret)}
+            if changed:
+                # publishes the change to the subscribers, like a request would
+                self.mw_obj.registry_changed()
+                self.announce_ready()
 
-                self.pubset = copy.deepcopy(temp)
+        # announcing readiness takes our PUB socket, so the handler runs in
+        # our event loop rather than on the thread that noticed the change
+        self.coord.watch_data(path, dump_data_change, self.mw_obj.inbox)
 
 
     def watch_znode_curbroker_change(self):
 
-        @self.zk.DataWatch("/curbroker")
-        def dump_data_change(data, stat):
+        def dump_data_change(data):
             print("\n*********** Inside watch_znode_curpubset_change *********")
 
             self.logger.info("DiscoverMW::disc watch - changing curbroker")
 
-            if self.zk.exists("/curbroker"):
-                value, stat = self.zk.get("/curbroker")
-                ret = value.decode("utf-8")
+            if data is not None:
+                ret = data.decode("utf-8")
 
                 arr = ret.split()
                 self.broker_addr = arr[0]
                 self.broker_port = arr[1]
 
+            else:
+                # the leader is gone; until the next one claims the znode
+                # there is no broker to hand out
+                self.broker_addr = None
+                self.broker_port = None
+
+        self.coord.watch_data("/curbroker", dump_data_change)
+
 
     ########################################
     # driver program
@@ -434,41 +391,35 @@ class DiscoveryAppln():
 
             if register_req.role == discovery_pb2.ROLE_PUBLISHER:
 
-                for topic in register_req.topiclist:
-
-                    if topic not in self.hm:
-                        self.hm[topic] = [(register_req.info.id,register_req.info.addr,register_req.info.port)]
-                    else:
-                        self.hm[topic].append((register_req.info.id,register_req.info.addr,register_req.info.port))
-
-
-                    if (register_req.info.id,register_req.info.addr,register_req.info.port) not in self.pubset:
-                        self.pubset.add ( (register_req.info.id,register_req.info.addr,register_req.info.port) )
-
+                # a duplicate, e.g., a resent request, changes nothing
+                self.registry.register(register_req.role,
+                                       (register_req.info.id, register_req.info.addr, register_req.info.port),
+                                       register_req.topiclist)
 
                 ready_resp = discovery_pb2.RegisterResp()
                 ready_resp.status = discovery_pb2.STATUS_SUCCESS
 
-                self.mw_obj.handle_response(ready_resp)
-                self.cur_pubs += 1
+                discovery_resp = discovery_pb2.DiscoveryResp()
+                discovery_resp.register_resp.CopyFrom(ready_resp)
+                discovery_resp.msg_type = discovery_pb2.TYPE_REGISTER
 
+                self.mw_obj.handle_response(discovery_resp)
 
-            elif register_req.role == discovery_pb2.ROLE_SUBSCRIBER:
 
-                for topic in register_req.topiclist:
-                    if topic not in self.hm2:
-                        self.hm2[topic] = [(register_req.info.id, register_req.info.addr,
-                                           register_req.info.port)]
+            elif register_req.role == discovery_pb2.ROLE_SUBSCRIBER:
 
-                    else:
-                        self.hm2[topic].append((register_req.info.id, register_req.info.addr,
-                                               register_req.info.port))
+                self.registry.register(register_req.role,
+                                       (register_req.info.id, register_req.info.addr, register_req.info.port),
+                                       register_req.topiclist)
 
                 ready_resp = discovery_pb2.RegisterResp()
                 ready_resp.status = discovery_pb2.STATUS_SUCCESS
 
-                self.mw_obj.handle_response(ready_resp)
-                self.cur_subs += 1
+                discovery_resp = discovery_pb2.DiscoveryResp()
+                discovery_resp.register_resp.CopyFrom(ready_resp)
+                discovery_resp.msg_type = discovery_pb2.TYPE_REGISTER
+
+                self.mw_obj.handle_response(discovery_resp)
 
 
             elif register_req.role == discovery_pb2.ROLE_BOTH:
@@ -479,9 +430,15 @@ class DiscoveryAppln():
                 ready_resp = discovery_pb2.RegisterResp()
                 ready_resp.status = discovery_pb2.STATUS_SUCCESS
 
-                self.mw_obj.handle_response(ready_resp)
+                discovery_resp = discovery_pb2.DiscoveryResp()
+                discovery_resp.register_resp.CopyFrom(ready_resp)
+                discovery_resp.msg_type = discovery_pb2.TYPE_REGISTER
+
+                self.mw_obj.handle_response(discovery_resp)
 
 
+            # this registration may well be the one everyone was waiting on
+            self.announce_ready()
 
             self.logger.info("DiscoveryAppln::register completed")
 
@@ -489,62 +446,81 @@ class DiscoveryAppln():
             raise e
 
 
+    def deregister_request(self, deregister_req):
 
+        self.logger.info("DiscoveryAppln::deregister request started")
 
-    def isready_response(self, isready_req):
+        try:
+            dereg_resp = discovery_pb2.DeregisterResp()
 
-        self.logger.info("DiscoveryAppln::is ready request started")
+            if self.registry.deregister(deregister_req.info.id):
+                dereg_resp.status = discovery_pb2.STATUS_SUCCESS
+            else:
+                # never registered, or already gone
+                dereg_resp.status = discovery_pb2.STATUS_FAILURE
 
-        try:
-            if (not self.isready) or (self.pubs+self.subs == self.cur_pubs+self.cur_subs):
+            discovery_resp = discovery_pb2.DiscoveryResp()
+            discovery_resp.deregister_resp.CopyFrom(dereg_resp)
+            discovery_resp.msg_type = discovery_pb2.TYPE_DEREGISTER
 
-                if self.dissemination == "Broker":
-                    if (not self.isready) or (self.broker_addr and self.broker_port):
+            self.mw_obj.handle_response(discovery_resp)
 
-                        ready_resp = discovery_pb2.IsReadyResp()
-                        ready_resp.status = discovery_pb2.STATUS_SUCCESS
+            self.logger.info("DiscoveryAppln::deregister completed")
 
-                        discovery_resp = discovery_pb2.DiscoveryResp()
-                        discovery_resp.isready_resp.CopyFrom(ready_resp)
-                        discovery_resp.msg_type = discovery_pb2.TYPE_ISREADY
+        except Exception as e:
+            raise e
 
-                        self.mw_obj.handle_response(discovery_resp)
 
-                        self.logger.info("DiscoveryAppln:: SUCCESS; Broker registered")
 
-                    else:
-                        ready_resp = discovery_pb2.IsReadyResp()
-                        ready_resp.status = discovery_pb2.STATUS_FAILURE
 
-                        discovery_resp = discovery_pb2.DiscoveryResp()
-                        discovery_resp.isready_resp.CopyFrom(ready_resp)
-                        discovery_resp.msg_type = discovery_pb2.TYPE_ISREADY
+    ########################################
+    # is the system ready
+    #
+    # all the expected publishers and subscribers have registered
+    # and, for the broker strategy, so has the broker
+    ########################################
+    def system_ready(self):
+        ''' check the readiness barrier '''
 
-                        self.mw_obj.handle_response(discovery_resp)
+        if not self.isready:
+            return True
 
-                        self.logger.info("DiscoveryAppln:: FAILURE; Broker not yet registered")
+        if self.pubs+self.subs != self.registry.count(discovery_pb2.ROLE_PUBLISHER) + self.registry.count(discovery_pb2.ROLE_SUBSCRIBER):
+            return False
 
-                else:
-                    ready_resp = discovery_pb2.IsReadyResp()
-                    ready_resp.status = discovery_pb2.STATUS_SUCCESS
+        if self.dissemination == "Broker":
+            return bool(self.broker_addr and self.broker_port)
 
-                    discovery_resp = discovery_pb2.DiscoveryResp()
-                    discovery_resp.isready_resp.CopyFrom(ready_resp)
-                    discovery_resp.msg_type = discovery_pb2.TYPE_ISREADY
+        return True
+
+
+    def isready_response(self, isready_req):
 
-                    self.mw_obj.handle_response(discovery_resp)
+        self.logger.info("DiscoveryAppln::is ready request started")
+
+        try:
+            ready_resp = discovery_pb2.IsReadyResp()
 
-                    self.logger.info("DiscoveryAppln:: SUCCESS; Publisher registered")
+            # tell the entity where we announce readiness and changes to the
+            # registry so that it can wait for them instead of asking us over and over
+            ready_resp.notify_endpoint = self.mw_obj.notify_endpoint
+
+            if self.system_ready():
+                ready_resp.status = discovery_pb2.STATUS_SUCCESS
+                self.logger.info("DiscoveryAppln:: SUCCESS; system is ready")
 
             else:
-                ready_resp = discovery_pb2.IsReadyResp()
                 ready_resp.status = discovery_pb2.STATUS_FAILURE
+                self.logger.info("DiscoveryAppln:: FAILURE; not everyone has registered yet")
 
-                discovery_resp = discovery_pb2.DiscoveryResp()
-                discovery_resp.isready_resp.CopyFrom(ready_resp)
-                discovery_resp.msg_type = discovery_pb2.TYPE_ISREADY
+            discovery_resp = discovery_pb2.DiscoveryResp()
+            discovery_resp.isready_resp.CopyFrom(ready_resp)
+            discovery_resp.msg_type = discovery_pb2.TYPE_ISREADY
 
-                self.mw_obj.handle_response(discovery_resp)
+            self.mw_obj.handle_response(discovery_resp)
+
+            # the expected counts may have changed under us via the watches
+            self.announce_ready()
 
             self.logger.info("DiscoveryAppln::is ready request finished")
 
@@ -552,51 +528,97 @@ class DiscoveryAppln():
             raise e
 
 
+    ########################################
+    # announce readiness
+    #
+    # published once on our notification socket as soon as the barrier
+    # is met, releasing everyone that is waiting on it at the same time
+    ########################################
+    def announce_ready(self):
+        ''' announce that the system is ready '''
 
-    def lookup_response(self, lookup_req):
+        try:
+            # several workers may get here at once but only one gets to announce
+            with self.lock:
+                if self.announced or not self.system_ready():
+                    return
 
-        self.logger.info("DiscoveryAppln::lookup response started")
+                self.announced = True
 
-        try:
+            self.logger.info("DiscoveryAppln::announce_ready - system is ready")
 
-            if self.dissemination != "Broker":  #direct
+            ready_resp = discovery_pb2.IsReadyResp()
+            ready_resp.status = discovery_pb2.STATUS_SUCCESS
 
-                lookup_resp = discovery_pb2.LookupPubByTopicResp()  # allocate
+            discovery_resp = discovery_pb2.DiscoveryResp()
+            discovery_resp.isready_resp.CopyFrom(ready_resp)
+            discovery_resp.msg_type = discovery_pb2.TYPE_ISREADY
 
-                for topic in lookup_req.topiclist:
-                    if topic in self.hm:
-                        for tup in self.hm[topic]:
-                            temp = discovery_pb2.RegistrantInfo()
+            self.mw_obj.notify("ready", discovery_resp)
 
-                            id_name = tup[0]
-                            add_name = tup[1]
-                            port_name = tup[2]
+        except Exception as e:
+            raise e
 
-                            temp.id = id_name
-                            temp.addr = add_name
-                            temp.port = port_name
 
-                            lookup_resp.array.append(temp)
 
+    def lookup_response(self, lookup_req):
 
-                discovery_resp = discovery_pb2.DiscoveryResp()
-                discovery_resp.lookup_resp.CopyFrom(lookup_resp)
-                discovery_resp.msg_type = discovery_pb2.TYPE_LOOKUP_PUB_BY_TOPIC
+        self.logger.info("DiscoveryAppln::lookup response started")
+
+        try:
+
+            if self.dissemination != "Broker":  #direct
+
+                # everyone asking about the same topics since the same version gets
+                # the same answer until the registry changes. The version is read
+                # before the view.
+                since = lookup_req.since_version if lookup_req.HasField("since_version") else None
+                key = (discovery_pb2.TYPE_LOOKUP_PUB_BY_TOPIC, frozenset(lookup_req.topiclist), since)
+                version = self.registry.version
+                buf2send = self.cache.get(version, key)
+
+                if buf2send is None:
+                    lookup_resp = discovery_pb2.LookupPubByTopicResp()  # allocate
+                    lookup_resp.version = version
+                    lookup_resp.notify_endpoint = self.mw_obj.notify_endpoint  # changes from here on
+
+                    if not self.fill_delta(lookup_resp, since, key[1]):
+                        view = self.registry.view  # the current view; never modified once published
+                        for topic in sorted(key[1]):
+                            if topic in view:
+                                for tup in view[topic]:
+                                    # the nested message is filled in place, saving a copy
+                                    lookup_resp.array.add(id=tup[0], addr=tup[1], port=tup[2])
+
+                    discovery_resp = discovery_pb2.DiscoveryResp()
+                    discovery_resp.lookup_resp.CopyFrom(lookup_resp)
+                    discovery_resp.msg_type = discovery_pb2.TYPE_LOOKUP_PUB_BY_TOPIC
+
+                    buf2send = discovery_resp.SerializeToString()
+                    self.cache.put(version, key, buf2send)
 
                 self.logger.info("DiscoveryAppln::lookup response finished")
+                self.log_cache_stats()
 
-                self.mw_obj.handle_response(discovery_resp)
+                self.mw_obj.handle_serialized_response(buf2send)
 
 
             else:
                 # broker - send broker info
                 lookup_resp = discovery_pb2.LookupPubByTopicResp()  # allocate
-                temp = discovery_pb2.RegistrantInfo()
-                temp.id = "Broker"
-                temp.addr = self.broker_addr
-                temp.port = int(self.broker_port)
+                if self.broker_addr and self.broker_port:
+                    temp = discovery_pb2.RegistrantInfo()
+                    temp.id = "Broker"
+                    temp.addr = self.broker_addr
+                    temp.port = int(self.broker_port)
 
-                lookup_resp.array.append(temp)
+                    lookup_resp.array.append(temp)
+                    lookup_resp.status = discovery_pb2.STATUS_SUCCESS
+
+                else:
+                    # no broker leads right now, e.g., in between two leaders
+                    self.logger.info("DiscoveryAppln::lookup - no leading broker yet")
+                    lookup_resp.status = discovery_pb2.STATUS_FAILURE
 
                 discovery_resp = discovery_pb2.DiscoveryResp()
                 discovery_resp.lookup_resp.CopyFrom(lookup_resp)
@@ -616,35 +638,138 @@ class DiscoveryAppln():
 
         try:
             self.logger.info("DiscoveryAppln::pubslookup_response response started")
-            pubs_resp = discovery_pb2.RegisterPubsResp()
-
-            for tup in self.pubset:
 
-                temp = discovery_pb2.RegistrantInfo()
+            since = pubs_req.since_version if pubs_req.HasField("since_version") else None
+            key = (discovery_pb2.TYPE_LOOKUP_ALL_PUBS, since)
+            version = self.registry.version  # read before the view
+            buf2send = self.cache.get(version, key)
 
-                id_name = tup[0]
-                add_name = tup[1]
-                port_name = tup[2]
+            if buf2send is None:
+                pubs_resp = discovery_pb2.RegisterPubsResp()
+                pubs_resp.version = version
+                pubs_resp.notify_endpoint = self.mw_obj.notify_endpoint  # changes from here on
 
-                temp.id = id_name
-                temp.addr = add_name
-                temp.port = port_name
+                if not self.fill_delta(pubs_resp, since, None):
+                    for tup in self.registry.pubs_view:  # the current view; never modified once published
+                        pubs_resp.array.add(id=tup[0], addr=tup[1], port=tup[2])
 
-                pubs_resp.array.append(temp)
+                discovery_resp = discovery_pb2.DiscoveryResp()
+                discovery_resp.pubs_resp.CopyFrom(pubs_resp)
+                discovery_resp.msg_type = discovery_pb2.TYPE_LOOKUP_ALL_PUBS
 
-            discovery_resp = discovery_pb2.DiscoveryResp()
-            discovery_resp.pubs_resp.CopyFrom(pubs_resp)
-            discovery_resp.msg_type = discovery_pb2.TYPE_LOOKUP_ALL_PUBS
+                buf2send = discovery_resp.SerializeToString()
+                self.cache.put(version, key, buf2send)
 
             self.logger.info("DiscoveryAppln::pubslookup_response response finished")
+            self.log_cache_stats()
 
-            self.mw_obj.handle_response(discovery_resp)
+            self.mw_obj.handle_serialized_response(buf2send)
 
         except Exception as e:
             raise e
 
 
-def parseCmdLineArgs():
+    ########################################
+    # push the changes to the publishers made since we last did so
+    #
+    # invoked by the middleware on its event loop thread whenever a request
+    # has been handled, so the changes go out one at a time and in order.
+    # Subscribers apply them instead of all looking up again after a change.
+    #
+    # PUB/SUB may drop some. So that receivers can tell, every change carries
+    # the version of the one pushed before it, overall and under its key; a
+    # receiver not knowing of that one has missed something and looks up.
+    ########################################
+    def publish_changes(self):
+        ''' publish the registry changes on the notification socket '''
+
+        try:
+            if self.registry.version == self.published:
+                return
+
+            floor, version, changes = self.registry.changes_after(self.published)
+            if floor > self.published:
+                # we lost track, e.g., the registry was reloaded from ZooKeeper;
+                # everyone needs to look up again
+                self.logger.info("DiscoveryAppln::publish_changes - asking for a resync")
+                self.mw_obj.notify("resync", discovery_pb2.DiscoveryResp())
+                changes = []
+
+                # and whoever misses that too finds out by the next change
+                self.feed_floor = version
+                self.last_pushed = {}
+
+            for change_version, id, before, after in changes:
+                change = discovery_pb2.RegistryChange()
+                change.version = change_version
+
+                topics = set()
+                for entry, info, names in ((before, change.before, change.before_topics),
+                                           (after, change.after, change.after_topics)):
+                    if entry is not None and entry[0] == discovery_pb2.ROLE_PUBLISHER:
+                        info.id, info.addr, info.port = entry[1]
+                        names.extend(sorted(entry[2]))
+                        topics |= entry[2]
+
+                if not topics:
+                    continue  # not about a publisher
+
+                change.previous = self.last_pushed.get("", self.feed_floor)
+                self.last_pushed[""] = change_version
+
+                # keyed by topic so that subscribers only hear about theirs
+                for topic in sorted(topics):
+                    change.previous_in_topic = self.last_pushed.get(topic, self.feed_floor)
+                    self.last_pushed[topic] = change_version
+
+                    discovery_resp = discovery_pb2.DiscoveryResp()
+                    discovery_resp.change.CopyFrom(change)
+                    discovery_resp.msg_type = discovery_pb2.TYPE_REGISTRY_CHANGE
+                    self.mw_obj.notify("pub/" + topic + "/", discovery_resp)
+
+            self.published = version
+
+        except Exception as e:
+            raise e
+
+    ########################################
+    # answer a lookup with the changes since the version the client knows
+    #
+    # returns False if the full answer is needed instead, e.g., the client
+    # knows of no version or one too old for us
+    ########################################
+    def fill_delta(self, resp, since, topics):
+        ''' fill in added and removed publishers '''
+
+        if since is None:
+            return False
+
+        delta = self.registry.delta(since, topics)
+        if delta is None:
+            return False
+
+        resp.version, added, removed = delta
+        resp.delta = True
+        for tup in added:
+            resp.array.add(id=tup[0], addr=tup[1], port=tup[2])
+        for tup in removed:
+            resp.removed.add(id=tup[0], addr=tup[1], port=tup[2])
+
+        return True
+
+    ########################################
+    # report how well the lookup response cache does
+    ########################################
+    def log_cache_stats(self):
+        ''' log the hit rate of the response cache every so often '''
+
+        lookups = self.cache.hits + self.cache.misses
+        if lookups % 100 == 0:
+            self.logger.info("DiscoveryAppln::cache - hit rate {:.1%} ({} hits, {} misses)".format(
+                self.cache.hit_rate(), self.cache.hits, self.cache.misses))
+
+
+def parseCmdLineArgs(argv=None):
         # instantiate a ArgumentParser object
         parser = argparse.ArgumentParser(description="Discovery Application")
 
@@ -669,17 +794,29 @@ def parseCmdLineArgs():
         parser.add_argument("-p", "--port", type=int, default=5555,
                             help="Port number on which our underlying publisher ZMQ service runs, default=5555")
 
+        parser.add_argument("-a", "--addr", default="localhost",
+                            help="IP addr of this discovery service to advertise (default: localhost)")
+
+        parser.add_argument("-np", "--notify_port", type=int, default=None,
+                            help="Port number on which we announce system events, default=port+1000")
+
+        parser.add_argument("-w", "--workers", type=int, default=4,
+                            help="Number of worker threads handling requests, default=4")
+
         parser.add_argument("-r", "--isready", type=bool, default=False,
                             help="Port number on which our underlying publisher ZMQ service runs, default=5555")
 
+        parser.add_argument("-zt", "--zkTimeout", type=float, default=10.0,
+                            help="ZooKeeper session timeout in seconds, which bounds the failover time, default 10")
+
         parser.add_argument("-zkp", "--zkPort", type=int, default=2181,
                             help="Port number on which our underlying publisher ZMQ service runs, default=5555")
 
         parser.add_argument("-zka", "--zkIPAddr", type=str, default="127.0.0.1",
-                            help="ZooKeeper server port, default 2181")
+                            help="ZooKeeper server IP address, default 127.0.0.1, or local for the in-process stand-in")
 
 
-        return parser.parse_args()
+        return parser.parse_args(argv)
 
 
 
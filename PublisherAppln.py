@@ -58,11 +58,13 @@ from topic_selector import TopicSelector
 from CS6381_MW.PublisherMW import PublisherMW
 # We also need the message formats to handle incoming responses.
 from CS6381_MW import discovery_pb2
+from CS6381_MW.Common import Backoff, endpoint
+from CS6381_MW.Common import MEMBERS_PUBS, REGISTRY_PUBS, join_membership, sign_off
 
 # import any other packages you need.
 from enum import Enum  # for an enumeration we are using to describe what state we are in
 
-from kazoo.client import KazooClient
+from CS6381_MW.Coordination import make_coordinator
 import atexit
 
 
@@ -98,7 +100,14 @@ class PublisherAppln():
 
     self.zkIPAddr = None  # ZK server IP address
     self.zkPort = None  # ZK server port num
-    self.zk = None
+    self.coord = None  # our Coordinator, caching what is in ZooKeeper
+
+    self.settle = None  # grace period before the first publication
+    self.size = None  # bytes the data of a publication is padded to
+    self.sent = 0  # iterations of publication done so far
+    self.ts = TopicSelector()
+    self.backoff = Backoff(cap=5.0)  # spacing of our is ready retries
+    self.retry = None  # armed is ready retry, a fallback to the announcement
 
   ########################################
   # configure/initialize
@@ -120,6 +129,8 @@ class PublisherAppln():
       self.iters = args.iters  # num of iterations
       self.frequency = args.frequency  # frequency with which topics are disseminated
       self.num_topics = args.num_topics  # total num of topics we publish
+      self.settle = args.settle  # grace period before we start publishing
+      self.size = args.size  # padding of the data we publish
 
       # Now, get the configuration object
       self.logger.debug("PublisherAppln::configure - parsing config.ini")
@@ -133,17 +144,19 @@ class PublisherAppln():
       ts = TopicSelector()
       self.topiclist = ts.interest(self.num_topics)  # let topic selector give us the desired num of topics
 
-      self.logger.info("PublisherAppln::configure - saving the KazooClient object")
+      self.logger.info("PublisherAppln::configure - starting the coordination client")
       self.zkIPAddr = args.zkIPAddr
       self.zkPort = args.zkPort
       hosts = self.zkIPAddr + str(":") + str(self.zkPort)
-      self.zk = KazooClient(hosts)
-      self.zk.start()
-
-      if self.zk.exists("/curDiscovery"):
-        # Now acquire the value and stats of that znode
-        # value,stat = self.zk.get (self.zkName, watch=self.watch)
-        value, stat = self.zk.get("/curDiscovery")
+      self.coord = make_coordinator(hosts, self.logger)
+      self.coord.start()
+
+      # served from the cache, which start has loaded. Without a discovery
+      # leader yet, we start with the one we were told about and move over
+      # once the leader advertises itself
+      bindstring = endpoint(*args.discovery.rsplit(":", 1))
+      value = self.coord.get("/curDiscovery")
+      if value is not None:
         bindstring = value.decode("utf-8")
 
       self.logger.info("PublisherAppln::configure - configuration complete")
@@ -162,13 +175,10 @@ class PublisherAppln():
 
     print("Exiting Publisher - starting exitfunc")
 
-    if self.zk.exists("/numPubs"):
-      value, stat = self.zk.get("/numPubs")
-      value = value.decode('utf-8')
-
-      new_val = int(value) - 1
-      new_bytes = bytes( str(new_val), 'utf-8')
-      self.zk.set("/numPubs", new_bytes)
+    # we are gone from the registry and the count together, in one round
+    # trip; closing the session then flushes whatever is still pending
+    sign_off(self.coord, self.name, REGISTRY_PUBS, MEMBERS_PUBS)
+    self.coord.stop()
 
     print("Exiting Publisher - exitfunc complete")
 
@@ -255,14 +265,9 @@ class PublisherAppln():
         self.logger.debug("PublisherAppln::invoke_operation - check if are ready to go")
         self.mw_obj.is_ready()  # send the is_ready? request
 
-        #add publisher
-        if self.zk.exists("/numPubs"):
-          value, stat = self.zk.get("/numPubs")
-          value = value.decode('utf-8')
-
-          new_val = int(value) - 1
-          new_bytes = bytes(str(new_val), 'utf-8')
-          self.zk.set("/numPubs", new_bytes)
+        # count ourselves among the publishers; we may be back here to ask
+        # again, which leaves the count as it is
+        join_membership(self.coord, MEMBERS_PUBS, self.name)
 
         # Remember that we were invoked by the event loop as part of the upcall.
         # So we are going to return back to it for its next iteration. Because
@@ -274,28 +279,29 @@ class PublisherAppln():
       elif (self.state == self.State.DISSEMINATE):
 
         # We are here because both registration and is ready is done. So the only thing
-        # left for us as a publisher is dissemination, which we do it actively here.
-        self.logger.info("PublisherAppln::invoke_operation - start Disseminating")
-
-        time.sleep(5)  #sleep to give time for broker to connect all of the subs
-
-        # Now disseminate topics at the rate at which we have configured ourselves.
-        ts = TopicSelector()
-        for i in range(self.iters):
-          # I leave it to you whether you want to disseminate all the topics of interest in
-          # each iteration OR some subset of it. Please modify the logic accordingly.
-          # Here, we choose to disseminate on all topics that we publish.  Also, we don't care
-          # about their values. But in future assignments, this can change.
-          for topic in self.topiclist:
-            # For now, we have chosen to send info in the form "topic name: topic value"
-            # In later assignments, we should be using more complex encodings using
-            # protobuf.  In fact, I am going to do this once my basic logic is working.
-            dissemination_data = ts.gen_publication(topic)
-            self.mw_obj.disseminate(self.name, topic, dissemination_data)
-
-          # Now sleep for an interval of time to ensure we disseminate at the
+        # left for us as a publisher is dissemination. Each upcall does one iteration
+        # of publication and then arms a timer for the next one, so the event loop
+        # keeps servicing our sockets in between instead of us sleeping.
+        if self.sent == 0:
+          self.logger.info("PublisherAppln::invoke_operation - start Disseminating")
+
+        # I leave it to you whether you want to disseminate all the topics of interest in
+        # each iteration OR some subset of it. Please modify the logic accordingly.
+        # Here, we choose to disseminate on all topics that we publish.  Also, we don't care
+        # about their values. But in future assignments, this can change.
+        for topic in self.topiclist:
+          # For now, we have chosen to send info in the form "topic name: topic value"
+          # In later assignments, we should be using more complex encodings using
+          # protobuf.  In fact, I am going to do this once my basic logic is working.
+          dissemination_data = self.ts.gen_publication(topic).ljust(self.size, "x")
+          self.mw_obj.disseminate(self.name, topic, dissemination_data)
+
+        self.sent += 1
+        if self.sent < self.iters:
+          # come back after an interval of time to ensure we disseminate at the
           # frequency that was configured.
-          time.sleep(1 / float(self.frequency))  # ensure we get a floating point num
+          self.mw_obj.schedule_upcall(1 / float(self.frequency))  # ensure we get a floating point num
+          return None
 
         self.logger.info("PublisherAppln::invoke_operation - Dissemination completed")
 
@@ -362,24 +368,37 @@ class PublisherAppln():
     try:
       self.logger.info("PublisherAppln::isready_response")
 
-      # Notice how we get that loop effect with the sleep (10)
+      if self.state != self.State.ISREADY:
+        # we have gone ahead already; another go ahead would only start a
+        # second dissemination chain
+        return None
+
+      # Notice how we get that loop effect with a timer
       # by an interaction between the event loop and these
       # upcall methods.
       if isready_resp.status == discovery_pb2.STATUS_FAILURE:
-        # discovery service is not ready yet
+        # discovery service is not ready yet and will announce it when it is.
+        # As a fallback we ask again after a backoff so that we don't make
+        # excessive calls; the event loop keeps running in the meantime.
         self.logger.debug("PublisherAppln::driver - Not ready yet; check again")
-        time.sleep(10)  # sleep between calls so that we don't make excessive calls
-
-      else:
-
-        # we got the go ahead
-        # set the state to disseminate
-        self.logger.debug("PublisherAppln::driver - DISSEMINATE STATE")
-        self.state = self.State.DISSEMINATE
+        self.retry = self.mw_obj.schedule_upcall(self.backoff.next_delay())
+        return None
 
-      # return timeout of 0 so event loop calls us back in the invoke_operation
+      # we got the go ahead
+      # set the state to disseminate
+      self.logger.debug("PublisherAppln::driver - DISSEMINATE STATE")
+      self.backoff.reset()
+      if self.retry:
+        # the go ahead may have been announced before our retry came due
+        self.mw_obj.cancel_upcall(self.retry)
+        self.retry = None
+      self.state = self.State.DISSEMINATE
+
+      # give the broker/subscribers a brief moment to connect before the first
+      # publication; the event loop calls us back in the invoke_operation
       # method, where we take action based on what state we are in.
-      return 0
+      self.mw_obj.schedule_upcall(self.settle)
+      return None
 
     except Exception as e:
       raise e
@@ -412,7 +431,7 @@ class PublisherAppln():
 # Parse command line arguments
 #
 ###################################
-def parseCmdLineArgs():
+def parseCmdLineArgs(argv=None):
   # instantiate a ArgumentParser object
   parser = argparse.ArgumentParser(description="Publisher Application")
 
@@ -430,6 +449,9 @@ def parseCmdLineArgs():
   parser.add_argument("-p", "--port", type=int, default=5577,
                       help="Port number on which our underlying publisher ZMQ service runs, default=5577")
 
+  parser.add_argument("-ap", "--advertise_port", type=int, default=None,
+                      help="Port number to advertise instead of --port, e.g., that of an impair.py proxy in front of us, default: --port. Brokers ask for gap fills on the advertised port + 1000, which must then lead to --port + 1000, e.g., by a second route of the proxy")
+
   parser.add_argument("-d", "--discovery", default="localhost:5555",
                       help="IP Addr:Port combo for the discovery service, default localhost:5555")
 
@@ -443,6 +465,15 @@ def parseCmdLineArgs():
 
   parser.add_argument("-i", "--iters", type=int, default=1000, help="number of publication iterations (default: 1000)")
 
+  parser.add_argument("-s", "--settle", type=float, default=0.2,
+                      help="Seconds to wait after the go ahead before the first publication (default: 0.2)")
+
+  parser.add_argument("-sz", "--size", type=int, default=0,
+                      help="Bytes the data of each publication is padded to, for load tests (default: 0, no padding)")
+
+  parser.add_argument("-rt", "--retransmit", type=int, default=100,
+                      help="Publications per topic kept for brokers catching up after a failover (default: 100)")
+
   parser.add_argument("-l", "--loglevel", type=int, default=logging.INFO,
                       choices=[logging.DEBUG, logging.INFO, logging.WARNING, logging.ERROR, logging.CRITICAL],
                       help="logging level, choices 10,20,30,40,50: default 20=logging.INFO")
@@ -451,9 +482,9 @@ def parseCmdLineArgs():
                       help="Port number on which our underlying publisher ZMQ service runs, default=5555")
 
   parser.add_argument("-zka", "--zkIPAddr", type=str, default="127.0.0.1",
-                      help="ZooKeeper server port, default 2181")
+                      help="ZooKeeper server IP address, default 127.0.0.1, or local for the in-process stand-in")
 
-  return parser.parse_args()
+  return parser.parse_args(argv)
 
 
 ###################################
@@ -41,6 +41,8 @@ from topic_selector import TopicSelector
 from CS6381_MW.SubscriberMW import SubscriberMW
 # We also need the message formats to handle incoming responses.
 from CS6381_MW import discovery_pb2
+from CS6381_MW.Common import Backoff, endpoint
+from CS6381_MW.Common import MEMBERS_SUBS, REGISTRY_SUBS, join_membership, sign_off
 
 from threading import Timer
 
@@ -49,7 +51,7 @@ from enum import Enum  # for an enumeration we are using to describe what state
 
 import zmq
 
-from kazoo.client import KazooClient
+from CS6381_MW.Coordination import make_coordinator
 import atexit
 
 class SubscriberAppln():
@@ -75,7 +77,10 @@ class SubscriberAppln():
 
         self.zkIPAddr = None  # ZK server IP address
         self.zkPort = None  # ZK server port num
-        self.zk = None
+        self.coord = None  # our Coordinator, caching what is in ZooKeeper
+
+        self.backoff = Backoff(cap=5.0)  # spacing of our is ready and lookup retries
+        self.retry = None  # armed is ready retry, a fallback to the announcement, or lookup retry
 
 
     def configure(self, args):
@@ -107,17 +112,19 @@ class SubscriberAppln():
             ts = TopicSelector()
             self.topiclist = ts.interest(self.num_topics)  # let topic selector give us the desired num of topics
 
-            self.logger.info("SubcriberAppln::configure - saving the KazooClient object")
+            self.logger.info("SubcriberAppln::configure - starting the coordination client")
             self.zkIPAddr = args.zkIPAddr
             self.zkPort = args.zkPort
             hosts = self.zkIPAddr + str(":") + str(self.zkPort)
-            self.zk = KazooClient(hosts)
-            self.zk.start()
-
-            if self.zk.exists("/curDiscovery"):
-                # Now acquire the value and stats of that znode
-                # value,stat = self.zk.get (self.zkName, watch=self.watch)
-                value, stat = self.zk.get("/curDiscovery")
+            self.coord = make_coordinator(hosts, self.logger)
+            self.coord.start()
+
+            # served from the cache, which start has loaded. Without a discovery
+            # leader yet, we start with the one we were told about and move over
+            # once the leader advertises itself
+            bindstring = endpoint(*args.discovery.rsplit(":", 1))
+            value = self.coord.get("/curDiscovery")
+            if value is not None:
                 bindstring = value.decode("utf-8")
 
             # Now setup up our underlying middleware object to which we delegate
@@ -132,29 +139,18 @@ class SubscriberAppln():
             raise e
 
 
-    def watch_znode_pubscount_change(self):
-
-        @self.zk.DataWatch("/numPubs")
-        def dump_data_change(data, stat):
-
-            self.logger.info("SubscriberAppln::disc watch - number of publishers has changed ")
-
-            if self.mw_obj.accepting:
-                self.mw_obj.plz_lookup(self.topiclist)
-
-
-
     def exitfunc(self):
 
         print("Exiting Subscriber - starting exitfunc")
 
-        if self.zk.exists("/numSubs") and self.state == self.State.Accept:
-            value, stat = self.zk.get("/numSubs")
-            value = value.decode("utf-8")
+        # what we got, should we be stopped short of the quota, e.g., by ^C
+        if self.mw_obj is not None:
+            self.mw_obj.dump_latencies()
 
-            new_val = int(value) - 1
-            new_bytes = bytes(str(new_val), 'utf-8')
-            self.zk.set("/numSubs", new_bytes)
+        # we are gone from the registry and the count together, in one round
+        # trip; closing the session then flushes whatever is still pending
+        sign_off(self.coord, self.name, REGISTRY_SUBS, MEMBERS_SUBS)
+        self.coord.stop()
 
         print("Exiting Subscriber - exitfunc complete")
 
@@ -251,8 +247,12 @@ class SubscriberAppln():
 
                 self.logger.info("SubcriberAppln::invoke_operation - LOOKUP State now activated")
 
+                if self.dissemination != "Broker":
+                    # discovery pushes us the publishers that come and go from here on.
+                    # We subscribe before looking up so that we miss none of them
+                    self.mw_obj.watch_changes()
+
                 self.mw_obj.plz_lookup(self.topiclist)  # send the lookup request
-                self.watch_znode_pubscount_change()
 
                 #self.mw_obj.event_loop()
 
@@ -265,15 +265,8 @@ class SubscriberAppln():
 
                 self.mw_obj.watch_znode_curbroker_change()
 
-                '''
-                if self.zk.exists("/numSubs"):
-                    value, stat = self.zk.get("/numSubs")
-                    value = value.decode("utf-8")
-
-                    new_val = int(value) + 1
-                    new_bytes = bytes(str(new_val), 'utf-8')
-                    self.zk.set("/numSubs", new_bytes)
-                '''
+                # count ourselves among the subscribers
+                join_membership(self.coord, MEMBERS_SUBS, self.name)
 
                 #return to event loop to accept dissemination of topics
                 return None
@@ -321,19 +314,31 @@ class SubscriberAppln():
         try:
             self.logger.info("SubcriberAppln::isready_response")
 
-            # Notice how we get that loop effect with the sleep (10)
+            if self.state != self.State.ISREADY:
+                # we have gone ahead already, so this is old news
+                return None
+
+            # Notice how we get that loop effect with a timer
             # by an interaction between the event loop and these
             # upcall methods.
 
             if isready_resp.status == discovery_pb2.STATUS_FAILURE:
-                # discovery service is not ready yet
+                # discovery service is not ready yet and will announce it when it is.
+                # As a fallback we ask again after a backoff so that we don't make
+                # excessive calls; the event loop keeps running in the meantime.
                 self.logger.debug("SubcriberAppln::driver - Not ready yet; check again")
-                time.sleep(5)  # sleep between calls so that we don't make excessive calls
+                self.retry = self.mw_obj.schedule_upcall(self.backoff.next_delay())
+                return None
 
             else:
                 # we got the go ahead
                 # set the state to disseminate
                 self.logger.info("SubcriberAppln::driver - LOOKUP STATE")
+                self.backoff.reset()
+                if self.retry:
+                    # the go ahead may have been announced before our retry came due
+                    self.mw_obj.cancel_upcall(self.retry)
+                    self.retry = None
                 self.state = self.State.LOOKUP
 
             # return timeout of 0 so event loop calls us back in the invoke_operation
@@ -349,11 +354,39 @@ class SubscriberAppln():
 
         self.logger.info("SubcriberAppln::driver - Lookup Response")
         try:
-            for tup in lookup_resp.array:
-                addr_name = tup.addr
-                port_name = tup.port
+            if lookup_resp.status == discovery_pb2.STATUS_FAILURE:
+                # no broker to receive from just yet
+                if self.state == self.State.ACCEPT:
+                    # we follow /curbroker for the next one anyway
+                    return None
+
+                self.logger.debug("SubcriberAppln::driver - no broker yet; look up again")
+                self.retry = self.mw_obj.schedule_upcall(self.backoff.next_delay())
+                return None
+
+            self.backoff.reset()
+            self.retry = None
+
+            if lookup_resp.delta:
+                # just what changed since our previous lookup
+                for tup in lookup_resp.removed:
+                    self.mw_obj.lookup_unbind(tup.addr, tup.port)
+
+                for tup in lookup_resp.array:
+                    addr_name = tup.addr
+                    port_name = tup.port
+
+                    self.mw_obj.lookup_bind(addr_name,port_name)
+            else:
+                # the full list; we connect to the new ones and drop whoever is
+                # not on it anymore
+                self.mw_obj.lookup_update([(tup.addr, tup.port) for tup in lookup_resp.array])
 
-                self.mw_obj.lookup_bind(addr_name,port_name)
+            self.logger.info("SubcriberAppln::driver - receiving from {} endpoints".format(self.mw_obj.fan_in()))
+
+            if self.state == self.State.ACCEPT:
+                # a later lookup catching up on changes; we are already accepting
+                return None
 
             self.state = self.State.ACCEPT
 
@@ -385,7 +418,7 @@ class SubscriberAppln():
 
 
 
-def parseCmdLineArgs():
+def parseCmdLineArgs(argv=None):
         # instantiate a ArgumentParser object
         parser = argparse.ArgumentParser(description="Subscriber Application")
 
@@ -420,13 +453,25 @@ def parseCmdLineArgs():
 
         parser.add_argument("-f", "--filename", default="latency1.json", help="filename for output")
 
+        parser.add_argument("-q", "--quota", type=int, default=200,
+                            help="Number of publications to take in before concluding, default 200")
+
+        parser.add_argument("-rs", "--resync", type=float, default=30,
+                            help="Seconds between lookups catching up on missed publisher changes, 0 to disable, default 30")
+
+        parser.add_argument("-bp", "--paths", type=int, default=1,
+                            help="Number of brokers to receive through at once, duplicates are dropped, default 1")
+
+        parser.add_argument("-dw", "--dedup", type=int, default=1024,
+                            help="Sequence numbers per publisher remembered to drop duplicates, default 1024")
+
         parser.add_argument("-zkp", "--zkPort", type=int, default=2181,
                             help="Port number on which our underlying publisher ZMQ service runs, default=5555")
 
         parser.add_argument("-zka", "--zkIPAddr", type=str, default="127.0.0.1",
-                            help="ZooKeeper server port, default 2181")
+                            help="ZooKeeper server IP address, default 127.0.0.1, or local for the in-process stand-in")
 
-        return parser.parse_args()
+        return parser.parse_args(argv)
 
 
 
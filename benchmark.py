@@ -0,0 +1,375 @@
+###############################################
+#
+# Purpose: Run the whole system locally under load and report how it did
+#
+# Created: Spring 2023
+#
+###############################################
+
+# An experiment used to mean a shell per entity (see TESTING) and feeding
+# the latency files to numbers_graphing.py by hand. Here we launch discovery,
+# the broker (for the Broker strategy), P publishers and S subscribers as
+# local processes, once for every combination of dissemination strategy,
+# publication rate and payload size asked for, and write a single report.
+#
+# For every run the report has
+#  - the publications delivered to the subscribers, out of those expected
+#  - the throughput, i.e., deliveries per second from the launch of the
+#    publishers until the last subscriber is done
+#  - the p50, p99 and p99.9 latency in ms, from publication to delivery
+#  - the CPU seconds and peak RSS of every role, totalled over its processes
+#
+# The entities are separate processes, so they need a ZooKeeper server to
+# meet at. We lay out its znodes with zkadmin.py before the first run.
+#
+# The in-process stand-in serves entities run as threads of one process
+# only, so with -zka local every run is a simulate.py process instead,
+# running all the entities over inproc endpoints. The report is the same
+# but for the CPU seconds and peak RSS, which are those of that one
+# process, as the role simulation. There are no links to impair then.
+#
+# e.g., python3 benchmark.py -P 3 -S 3 --rates 1,10,50 --sizes 0,1024 -o bench
+#
+# Given --delay, --jitter, --bandwidth or --loss, the publishers and the
+# broker (or whichever --impaired names) are reached through an impair.py
+# proxy of their own, whose port they advertise in place of theirs, so that
+# every link to them is a WAN-like one, e.g.,
+#
+#   python3 benchmark.py -P 3 -S 3 --strategies Direct,Broker --delay 40 --jitter 10 --loss 0.01
+
+import os  # for wait4 and the run directories
+import re  # to read what simulate.py reports
+import sys  # for the interpreter
+import time  # for the clock
+import json  # for the report
+import signal  # to stop the entities
+import argparse  # for argument parsing
+import subprocess  # to launch the entities
+import configparser  # to write the config.ini of every run
+import threading  # to wait for the leaders
+
+from CS6381_MW.Coordination import make_coordinator, LOCAL
+from CS6381_MW.Common import GAPFILL_PORT_OFFSET
+
+# the directory of the entities
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# every publisher and subscriber takes all of the topics, so that every
+# subscriber is due every publication
+TOPICS = 9
+
+# the proxy in front of an entity listens this far above the entity's ports
+PROXY_PORT_OFFSET = 2000
+
+
+def parseCmdLineArgs():
+    parser = argparse.ArgumentParser(description="Benchmark harness")
+
+    parser.add_argument("-P", "--pubs", type=int, default=1,
+                        help="number of publishers, default 1")
+
+    parser.add_argument("-S", "--subs", type=int, default=1,
+                        help="number of subscribers, default 1")
+
+    parser.add_argument("--strategies", default=None,
+                        help="comma separated dissemination strategies to run, default: the one in config.ini")
+
+    parser.add_argument("--rates", default="10",
+                        help="comma separated publication iterations per second to run, default 10")
+
+    parser.add_argument("--sizes", default="0",
+                        help="comma separated payload sizes in bytes to run, default 0 (unpadded)")
+
+    parser.add_argument("-i", "--iters", type=int, default=100,
+                        help="publication iterations of every publisher, default 100")
+
+    parser.add_argument("-g", "--grace", type=float, default=5.0,
+                        help="seconds the subscribers get after the publishers are done, default 5")
+
+    parser.add_argument("-c", "--config", default="config.ini",
+                        help="configuration file the runs start from (default: config.ini)")
+
+    parser.add_argument("-o", "--outdir", default="bench",
+                        help="directory for the logs, latency files and report, default bench")
+
+    parser.add_argument("--delay", type=float, default=0,
+                        help="one-way delay in ms of the impaired links, default 0")
+
+    parser.add_argument("--jitter", type=float, default=0,
+                        help="delay variation in ms of the impaired links, default 0")
+
+    parser.add_argument("--bandwidth", type=int, default=0,
+                        help="bytes per second of the impaired links, default 0 (unlimited)")
+
+    parser.add_argument("--loss", type=float, default=0,
+                        help="probability of a segment on the impaired links being lost and retransmitted, default 0")
+
+    parser.add_argument("--impaired", default="publisher,broker",
+                        help="comma separated roles or names of the entities reached over impaired links, default publisher,broker")
+
+    parser.add_argument("-zkp", "--zkPort", type=int, default=2181,
+                        help="ZooKeeper server port, default 2181")
+
+    parser.add_argument("-zka", "--zkIPAddr", type=str, default="127.0.0.1",
+                        help="ZooKeeper server IP address, default 127.0.0.1")
+
+    return parser.parse_args()
+
+
+########################################
+# the entities of a run, each a local process
+########################################
+class Entity():
+    """ A process of one of the roles """
+
+    def __init__(self, role, name, script, argv, rundir):
+        self.role = role  # discovery, broker, publisher or subscriber
+        self.name = name
+        self.log = open(os.path.join(rundir, name + ".log"), "w")
+        self.proc = subprocess.Popen([sys.executable, script] + argv, cwd=HERE,
+                                     stdout=self.log, stderr=subprocess.STDOUT)
+        self.usage = None  # resource usage once it is gone
+
+    def stop(self):
+        ''' ask it to go away, giving its exit handlers a chance '''
+        if self.usage is None and self.proc.poll() is None:
+            self.proc.send_signal(signal.SIGINT)
+
+    def reap(self, timeout=None):
+        ''' wait for it to go away and collect its resource usage '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.usage is None:
+            pid, status, usage = os.wait4(self.proc.pid, os.WNOHANG)
+            if pid:
+                self.usage = usage
+                self.log.close()
+                break
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+
+########################################
+# the proxy in front of an entity, if it is to be reached over impaired links
+#
+# returns the arguments that have the entity advertise the proxy
+########################################
+def impair(args, role, name, port, rundir, entities):
+    if not (args.delay or args.jitter or args.bandwidth or args.loss):
+        return []
+    if role not in args.impaired.split(",") and name not in args.impaired.split(","):
+        return []
+
+    impairment = ["--delay", str(args.delay), "--jitter", str(args.jitter),
+                  "--bandwidth", str(args.bandwidth), "--loss", str(args.loss)]
+
+    # publishers are also asked for gap fills, a port of theirs further up
+    routes = []
+    for offset in (0, GAPFILL_PORT_OFFSET) if role == "publisher" else (0,):
+        routes += ["-r", "{}:localhost:{}".format(port + offset + PROXY_PORT_OFFSET, port + offset)]
+    entities.append(Entity("proxy", name + "-proxy", "impair.py", routes + impairment + ["-l", "30"], rundir))
+    return ["-ap", str(port + PROXY_PORT_OFFSET)]
+
+
+########################################
+# percentile by the nearest rank
+########################################
+def percentile(values, p):
+    if not values:
+        return None
+    rank = max(1, int(-(-p * len(values) // 100)))  # ceiling
+    return values[rank - 1]
+
+
+########################################
+# wait for the znode at path to show up
+########################################
+def wait_for(coord, path, timeout):
+    there = threading.Event()
+    coord.watch_data(path, lambda data: data is not None and there.set())
+    return there.wait(timeout)
+
+
+########################################
+# one run of the system
+########################################
+def run(args, coord, strategy, rate, size, rundir):
+    os.makedirs(rundir, exist_ok=True)
+
+    # the configuration of the run is ours but for the strategy
+    config = configparser.ConfigParser()
+    config.read(args.config)
+    config["Dissemination"]["Strategy"] = strategy
+    config_file = os.path.join(rundir, "config.ini")
+    with open(config_file, "w") as f:
+        config.write(f)
+
+    common = ["-c", config_file, "-l", "30", "-zka", args.zkIPAddr, "-zkp", str(args.zkPort)]
+    expected = args.pubs * args.iters * TOPICS  # per subscriber
+    entities = []
+
+    try:
+        entities.append(Entity("discovery", "discovery", "DiscoveryAppln.py",
+                               ["-P", str(args.pubs), "-S", str(args.subs), "-r", "1"] + common, rundir))
+        if not wait_for(coord, "/curDiscovery", 30):
+            raise RuntimeError("no discovery leader")
+
+        if strategy == "Broker":
+            advertise = impair(args, "broker", "broker", 5570, rundir, entities)
+            entities.append(Entity("broker", "broker", "BrokerAppln.py",
+                                   ["-p", "5570", "-T", str(TOPICS)] + advertise + common, rundir))
+            if not wait_for(coord, "/curbroker", 30):
+                raise RuntimeError("no broker leader")
+
+        subs = []
+        for i in range(args.subs):
+            name = "sub{}".format(i)
+            subs.append(Entity("subscriber", name, "SubscriberAppln.py",
+                               ["-n", name, "-p", str(5800 + i), "-T", str(TOPICS), "-q", str(expected),
+                                "-f", os.path.join(rundir, name + ".json")] + common, rundir))
+
+        started = time.monotonic()
+        pubs = []
+        for i in range(args.pubs):
+            name = "pub{}".format(i)
+            advertise = impair(args, "publisher", name, 5600 + i, rundir, entities)
+            pubs.append(Entity("publisher", name, "PublisherAppln.py",
+                               ["-n", name, "-p", str(5600 + i), "-T", str(TOPICS), "-i", str(args.iters),
+                                "-f", str(rate), "-sz", str(size)] + advertise + common, rundir))
+        entities += subs + pubs
+
+        for pub in pubs:
+            pub.reap()
+
+        # the subscribers conclude at their quota; those short of it by the
+        # end of the grace period are stopped
+        for sub in subs:
+            if not sub.reap(args.grace):
+                sub.stop()
+                sub.reap()
+        elapsed = time.monotonic() - started
+
+    finally:
+        for entity in entities:
+            entity.stop()
+        for entity in entities:
+            entity.reap()
+
+    return summarize(args, strategy, rate, size, rundir, [sub.name for sub in subs], elapsed, entities)
+
+
+########################################
+# one run of the system in a single process, for -zka local
+########################################
+def run_local(args, strategy, rate, size, rundir):
+    os.makedirs(rundir, exist_ok=True)
+
+    simulation = Entity("simulation", "simulation", "simulate.py",
+                        ["-P", str(args.pubs), "-S", str(args.subs), "-T", str(TOPICS), "-i", str(args.iters),
+                         "-f", str(rate), "-sz", str(size), "-g", str(args.grace), "-s", strategy,
+                         "-c", os.path.abspath(args.config), "-o", os.path.abspath(rundir)], rundir)
+    simulation.reap()
+
+    # from the launch of the publishers until the last subscriber is done
+    with open(simulation.log.name) as f:
+        timing = re.search(r"published in ([\d.]+) s, done ([\d.]+) s later", f.read())
+    if timing is None:
+        raise RuntimeError("simulation failed, see {}".format(simulation.log.name))
+    elapsed = float(timing.group(1)) + float(timing.group(2))
+
+    return summarize(args, strategy, rate, size, rundir, ["sub{}".format(i) for i in range(args.subs)], elapsed,
+                     [simulation])
+
+
+########################################
+# what a run reports, given the names of its subscribers
+########################################
+def summarize(args, strategy, rate, size, rundir, subs, elapsed, entities):
+    latencies = []
+    for sub in subs:
+        try:
+            with open(os.path.join(rundir, sub + ".json")) as f:
+                for values in json.load(f).values():
+                    latencies += values
+        except (OSError, ValueError):
+            pass  # died before writing anything
+    latencies.sort()
+
+    roles = {}
+    for entity in entities:
+        role = roles.setdefault(entity.role, {"processes": 0, "cpu_s": 0.0, "rss_mb": 0.0})
+        role["processes"] += 1
+        role["cpu_s"] += entity.usage.ru_utime + entity.usage.ru_stime
+        role["rss_mb"] += entity.usage.ru_maxrss / 1024.0  # in kB on Linux
+
+    return {
+        "strategy": strategy,
+        "rate": rate,
+        "size": size,
+        "pubs": args.pubs,
+        "subs": args.subs,
+        "impairment": {"delay_ms": args.delay, "jitter_ms": args.jitter, "bandwidth": args.bandwidth,
+                       "loss": args.loss, "impaired": args.impaired},
+        "delivered": len(latencies),
+        "expected": args.pubs * args.iters * TOPICS * len(subs),
+        "throughput": len(latencies) / elapsed,
+        "latency_ms": {"p50": percentile(latencies, 50), "p99": percentile(latencies, 99),
+                       "p99.9": percentile(latencies, 99.9)},
+        "roles": roles,
+    }
+
+
+def main():
+    args = parseCmdLineArgs()
+
+    local = args.zkIPAddr == LOCAL
+    if local and (args.delay or args.jitter or args.bandwidth or args.loss):
+        sys.exit("impaired links need the entities to run as processes of their own, and a ZooKeeper server")
+
+    config = configparser.ConfigParser()
+    config.read(args.config)
+    strategies = args.strategies.split(",") if args.strategies else [config["Dissemination"]["Strategy"]]
+    rates = [int(rate) for rate in args.rates.split(",")]
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    coord = None
+    if not local:
+        # idempotent, so we may just as well
+        subprocess.run([sys.executable, "zkadmin.py", "-zka", args.zkIPAddr, "-zkp", str(args.zkPort)],
+                       cwd=HERE, check=True)
+
+        coord = make_coordinator(args.zkIPAddr + ":" + str(args.zkPort))
+        coord.start()
+
+    os.makedirs(args.outdir, exist_ok=True)
+    report = []
+    for strategy in strategies:
+        for rate in rates:
+            for size in sizes:
+                rundir = os.path.join(args.outdir, "{}-r{}-s{}".format(strategy, rate, size))
+                if local:
+                    result = run_local(args, strategy, rate, size, rundir)
+                else:
+                    result = run(args, coord, strategy, rate, size, rundir)
+                report.append(result)
+
+                latency = result["latency_ms"]
+                print("{:<7} rate {:>4}/s size {:>6} B: {}/{} delivered, {:.1f} msgs/s, "
+                      "p50 {} p99 {} p99.9 {} ms".format(
+                          strategy, rate, size, result["delivered"], result["expected"], result["throughput"],
+                          *("-" if latency[p] is None else "{:.2f}".format(latency[p]) for p in ("p50", "p99", "p99.9"))))
+                for role, usage in sorted(result["roles"].items()):
+                    print("    {:<10} x{}: {:.2f} s CPU, {:.1f} MB RSS".format(
+                        role, usage["processes"], usage["cpu_s"], usage["rss_mb"]))
+
+    if coord is not None:
+        coord.stop()
+
+    with open(os.path.join(args.outdir, "report.json"), "w") as f:
+        json.dump(report, f, indent=4)
+    print("report in {}".format(os.path.join(args.outdir, "report.json")))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+###############################################
+#
+# Purpose: Measure how long it takes the discovery replicas, or the
+# brokers, to fail over
+#
+# Created: Spring 2023
+#
+###############################################
+
+# We watch /curDiscovery, which is held by the leader of the discovery
+# replicas (or /curbroker with -w broker), and report when the leader goes
+# away and when its successor advertises itself.
+#
+# Given the pid of the leader, we kill -9 it ourselves so that the whole of
+# the failover is timed, from the crash to the new leader. Most of that is
+# the ZooKeeper session timeout of the leader (see -zt of DiscoveryAppln)
+# since that is when its znodes go away; the election itself takes a
+# round trip or two.
+#
+# e.g., python3 failover_monitor.py -k `pgrep -f "DiscoveryAppln.py -p 5555"`
+#
+# The in-process stand-in for ZooKeeper is not shared with other processes,
+# so there is nothing to watch here with -zka local. simulate.py -k crashes
+# the leader of its own entities instead and times the failover with the
+# LeaderClock below, e.g.,
+#
+#   python3 simulate.py -D 3 -P 10 -S 10 -i 20 -f 2 -k discovery
+
+import os  # for kill
+import signal  # for SIGKILL
+import time  # for the clock
+import queue  # hands the watch events to the main thread
+import argparse  # for argument parsing
+
+# the candidates for leader queue up under here
+from CS6381_MW.Common import DISCOVERY_ELECTION, BROKER_ELECTION
+from CS6381_MW.Coordination import make_coordinator
+
+# the znode the leader advertises itself in, and the election, of each kind
+# of replica
+LEADERS = {
+    "discovery": ("/curDiscovery", DISCOVERY_ELECTION),
+    "broker": ("/curbroker", BROKER_ELECTION),
+}
+
+
+def parseCmdLineArgs():
+    parser = argparse.ArgumentParser(description="Failover monitor")
+
+    parser.add_argument("-w", "--watch", choices=sorted(LEADERS), default="discovery",
+                        help="replicas whose leader we watch, default discovery")
+
+    parser.add_argument("-k", "--kill", type=int, default=None,
+                        help="pid of the leader to kill -9, default: wait for it to go away by itself")
+
+    parser.add_argument("-n", "--count", type=int, default=1,
+                        help="number of failovers to wait for, default 1")
+
+    parser.add_argument("-zkp", "--zkPort", type=int, default=2181,
+                        help="ZooKeeper server port, default 2181")
+
+    parser.add_argument("-zka", "--zkIPAddr", type=str, default="127.0.0.1",
+                        help="ZooKeeper server IP address, default 127.0.0.1")
+
+    return parser.parse_args()
+
+
+class LeaderClock():
+    """ Times the changes of the leader advertised in a znode """
+
+    ########################################
+    # constructor
+    ########################################
+    def __init__(self, coord, path):
+        self.changes = queue.Queue()  # (time, leader or None) for each change of path
+        coord.watch_data(path, self.leader_change)
+
+    def leader_change(self, data):
+        self.changes.put((time.monotonic(), data.decode("utf-8") if data is not None else None))
+
+    ########################################
+    # wait for somebody other than leader to lead
+    #
+    # returns when the znode went away (None if it was replaced in one
+    # step), when the successor advertised itself and who it is; or None
+    # if nobody took over within timeout seconds
+    ########################################
+    def failover(self, leader, timeout=None):
+        ''' (gone, elected, successor) '''
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        gone = None
+        while True:
+            try:
+                when, value = self.changes.get(timeout=None if deadline is None else max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                return None
+
+            if value is None:
+                gone = when
+            elif value != leader:
+                return gone, when, value
+
+
+def main():
+    args = parseCmdLineArgs()
+    path, election = LEADERS[args.watch]
+
+    # chrooted to where everything of ours lives
+    coord = make_coordinator(args.zkIPAddr + ":" + str(args.zkPort))
+    coord.start()
+
+    clock = LeaderClock(coord, path)
+    since, leader = clock.changes.get()
+    print("leader: {}, candidates: {}".format(leader, coord.election(election).contenders()))
+
+    killed = None
+    if args.kill:
+        print("killing {}".format(args.kill))
+        killed = time.monotonic()
+        os.kill(args.kill, signal.SIGKILL)
+
+    for failover in range(args.count):
+        gone, when, leader = clock.failover(leader)
+
+        if gone is not None:
+            print("leader gone{}".format(
+                "" if killed is None else " {:.3f} s after the kill".format(gone - killed)))
+
+        report = "new leader: {}".format(leader)
+        if gone is not None:
+            report += ", {:.3f} s after the old one went away".format(when - gone)
+        if killed is not None:
+            report += ", {:.3f} s after the kill".format(when - killed)
+        print(report)
+
+        killed = None
+
+    coord.stop()
+
+
+if __name__ == "__main__":
+    main()
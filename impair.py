@@ -0,0 +1,246 @@
+###############################################
+#
+# Purpose: A TCP proxy that impairs the links through it, for WAN-like
+# experiments without Mininet
+#
+# Created: Spring 2023
+#
+###############################################
+
+# Mininet gives us links with delay and loss, but it needs root and a VM.
+# Instead, an entity can be reached through this proxy: it listens on a port
+# of its own, forwards every connection to the entity and holds back what
+# goes through it as a link would
+#  - delay and jitter, in ms: every segment arrives delay +/- jitter
+#    (uniformly) after it was sent, though never ahead of the one before,
+#    as TCP delivers in order
+#  - bandwidth, in bytes per second: segments queue up behind each other
+#    for as long as it takes to send them
+#  - loss, a probability: ZMQ runs over TCP, so a lost segment is not gone
+#    but retransmitted, i.e., it arrives a retransmission timeout late,
+#    holding back all behind it. Dropping bytes of the stream instead would
+#    merely break the framing of ZMQ.
+# The same impairment applies both ways.
+#
+# Publishers and brokers advertise the port of their proxy in place of
+# their own with -ap (benchmark.py --delay etc. does all of this for us).
+# Brokers ask a publisher for gap fills on the port it advertises + 1000
+# (GAPFILL_PORT_OFFSET), while the publisher binds its own port + 1000, so
+# a publisher's proxy needs a second route between the two, e.g., for a
+# publisher on port 5600 and its gap-fill port 6600,
+#
+#   python3 impair.py -r 7600:localhost:5600 -r 8600:localhost:6600 --delay 50 --jitter 10
+#   python3 PublisherAppln.py -p 5600 -ap 7600 ...
+
+import time  # for the clock
+import socket  # what we proxy
+import random  # for jitter and loss
+import argparse  # for argument parsing
+import threading  # every direction of every connection has threads of its own
+import collections  # for the segments in flight
+import logging  # for logging. Use it in place of print statements.
+
+
+def parseCmdLineArgs():
+    parser = argparse.ArgumentParser(description="Link impairment proxy")
+
+    parser.add_argument("-r", "--route", action="append", required=True,
+                        help="listen_port:host:port to forward, may be repeated")
+
+    parser.add_argument("--delay", type=float, default=0,
+                        help="one-way delay in ms, default 0")
+
+    parser.add_argument("--jitter", type=float, default=0,
+                        help="delay variation in ms either way, default 0")
+
+    parser.add_argument("--bandwidth", type=int, default=0,
+                        help="bytes per second, default 0 (unlimited)")
+
+    parser.add_argument("--loss", type=float, default=0,
+                        help="probability of a segment being lost and retransmitted, default 0")
+
+    parser.add_argument("--rto", type=float, default=200,
+                        help="ms a lost segment arrives late by, default 200 (TCP's minimum RTO)")
+
+    parser.add_argument("-l", "--loglevel", type=int, default=logging.INFO,
+                        choices=[logging.DEBUG, logging.INFO, logging.WARNING, logging.ERROR, logging.CRITICAL],
+                        help="logging level, choices 10,20,30,40,50: default 20=logging.INFO")
+
+    return parser.parse_args()
+
+
+class Impairment():
+    """ How a link holds back what goes through it """
+
+    # the most we read at once, i.e., a TCP segment on Ethernet
+    SEGMENT = 1460
+
+    ########################################
+    # constructor
+    ########################################
+    def __init__(self, delay=0, jitter=0, bandwidth=0, loss=0, rto=200, seed=None):
+        self.delay = delay / 1000.0  # s
+        self.jitter = jitter / 1000.0  # s
+        self.bandwidth = bandwidth  # bytes per second, 0 for unlimited
+        self.loss = loss  # probability
+        self.rto = rto / 1000.0  # s
+        self.random = random.Random(seed)
+
+    ########################################
+    # when a segment of size bytes handed to the link at now arrives
+    #
+    # free is when the link is done sending what came before, last when
+    # the segment before arrives; returns the arrival and the new free
+    ########################################
+    def schedule(self, size, now, free, last):
+        ''' (arrival, free) of a segment '''
+
+        # it waits for the link, then takes its time on it
+        sent = max(now, free)
+        if self.bandwidth:
+            sent += size / float(self.bandwidth)
+
+        arrival = sent + max(0.0, self.delay + self.random.uniform(-self.jitter, self.jitter))
+        if self.loss and self.random.random() < self.loss:
+            arrival += self.rto
+
+        return max(arrival, last), sent
+
+
+class Link():
+    """ One direction of a proxied connection """
+
+    ########################################
+    # constructor
+    ########################################
+    def __init__(self, logger, impairment, src, dst, name):
+        self.logger = logger
+        self.impairment = impairment
+        self.src = src  # socket we read from
+        self.dst = dst  # socket we write to
+        self.name = name
+        self.in_flight = collections.deque()  # (arrival, segment), None once src is done
+        self.cond = threading.Condition()  # guards in_flight
+        self.free = 0.0  # when the link is done sending
+        self.last = 0.0  # when the last segment arrives
+
+    def start(self):
+        ''' start moving segments '''
+        threading.Thread(target=self.receive, name=self.name + "-rx", daemon=True).start()
+        threading.Thread(target=self.deliver, name=self.name + "-tx", daemon=True).start()
+
+    ########################################
+    # put the segments of src in flight
+    ########################################
+    def receive(self):
+        try:
+            while True:
+                segment = self.src.recv(Impairment.SEGMENT)
+                if not segment:
+                    break
+
+                arrival, self.free = self.impairment.schedule(len(segment), time.monotonic(), self.free, self.last)
+                self.last = arrival
+                with self.cond:
+                    self.in_flight.append((arrival, segment))
+                    self.cond.notify()
+
+        except OSError as e:
+            self.logger.debug("Link::receive - {}: {}".format(self.name, e))
+
+        with self.cond:
+            self.in_flight.append(None)
+            self.cond.notify()
+
+    ########################################
+    # hand every segment to dst once it arrives
+    ########################################
+    def deliver(self):
+        try:
+            while True:
+                with self.cond:
+                    while not self.in_flight:
+                        self.cond.wait()
+                    head = self.in_flight.popleft()
+
+                if head is None:
+                    self.dst.shutdown(socket.SHUT_WR)
+                    break
+
+                arrival, segment = head
+                wait = arrival - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+                self.dst.sendall(segment)
+
+        except OSError as e:
+            self.logger.debug("Link::deliver - {}: {}".format(self.name, e))
+            # nobody to deliver to; have the other end find out too
+            for sock in (self.src, self.dst):
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+
+class Proxy():
+    """ Forwards the connections to a port on to an entity, impairing them """
+
+    ########################################
+    # constructor
+    ########################################
+    def __init__(self, logger, listen_port, host, port, impairment):
+        self.logger = logger
+        self.target = (host, port)
+        self.impairment = impairment
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(("", listen_port))
+        self.listener.listen(128)
+        self.name = "{}->{}:{}".format(listen_port, host, port)
+
+    def start(self):
+        ''' accept connections in the background '''
+        threading.Thread(target=self.accept, name=self.name, daemon=True).start()
+
+    ########################################
+    # a link of our own for every connection
+    ########################################
+    def accept(self):
+        while True:
+            client, peer = self.listener.accept()
+            try:
+                server = socket.create_connection(self.target)
+            except OSError as e:
+                # not up (yet); ZMQ will reconnect
+                self.logger.debug("Proxy::accept - {}: {}".format(self.name, e))
+                client.close()
+                continue
+
+            self.logger.info("Proxy::accept - {} from {}:{}".format(self.name, *peer))
+            for sock in (client, server):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            Link(self.logger, self.impairment, client, server, self.name + "-up").start()
+            Link(self.logger, self.impairment, server, client, self.name + "-down").start()
+
+
+def main():
+    args = parseCmdLineArgs()
+    logging.basicConfig(level=args.loglevel, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    logger = logging.getLogger("impair")
+
+    impairment = Impairment(args.delay, args.jitter, args.bandwidth, args.loss, args.rto)
+    for route in args.route:
+        listen_port, host, port = route.split(":")
+        Proxy(logger, int(listen_port), host, int(port), impairment).start()
+        logger.info("impair::main - {} -> {}:{}".format(listen_port, host, port))
+
+    # until we are told to go away
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
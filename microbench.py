@@ -0,0 +1,287 @@
+###############################################
+#
+# Purpose: Microbenchmarks of what the middleware does per message
+#
+# Created: Spring 2023
+#
+###############################################
+
+# benchmark.py tells how the whole system does; this tells what each step
+# every message, or every discovery request, goes through costs on its own:
+#  - publisher.disseminate      PublisherMW.disseminate, building and sending
+#                               a publication
+#  - subscriber.publication     SubscriberMW.handle_publication, parsing it,
+#                               dropping duplicates and recording the latency
+#  - broker.forward[leading|standby]
+#                               BrokerMW.forward
+#  - discovery.register[N]      a registration changing the registry
+#  - discovery.lookup[N], discovery.lookup_uncached[N]
+#                               a lookup by topic, answered from the response
+#                               cache and built afresh
+# the discovery ones with N publishers registered already, and taking the
+# request from its serialized form to the serialized reply.
+#
+# The sockets are real, but nobody is connected to them, so what we time
+# ends where ZMQ takes over. Whatever the middleware prints goes to
+# /dev/null, and it logs at WARNING.
+#
+# The results go to a JSON file. Given a baseline, e.g., the results of an
+# earlier run, every case is compared with it and those slower by more than
+# the threshold are flagged:
+#
+#   python3 microbench.py -o microbench_baseline.json    # before a change
+#   python3 microbench.py -b microbench_baseline.json    # after it
+#
+# The baseline in the repository was taken on a development machine; take
+# one of your own before comparing.
+
+import os  # for /dev/null
+import sys  # for the exit status
+import json  # for the results
+import time  # for the clock
+import random  # for the registrants
+import logging  # to keep the middleware quiet
+import argparse  # for argument parsing
+import platform  # what we ran on
+import statistics  # for the median
+import contextlib  # to send prints to /dev/null
+import itertools  # to alternate requests
+import collections  # for the replay buffer
+
+import zmq
+
+from CS6381_MW import discovery_pb2
+from CS6381_MW.PublisherMW import PublisherMW
+from CS6381_MW.SubscriberMW import SubscriberMW
+from CS6381_MW.BrokerMW import BrokerMW
+from CS6381_MW.DiscoveryMW import DiscoveryMW
+from DiscoveryAppln import DiscoveryAppln
+from registry import ResponseCache
+from topic_selector import TopicSelector
+
+
+def parseCmdLineArgs():
+    parser = argparse.ArgumentParser(description="Microbenchmarks")
+
+    parser.add_argument("-k", "--keyword", default="",
+                        help="only run the cases whose name contains this")
+
+    parser.add_argument("-r", "--repeat", type=int, default=5,
+                        help="timed rounds per case, the best counts, default 5")
+
+    parser.add_argument("-N", "--registrants", default="10,1000,100000",
+                        help="comma separated numbers of publishers registered for the discovery cases, default 10,1000,100000")
+
+    parser.add_argument("-o", "--output", default="microbench.json",
+                        help="file for the results, default microbench.json")
+
+    parser.add_argument("-b", "--baseline", default=None,
+                        help="results to compare with, e.g., microbench_baseline.json")
+
+    parser.add_argument("-t", "--threshold", type=float, default=0.2,
+                        help="slowdown against the baseline that counts as a regression, default 0.2 (20%%)")
+
+    parser.add_argument("--fail", action="store_true",
+                        help="exit with status 1 if there are regressions")
+
+    return parser.parse_args()
+
+
+# all the sockets live in here
+context = zmq.Context()
+logger = logging.getLogger("microbench")
+logger.setLevel(logging.WARNING)
+
+
+########################################
+# a PUB socket nobody is connected to
+########################################
+def sink():
+    sock = context.socket(zmq.PUB)
+    sock.bind("inproc://microbench-{}".format(id(sock)))
+    return sock
+
+
+########################################
+# the cases
+#
+# each returns the number of calls per round and a setup, which is called
+# before every round and returns what to call
+########################################
+def publisher_disseminate():
+    def setup():
+        mw = PublisherMW(logger)
+        mw.pub = sink()
+        mw.addr = "10.0.0.1"
+        mw.seq = int(time.time() * 1000) << 20
+        mw.retransmit = 100
+        return lambda: mw.disseminate("pub1", "weather", "sunny")
+
+    return 50000, setup
+
+
+def subscriber_publication():
+    number = 50000
+    # as the publisher sends them, each one new
+    messages = ["weather:sunny:{}:10.0.0.1:pub1:{}".format(time.time(), seq) for seq in range(number)]
+
+    def setup():
+        mw = SubscriberMW(logger)
+        mw.dedup = 1024
+        return lambda message=iter(messages): mw.handle_publication(next(message))
+
+    return number, setup
+
+
+def broker_forward(leading):
+    message = "weather:sunny:{}:10.0.0.1:pub1:42".format(time.time())
+
+    def setup():
+        mw = BrokerMW(logger)
+        mw.pub = sink()
+        mw.leading = leading
+        mw.replay = collections.deque(maxlen=100)
+        return lambda: mw.forward(message)
+
+    return 50000, setup
+
+
+# the discovery, with n publishers of three topics each registered
+def discovery(n):
+    topics = TopicSelector.topiclist
+    rng = random.Random(n)
+
+    appln = DiscoveryAppln(logger)
+    appln.dissemination = "Direct"
+    appln.isready = False
+    appln.announced = True  # nothing to announce
+    for i in range(n):
+        info = ("pub{}".format(i), "10.{}.{}.{}".format(i >> 16 & 255, i >> 8 & 255, i & 255), 5577)
+        appln.registry.register(discovery_pb2.ROLE_PUBLISHER, info, rng.sample(topics, 3))
+
+    mw = DiscoveryMW(logger)
+    mw.upcall_obj = appln
+    mw.notify_endpoint = "tcp://10.0.0.1:6555"
+    mw.local.rep = sink()  # in place of the REP socket of a worker
+    mw.local.push = sink()
+    mw.local.tag = [b"\x00\x00\x00\x00\x00\x00\x00\x01"]
+    appln.mw_obj = mw
+    return appln, mw
+
+
+def discovery_register(n):
+    appln, mw = discovery(n)
+
+    # the same publisher over and over, changing its topics every time
+    requests = []
+    for topiclist in (["weather", "humidity"], ["light", "sound"]):
+        req = discovery_pb2.DiscoveryReq()
+        req.msg_type = discovery_pb2.TYPE_REGISTER
+        req.register_req.role = discovery_pb2.ROLE_PUBLISHER
+        req.register_req.info.id = "bench"
+        req.register_req.info.addr = "10.255.255.255"
+        req.register_req.info.port = 5577
+        req.register_req.topiclist.extend(topiclist)
+        requests.append(req.SerializeToString())
+
+    def setup():
+        return lambda request=itertools.cycle(requests): mw.handle_request(next(request))
+
+    return max(10, min(2000, 2000000 // n)), setup
+
+
+def discovery_lookup(n, cached):
+    appln, mw = discovery(n)
+
+    req = discovery_pb2.DiscoveryReq()
+    req.msg_type = discovery_pb2.TYPE_LOOKUP_PUB_BY_TOPIC
+    req.lookup_req.topiclist.extend(["weather", "humidity", "airquality"])
+    request = req.SerializeToString()
+
+    def setup():
+        if cached:
+            return lambda: mw.handle_request(request)
+
+        def lookup():
+            appln.cache = ResponseCache()  # so that it misses
+            mw.handle_request(request)
+        return lookup
+
+    return (20000 if cached else max(5, min(2000, 200000 // n))), setup
+
+
+########################################
+# time a case
+#
+# the best round counts, the others being slower for reasons other than
+# our code, e.g., the machine being busy
+########################################
+def measure(number, setup, repeat):
+    rounds = []
+    for _ in range(repeat):
+        call = setup()
+        start = time.perf_counter()
+        for _ in range(number):
+            call()
+        rounds.append((time.perf_counter() - start) / number * 1e9)
+
+    return {"ns_per_op": min(rounds), "median_ns": statistics.median(rounds), "number": number, "repeat": repeat}
+
+
+def main():
+    args = parseCmdLineArgs()
+
+    cases = [
+        ("publisher.disseminate", publisher_disseminate),
+        ("subscriber.publication", subscriber_publication),
+        ("broker.forward[leading]", lambda: broker_forward(True)),
+        ("broker.forward[standby]", lambda: broker_forward(False)),
+    ]
+    for n in [int(n) for n in args.registrants.split(",")]:
+        cases += [
+            ("discovery.register[{}]".format(n), lambda n=n: discovery_register(n)),
+            ("discovery.lookup[{}]".format(n), lambda n=n: discovery_lookup(n, True)),
+            ("discovery.lookup_uncached[{}]".format(n), lambda n=n: discovery_lookup(n, False)),
+        ]
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+
+    results = {}
+    regressions = []
+    for name, case in cases:
+        if args.keyword not in name:
+            continue
+
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            number, setup = case()
+            result = measure(number, setup, args.repeat)
+        results[name] = result
+
+        report = "{:<36} {:>12.0f} ns/op".format(name, result["ns_per_op"])
+        base = baseline.get(name)
+        if base is not None:
+            change = result["ns_per_op"] / base["ns_per_op"] - 1
+            result["change"] = change
+            report += "  {:+7.1%} vs baseline".format(change)
+            if change > args.threshold:
+                regressions.append(name)
+                report += "  REGRESSION"
+        print(report)
+
+    with open(args.output, "w") as f:
+        json.dump({"python": platform.python_version(), "machine": platform.machine(),
+                   "results": results}, f, indent=4)
+    print("results in {}".format(args.output))
+
+    if regressions:
+        print("{} slower than the baseline by more than {:.0%}: {}".format(
+            len(regressions), args.threshold, ", ".join(regressions)))
+        if args.fail:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
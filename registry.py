@@ -0,0 +1,299 @@
+###############################################
+#
+# Purpose:
+# The registry of publishers and subscribers maintained by the discovery
+# service, indexed both by registrant id and by topic.
+#
+# To be used by the discovery application logic only. See its code
+#
+# Created: Spring 2023
+#
+###############################################
+
+# Registrants are kept with set semantics: registering the same entity twice,
+# e.g., because its request was resent, leaves a single entry behind, and an
+# entity registering again with other topics or another address replaces its
+# earlier registration. Inserting and removing an entity costs O(1) per topic.
+#
+# Requests are handled by several discovery workers at once. Changes are made
+# under the lock. The views the lookups are answered from are immutable and
+# rebuilt on the first read after a change, and only for the topics it
+# touched, so registering costs the same however many have registered
+# already; readers take the lock only when there is something to rebuild.
+#
+# Every change bumps the version of the registry. Lookup responses built from
+# one version stay valid until the next, so they are cached already serialized.
+#
+# The recent changes are also kept so that a client that tells us the version
+# it last heard of gets just the endpoints added and removed since. Versions
+# start from the time the registry was created, so those of two discovery
+# instances do not overlap and a version from another instance, e.g., from
+# before a failover, is met with the full answer.
+
+import threading
+import time
+import collections
+
+# We need the roles the registrants play
+from CS6381_MW import discovery_pb2
+
+
+class Registry():
+
+    ########################################
+    # constructor
+    ########################################
+    def __init__(self, history=1024):
+        self.lock = threading.Lock()  # serializes the changes
+        self.entries = {}  # id -> (role, (id, addr, port), frozenset of topics)
+        self.by_topic = {}  # role -> topic -> id -> (id, addr, port)
+        self.by_role = {}  # role -> id -> (id, addr, port)
+        self.version = time.time_ns() // 1000  # bumped on every change
+        self.changes = collections.deque(maxlen=history)  # (version, id, entry before the change or None, entry after or None)
+        self.floor = self.version  # oldest version we can give a delta from
+
+        # the views handed out; replaced but never modified
+        self.topics_view = {}  # topic -> tuple of (id, addr, port) of its publishers
+        self.stale_topics = set()  # topics changed since topics_view was built
+        self.all_pubs_view = ()  # (id, addr, port) of all the publishers
+        self.stale_pubs = False  # publishers changed since all_pubs_view was built
+
+    ########################################
+    # add (or replace) a registration
+    #
+    # returns True if the registry changed
+    ########################################
+    def register(self, role, info, topics):
+        ''' register the entity with info (id, addr, port) for topics '''
+
+        entry = (role, tuple(info), frozenset(topics))
+        with self.lock:
+            old = self.entries.get(entry[1][0])
+            if old == entry:
+                return False  # a duplicate
+
+            touched = set(entry[2])
+            if old is not None:
+                self.remove(old)
+                touched |= old[2]
+
+            self.add(entry)
+            self.changed(touched)
+            self.record(entry[1][0], old)
+            return True
+
+    ########################################
+    # drop a registration
+    #
+    # returns True if the registry changed
+    ########################################
+    def deregister(self, id):
+        ''' deregister the entity named id '''
+
+        with self.lock:
+            entry = self.entries.get(id)
+            if entry is None:
+                return False
+
+            self.remove(entry)
+            self.changed(entry[2])
+            self.record(id, entry)
+            return True
+
+    ########################################
+    # the publishers added and removed since a version
+    #
+    # limited to those of the given topics unless topics is None. Returns
+    # (version, added, removed) with the endpoints as (id, addr, port), or
+    # None if the changes since then are not known to us.
+    ########################################
+    def delta(self, since, topics=None):
+        ''' what changed for the publishers since version since '''
+
+        with self.lock:
+            if since < self.floor or since > self.version:
+                return None
+
+            # the state of each entity changed since then, as it was back then
+            before = {}
+            for version, id, entry, after in self.changes:
+                if version > since and id not in before:
+                    before[id] = entry
+
+            added = []
+            removed = []
+            for id, entry in before.items():
+                old = self.endpoint(entry, topics)
+                new = self.endpoint(self.entries.get(id), topics)
+                if old != new:
+                    if old is not None:
+                        removed.append(old)
+                    if new is not None:
+                        added.append(new)
+
+            return self.version, added, removed
+
+    # the endpoint of a publisher entry of interest to topics, if any
+    def endpoint(self, entry, topics):
+        if entry is None or entry[0] != discovery_pb2.ROLE_PUBLISHER:
+            return None
+        if topics is not None and not entry[2] & topics:
+            return None
+        return entry[1]
+
+    ########################################
+    # the changes made after a version, oldest first
+    #
+    # returns (floor, version, changes). If floor is past the version
+    # asked about, the changes in between are not known anymore.
+    ########################################
+    def changes_after(self, since):
+        ''' (version, id, before, after) of each change since version since '''
+
+        with self.lock:
+            return self.floor, self.version, [change for change in self.changes if change[0] > since]
+
+    ########################################
+    # number of registered entities playing role
+    ########################################
+    def count(self, role):
+        ''' how many have registered as role '''
+        return len(self.by_role.get(role, ()))
+
+    ########################################
+    # the views of the publishers, never modified once handed out
+    #
+    # rebuilt on the first read after a change rather than on every change,
+    # so that registering does not cost O(N) however many are registered
+    ########################################
+    @property
+    def view(self):
+        ''' topic -> tuple of (id, addr, port) of its publishers '''
+
+        if self.stale_topics:
+            with self.lock:
+                index = self.by_topic.get(discovery_pb2.ROLE_PUBLISHER, {})
+                view = dict(self.topics_view)  # the untouched topics are shared
+                for topic in self.stale_topics:
+                    if topic in index:
+                        view[topic] = tuple(index[topic].values())
+                    else:
+                        view.pop(topic, None)
+
+                self.topics_view = view
+                self.stale_topics = set()
+
+        return self.topics_view
+
+    @property
+    def pubs_view(self):
+        ''' (id, addr, port) of all the publishers '''
+
+        if self.stale_pubs:
+            with self.lock:
+                self.all_pubs_view = tuple(self.by_role.get(discovery_pb2.ROLE_PUBLISHER, {}).values())
+                self.stale_pubs = False
+
+        return self.all_pubs_view
+
+    ########################################
+    # put an entry into the indices (lock held)
+    ########################################
+    def add(self, entry):
+        self.entries[entry[1][0]] = entry
+        self.by_role.setdefault(entry[0], {})[entry[1][0]] = entry[1]
+
+        index = self.by_topic.setdefault(entry[0], {})
+        for topic in entry[2]:
+            index.setdefault(topic, {})[entry[1][0]] = entry[1]
+
+    ########################################
+    # take an entry out of the indices (lock held)
+    ########################################
+    def remove(self, entry):
+        self.entries.pop(entry[1][0], None)
+        self.by_role[entry[0]].pop(entry[1][0], None)
+
+        index = self.by_topic.get(entry[0], {})
+        for topic in entry[2]:
+            infos = index.get(topic)
+            if infos is not None:
+                infos.pop(entry[1][0], None)
+                if not infos:
+                    del index[topic]
+
+    ########################################
+    # remember what an entity was before and is after a change (lock held)
+    ########################################
+    def record(self, id, before):
+        if len(self.changes) == self.changes.maxlen:
+            # the change about to be dropped can no longer be part of a delta
+            self.floor = self.changes[0][0]
+        self.changes.append((self.version, id, before, self.entries.get(id)))
+
+    ########################################
+    # mark the views of the given topics stale after a change (lock held)
+    #
+    # the version is bumped only once they are marked: whoever reads the
+    # version first and the views next never pairs a new version with old
+    # views
+    ########################################
+    def changed(self, topics):
+        self.stale_topics |= topics
+        self.stale_pubs = True
+        self.version += 1
+
+
+class ResponseCache():
+    """ Serialized responses valid for one version of the registry """
+
+    ########################################
+    # constructor
+    ########################################
+    def __init__(self, capacity=1024):
+        self.lock = threading.Lock()
+        self.capacity = capacity  # max number of responses we hold on to
+        self.version = None  # the registry version of what we hold
+        self.responses = {}  # key -> serialized response
+        self.hits = 0
+        self.misses = 0
+
+    ########################################
+    # the response for key as of version, if we have it
+    ########################################
+    def get(self, version, key):
+        ''' cached bytes or None '''
+
+        with self.lock:
+            buf = self.responses.get(key) if version == self.version else None
+            if buf is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return buf
+
+    ########################################
+    # remember the response for key as of version
+    ########################################
+    def put(self, version, key, buf):
+        ''' cache bytes '''
+
+        with self.lock:
+            if version != self.version:
+                if self.version is not None and version < self.version:
+                    return  # built from a registry that has changed since
+
+                # the registry changed; everything we hold is stale
+                self.version = version
+                self.responses = {}
+
+            if len(self.responses) < self.capacity:
+                self.responses[key] = buf
+
+    ########################################
+    # fraction of the lookups answered from the cache
+    ########################################
+    def hit_rate(self):
+        ''' hits / lookups '''
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
@@ -0,0 +1,277 @@
+###############################################
+#
+# Purpose: Run many entities as threads of a single process
+#
+# Created: Spring 2023
+#
+###############################################
+
+# Trying the system out with many entities used to take Mininet or dozens of
+# processes. Here the discovery replicas, the brokers, the publishers and
+# the subscribers are the very same application objects, each running its
+# event loop on a thread of its own, all in one process:
+#  - they talk over inproc endpoints of a shared ZMQ context, named after
+#    the address and port they would have (see Common.use_inproc), e.g.,
+#    inproc://pub12:5577, so no ports need to be handed out
+#  - they meet in the in-process stand-in for ZooKeeper (see
+#    LocalCoordination.py) rather than on a server
+#
+# Every subscriber takes all the topics, so each is due every publication.
+# Once the publishers are done, and the subscribers have had their grace
+# period, we report what was delivered and how fast, e.g.,
+#
+#   python3 simulate.py -P 500 -S 500 -i 10 -f 2
+#
+# With -k, the leading discovery replica or broker crashes halfway through
+# the publications, and we also report how long it took the next in line
+# to take over, e.g.,
+#
+#   python3 simulate.py -D 3 -P 10 -S 10 -i 20 -f 2 -k discovery
+
+import os  # for /dev/null
+import sys  # for stdout
+import time  # for the clock
+import logging  # for the loggers of the entities
+import argparse  # for argument parsing
+import resource  # for the limit on open files
+import threading  # every entity runs on a thread of its own
+import tempfile  # for the config.ini of the run
+import configparser  # to write it
+
+import zmq
+
+from CS6381_MW.Common import use_inproc
+from CS6381_MW.Coordination import make_coordinator, LOCAL
+
+import DiscoveryAppln
+import BrokerAppln
+import PublisherAppln
+import SubscriberAppln
+
+from benchmark import percentile, wait_for, TOPICS
+from failover_monitor import LeaderClock, LEADERS
+
+# the ensemble of the run
+HOSTS = LOCAL + ":2181"
+
+
+def parseCmdLineArgs():
+    parser = argparse.ArgumentParser(description="Single process simulation")
+
+    parser.add_argument("-D", "--discovery", type=int, default=1,
+                        help="number of discovery replicas, default 1")
+
+    parser.add_argument("-B", "--brokers", type=int, default=1,
+                        help="number of brokers for the Broker strategy, default 1")
+
+    parser.add_argument("-bp", "--paths", type=int, default=1,
+                        help="number of brokers every subscriber receives through, default 1")
+
+    parser.add_argument("-P", "--pubs", type=int, default=10,
+                        help="number of publishers, default 10")
+
+    parser.add_argument("-S", "--subs", type=int, default=10,
+                        help="number of subscribers, default 10")
+
+    parser.add_argument("-T", "--num_topics", type=int, choices=range(1, 10), default=1,
+                        help="number of topics every publisher publishes, default 1")
+
+    parser.add_argument("-i", "--iters", type=int, default=10,
+                        help="publication iterations of every publisher, default 10")
+
+    parser.add_argument("-f", "--frequency", type=int, default=1,
+                        help="publication iterations per second, default 1")
+
+    parser.add_argument("-sz", "--size", type=int, default=0,
+                        help="payload size in bytes of every publication, default 0 (unpadded)")
+
+    parser.add_argument("-g", "--grace", type=float, default=5.0,
+                        help="seconds the subscribers get after the publishers are done, default 5")
+
+    parser.add_argument("-c", "--config", default="config.ini",
+                        help="configuration file (default: config.ini)")
+
+    parser.add_argument("-s", "--strategy", default=None,
+                        help="dissemination strategy, default: the one in config.ini")
+
+    parser.add_argument("-k", "--kill", choices=sorted(LEADERS), default=None,
+                        help="crash the leading discovery replica or broker halfway through, default: none")
+
+    parser.add_argument("-o", "--outdir", default=None,
+                        help="directory for the latency files of the subscribers, default: none written")
+
+    parser.add_argument("-l", "--loglevel", type=int, default=logging.WARNING,
+                        choices=[logging.DEBUG, logging.INFO, logging.WARNING, logging.ERROR, logging.CRITICAL],
+                        help="logging level of the entities, default 30=logging.WARNING")
+
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="let the entities print what they receive")
+
+    return parser.parse_args()
+
+
+########################################
+# an entity on a thread of its own
+########################################
+def launch(module, cls, name, argv, loglevel):
+    logger = logging.getLogger(name)
+    logger.setLevel(loglevel)
+
+    appln = getattr(module, cls)(logger)
+    appln.configure(module.parseCmdLineArgs(argv))
+
+    thread = threading.Thread(target=appln.driver, name=name, daemon=True)
+    thread.start()
+    return appln, thread
+
+
+########################################
+# what kill -9 does to an entity
+#
+# its session goes away, and with it its znodes, as a real one does once
+# its session timeout (-zt) has passed; and it stops serving
+########################################
+def crash(appln):
+    appln.coord.stop()
+    appln.mw_obj.disable_event_loop()
+
+
+# what a discovery replica or a broker advertises in the znode it leads by
+def advertised(appln):
+    if isinstance(appln, DiscoveryAppln.DiscoveryAppln):
+        return appln.endpoint
+    return "{} {}".format(appln.mw_obj.addr, appln.mw_obj.port)
+
+
+def main():
+    args = parseCmdLineArgs()
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    # the configuration of the run is ours but for the strategy
+    config = configparser.ConfigParser()
+    config.read(args.config)
+    if args.strategy:
+        config["Dissemination"]["Strategy"] = args.strategy
+    strategy = config["Dissemination"]["Strategy"]
+    config_file = os.path.join(tempfile.mkdtemp(), "config.ini")
+    with open(config_file, "w") as f:
+        config.write(f)
+
+    # brokers take part in the Broker strategy only
+    brokers = args.brokers if strategy == "Broker" else 0
+    entities = args.discovery + brokers + args.pubs + args.subs
+
+    # before the first socket is created
+    use_inproc()
+    zmq.Context.instance().set(zmq.MAX_SOCKETS, 8 * entities + 1024)
+
+    # every entity has a few sockets and the pipe of its inbox open
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    if args.outdir:
+        os.makedirs(args.outdir, exist_ok=True)
+
+    # all the sockets of the entities go to the same context, so that
+    # inproc works among them; and what they print goes nowhere
+    stdout = sys.stdout
+    if not args.verbose:
+        sys.stdout = open(os.devnull, "w")
+
+    coord = make_coordinator(HOSTS)
+    coord.start()
+
+    common = ["-c", config_file, "-zka", LOCAL, "-d", "discovery0:5555"]
+    level = ["-l", str(args.loglevel)]
+    expected = args.pubs * args.iters * args.num_topics  # per subscriber
+
+    replicas = {"discovery": [], "broker": []}
+    started = time.monotonic()
+    for i in range(args.discovery):
+        replicas["discovery"].append(launch(DiscoveryAppln, "DiscoveryAppln", "discovery{}".format(i),
+               ["-a", "discovery{}".format(i), "-P", str(args.pubs), "-S", str(args.subs), "-r", "1"] + level
+               + common[:4], args.loglevel))
+    if not wait_for(coord, "/curDiscovery", 30):
+        sys.exit("no discovery leader")
+
+    if strategy == "Broker":
+        for i in range(brokers):
+            replicas["broker"].append(launch(BrokerAppln, "BrokerAppln", "broker{}".format(i),
+                   ["-n", "broker{}".format(i), "-a", "broker{}".format(i), "-T", str(TOPICS)] + level + common,
+                   args.loglevel))
+        if not wait_for(coord, "/curbroker", 30):
+            sys.exit("no broker leader")
+
+    subs = []
+    for i in range(args.subs):
+        name = "sub{}".format(i)
+        latencies = os.path.join(args.outdir, name + ".json") if args.outdir else os.devnull
+        subs.append(launch(SubscriberAppln, "SubscriberAppln", name,
+                           ["-n", name, "-a", name, "-T", str(TOPICS), "-q", str(expected), "-f", latencies,
+                            "-bp", str(args.paths)]
+                           + level + common, args.loglevel))
+
+    pubs = []
+    for i in range(args.pubs):
+        name = "pub{}".format(i)
+        pubs.append(launch(PublisherAppln, "PublisherAppln", name,
+                           ["-n", name, "-a", name, "-T", str(args.num_topics), "-i", str(args.iters),
+                            "-f", str(args.frequency), "-sz", str(args.size)] + level + common, args.loglevel))
+    launched = time.monotonic()
+
+    failover = None
+    if args.kill:
+        # halfway through what the publishers are due to take
+        time.sleep(args.iters / float(args.frequency) / 2)
+        path, election = LEADERS[args.kill]
+        clock = LeaderClock(coord, path)
+        since, leader = clock.changes.get()
+        crashed = time.monotonic()
+        crash(next(appln for appln, thread in replicas[args.kill] if advertised(appln) == leader))
+        failover = clock.failover(leader, timeout=30)
+
+    for appln, thread in pubs:
+        thread.join()
+    published = time.monotonic()
+
+    # the subscribers conclude at their quota
+    deadline = published + args.grace
+    for appln, thread in subs:
+        thread.join(max(0, deadline - time.monotonic()))
+    done = time.monotonic()
+
+    sys.stdout = stdout
+
+    latencies = []
+    duplicates = 0
+    for appln, thread in subs:
+        for values in appln.mw_obj.logging_dict.values():
+            latencies += values
+        duplicates += appln.mw_obj.duplicates
+    latencies.sort()
+
+    print("{} entities ({} discovery, {} brokers, {} publishers, {} subscribers), {}".format(
+        entities, args.discovery, brokers, args.pubs, args.subs, strategy))
+    print("launched in {:.2f} s, published in {:.2f} s, done {:.2f} s later".format(
+        launched - started, published - launched, done - published))
+    print("{}/{} delivered, {} duplicates dropped, {} subscribers short of their quota".format(
+        len(latencies), expected * args.subs, duplicates, sum(thread.is_alive() for appln, thread in subs)))
+    if args.kill:
+        if failover is None:
+            print("{} {} crashed, nobody took over".format(args.kill, leader))
+        else:
+            gone, elected, successor = failover
+            print("{} {} crashed, gone {:.1f} ms later, {} leading {:.1f} ms after the crash".format(
+                args.kill, leader, (gone - crashed) * 1000, successor, (elected - crashed) * 1000))
+    if latencies:
+        print("latency p50 {:.2f} ms, p99 {:.2f} ms, p99.9 {:.2f} ms".format(
+            percentile(latencies, 50), percentile(latencies, 99), percentile(latencies, 99.9)))
+
+    # the entities are still running, and their exit handlers would tear
+    # down sessions of an ensemble that goes away with us anyway
+    sys.stdout.flush()
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main()
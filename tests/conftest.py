@@ -0,0 +1,7 @@
+# The tests import the entities and the middleware the way the entities
+# import each other, i.e., from the top of the repository.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
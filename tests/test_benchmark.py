@@ -0,0 +1,38 @@
+###############################################
+#
+# Purpose: Tests of the benchmark harness without a ZooKeeper server
+#
+# Created: Spring 2023
+#
+###############################################
+
+import os
+import sys
+import json
+import subprocess
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_local_runs_are_simulated_and_reported(tmp_path):
+    result = subprocess.run([sys.executable, "benchmark.py", "-zka", "local", "-P", "1", "-S", "2",
+                             "--strategies", "Direct,Broker", "-i", "5", "--rates", "20", "--sizes", "64",
+                             "-o", str(tmp_path)], cwd=HERE, capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+
+    with open(os.path.join(str(tmp_path), "report.json")) as f:
+        report = json.load(f)
+
+    assert [run["strategy"] for run in report] == ["Direct", "Broker"]
+    for run in report:
+        assert run["delivered"] == run["expected"] == 1 * 5 * 9 * 2
+        assert run["throughput"] > 0
+        assert run["latency_ms"]["p50"] is not None
+        assert list(run["roles"]) == ["simulation"]
+
+
+def test_local_runs_refuse_impaired_links(tmp_path):
+    result = subprocess.run([sys.executable, "benchmark.py", "-zka", "local", "--delay", "10", "-o", str(tmp_path)],
+                            cwd=HERE, capture_output=True, text=True, timeout=60)
+    assert result.returncode != 0
+    assert "impaired links" in result.stderr
@@ -0,0 +1,164 @@
+###############################################
+#
+# Purpose: Tests of what a broker middleware does once elected, replaying
+# what it kept while standing by to the subscribers that follow it
+#
+# Created: Spring 2023
+#
+###############################################
+
+import time
+import logging
+import itertools
+import collections
+
+import zmq
+
+from CS6381_MW import Common
+from CS6381_MW.BrokerMW import BrokerMW
+from CS6381_MW.PublisherMW import PublisherMW
+from CS6381_MW.Common import ConnectionManager, GAPFILL_PORT_OFFSET
+
+logger = logging.getLogger("test")
+
+# every broker gets an endpoint of its own
+brokers = itertools.count()
+
+
+def broker(catchup_wait=5):
+    ''' a broker standing by, its XPUB socket bound in-process '''
+    context = zmq.Context.instance()
+    mw = BrokerMW(logger)
+    mw.context = context
+    mw.poller = zmq.Poller()
+    mw.replay = collections.deque(maxlen=100)
+    mw.catchup_wait = catchup_wait
+    mw.gapfill_timeout = 2
+
+    mw.pub = context.socket(zmq.XPUB)
+    mw.pub.setsockopt(zmq.XPUB_VERBOSE, 1)
+    mw.pub.bind("inproc://broker-test-{}".format(next(brokers)))
+    mw.poller.register(mw.pub, zmq.POLLIN)
+
+    mw.sub = context.socket(zmq.SUB)
+    mw.publishers = ConnectionManager(mw.sub, logger, name="SUB")
+    return mw
+
+
+def subscriber(mw, topic="weather"):
+    ''' a subscriber following the broker '''
+    sub = zmq.Context.instance().socket(zmq.SUB)
+    sub.connect(mw.pub.getsockopt_string(zmq.LAST_ENDPOINT))
+    sub.setsockopt_string(zmq.SUBSCRIBE, topic)
+    return sub
+
+
+########################################
+# the part of BrokerMW::event_loop the tests need, for a while
+########################################
+def pump(mw, seconds, others={}):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        events = dict(mw.poller.poll(timeout=10))
+        mw.timers.run_expired()
+        for sock in events:
+            if sock is mw.pub:
+                mw.handle_subscription()
+            elif sock in mw.gapfills:
+                mw.handle_gapfill(sock)
+            else:
+                others[sock]()
+
+
+class Dropped():
+    """ Stands in for the PUB socket of a publisher whose sends do not get through """
+
+    def send(self, buf):
+        pass
+
+
+def received(sub):
+    return [sub.recv_string() for i in iter(lambda: sub.poll(0), 0)]
+
+
+def test_the_replay_waits_for_the_subscribers_to_follow():
+    mw = broker()
+    mw.forward("weather:sunny:10.0.0.1:pub1:100")
+    mw.forward("weather:rainy:10.0.0.1:pub1:101")
+
+    mw.take_over()
+    pump(mw, 0.2)
+    # nobody there to get it yet
+    assert len(mw.replay) == 2
+
+    # a subscriber sees /curbroker and follows us
+    started = time.monotonic()
+    sub = subscriber(mw)
+    pump(mw, 0.5)
+    assert received(sub) == ["weather:sunny:10.0.0.1:pub1:100", "weather:rainy:10.0.0.1:pub1:101"]
+    # long before we would have given up on the subscribers
+    assert time.monotonic() - started < mw.catchup_wait
+    assert mw.catchup is None
+    sub.close(linger=0)
+
+
+def test_the_replay_goes_out_after_the_wait_even_if_nobody_joins():
+    mw = broker(catchup_wait=0.1)
+    mw.forward("weather:sunny:10.0.0.1:pub1:100")
+
+    mw.take_over()
+    pump(mw, 0.3)
+    assert len(mw.replay) == 0
+    assert mw.catchup is None
+
+
+def test_last_seen_keeps_the_highest_sequence_number_as_a_number():
+    mw = broker()
+    mw.forward("weather:sunny:10.0.0.1:pub1:100")
+    mw.forward("weather:sunny:10.0.0.1:pub1:102")
+    # e.g., from a gap fill
+    mw.forward("weather:sunny:10.0.0.1:pub1:101")
+
+    assert mw.last_seen == {"pub1": 102}
+
+
+########################################
+# a publication the new leader never got, filled in from the publisher's
+# retransmit ring once the subscribers have followed it
+########################################
+def test_what_the_new_leader_missed_is_gap_filled_to_the_subscribers(monkeypatch):
+    monkeypatch.setitem(Common.TRANSPORT, "name", "inproc")
+    mw = broker()
+
+    pub = PublisherMW(logger)
+    pub.addr = "pub-test-{}".format(next(brokers))
+    pub.seq = 100
+    pub.retransmit = 10
+    pub.registration = ("pub1", ["weather"])
+    pub.pub = Dropped()
+    pub.gapfill = zmq.Context.instance().socket(zmq.ROUTER)
+    pub.gapfill.bind(Common.bind_endpoint(pub.addr, 5577 + GAPFILL_PORT_OFFSET))
+    mw.poller.register(pub.gapfill, zmq.POLLIN)
+    mw.publishers.add(Common.endpoint(pub.addr, 5577))
+
+    # the standby gets the first three, and the old leader goes before
+    # the last two make it through to us
+    for i in range(5):
+        pub.disseminate("pub1", "weather", "sunny")
+    for seq, publication in list(pub.rings["weather"])[:3]:
+        mw.forward(publication)
+
+    mw.take_over()
+    pump(mw, 0.2, {pub.gapfill: pub.handle_gapfill})
+    # we ask only once there is somebody to pass the answer on to
+    assert not mw.gapfills
+
+    sub = subscriber(mw)
+    pump(mw, 0.5, {pub.gapfill: pub.handle_gapfill})
+    got = [int(publication.rsplit(":", 1)[1]) for publication in received(sub)]
+    # the replay, and then the gap fill
+    assert got == [100, 101, 102, 103, 104]
+    assert not mw.gapfills
+
+    sub.close(linger=0)
+    pub.gapfill.close(linger=0)
@@ -0,0 +1,142 @@
+###############################################
+#
+# Purpose: Tests of the registry change feed, from discovery pushing the
+# changes to subscribers and brokers applying them
+#
+# Created: Spring 2023
+#
+###############################################
+
+import logging
+
+from CS6381_MW import discovery_pb2
+from CS6381_MW.SubscriberMW import SubscriberMW
+from CS6381_MW.BrokerMW import BrokerMW
+from DiscoveryAppln import DiscoveryAppln
+
+logger = logging.getLogger("test")
+
+
+class Recorder():
+    """ Stands in for the middleware of discovery, keeping what it pushes """
+
+    def __init__(self):
+        self.pushed = []  # (key, DiscoveryResp)
+
+    def notify(self, key, resp):
+        copy = discovery_pb2.DiscoveryResp()
+        copy.CopyFrom(resp)
+        self.pushed.append((key, copy))
+
+
+def discovery():
+    appln = DiscoveryAppln(logger)
+    appln.mw_obj = Recorder()
+    return appln
+
+
+def register(appln, name, port, topics):
+    appln.registry.register(discovery_pb2.ROLE_PUBLISHER, (name, "10.0.0.1", port), topics)
+    appln.publish_changes()
+
+
+# a subscriber to topics that has looked up as of version
+def subscriber(topics, version):
+    mw = SubscriberMW(logger)
+    mw.topiclist = topics
+    mw.lookup_version = mw.applied_version = version
+    mw.topic_versions = {topic: version for topic in topics}
+    mw.bound = []
+    mw.lookups = []
+    mw.lookup_bind = lambda addr, port: mw.bound.append((addr, port))
+    mw.lookup_unbind = lambda addr, port: mw.bound.remove((addr, port))
+    mw.plz_lookup = lambda topiclist: mw.lookups.append(list(topiclist))
+    return mw
+
+
+def deliver(mw, pushed):
+    for key, resp in pushed:
+        if key.startswith("pub/") and key[len("pub/"):-1] in mw.topiclist:
+            mw.apply_change(key[len("pub/"):-1], resp.change)
+
+
+def test_every_copy_names_its_predecessors():
+    appln = discovery()
+    start = appln.registry.version
+    register(appln, "pub1", 5001, ["weather", "humidity"])
+    register(appln, "pub2", 5002, ["weather"])
+
+    changes = [(key, resp.change) for key, resp in appln.mw_obj.pushed]
+    assert [key for key, change in changes] == ["pub/humidity/", "pub/weather/", "pub/weather/"]
+    assert changes[0][1].previous == start and changes[0][1].previous_in_topic == start
+    assert changes[1][1].previous_in_topic == start
+    assert changes[2][1].previous == changes[0][1].version
+    assert changes[2][1].previous_in_topic == changes[1][1].version
+
+
+def test_subscriber_applies_contiguous_changes_once():
+    appln = discovery()
+    mw = subscriber(["weather", "humidity"], appln.registry.version)
+    register(appln, "pub1", 5001, ["weather", "humidity"])
+    register(appln, "pub2", 5002, ["weather"])
+
+    deliver(mw, appln.mw_obj.pushed)
+
+    assert mw.bound == [("10.0.0.1", 5001), ("10.0.0.1", 5002)]
+    assert mw.lookups == []
+    assert mw.lookup_version == appln.registry.version - 1  # humidity last changed with pub1
+    assert mw.topic_versions["weather"] == appln.registry.version
+
+
+def test_subscriber_looks_up_from_the_last_contiguous_version_on_a_gap():
+    appln = discovery()
+    version = appln.registry.version
+    mw = subscriber(["weather"], version)
+    register(appln, "pub1", 5001, ["weather"])
+    register(appln, "pub2", 5002, ["weather"])
+    register(appln, "pub3", 5003, ["weather"])
+
+    deliver(mw, appln.mw_obj.pushed[1:])  # the first one is lost
+
+    assert mw.bound == []
+    assert mw.lookups == [["weather"]]  # just once for the whole gap
+    assert mw.lookup_version == version  # what the lookup asks for changes since
+
+
+def test_subscriber_ignores_changes_to_other_topics():
+    appln = discovery()
+    mw = subscriber(["weather"], appln.registry.version)
+    register(appln, "pub1", 5001, ["light"])
+    register(appln, "pub2", 5002, ["weather"])
+
+    deliver(mw, appln.mw_obj.pushed)
+
+    assert mw.bound == [("10.0.0.1", 5002)]
+    assert mw.lookups == []
+
+
+def test_broker_asks_again_on_a_gap():
+    appln = discovery()
+    mw = BrokerMW(logger)
+    mw.pubs_version = appln.registry.version
+    mw.bound = []
+    mw.requests = 0
+    mw.lookup_bind = lambda addr, port: mw.bound.append((addr, port))
+    mw.lookup_unbind = lambda addr, port: mw.bound.remove((addr, port))
+
+    def request_pubs():
+        mw.requests += 1
+    mw.request_pubs = request_pubs
+
+    register(appln, "pub1", 5001, ["weather"])
+    register(appln, "pub2", 5002, ["light"])
+    register(appln, "pub3", 5003, ["sound"])
+    pushed = appln.mw_obj.pushed
+
+    mw.apply_change(pushed[0][1].change)
+    assert mw.bound == [("10.0.0.1", 5001)]
+
+    for key, resp in pushed[2:]:  # the second one is lost
+        mw.apply_change(resp.change)
+    assert mw.bound == [("10.0.0.1", 5001)]
+    assert mw.requests == 1
@@ -0,0 +1,139 @@
+###############################################
+#
+# Purpose: Tests of the facilities the middleware shares, in Common.py
+#
+# Created: Spring 2023
+#
+###############################################
+
+import time
+
+from CS6381_MW.Common import TimerQueue, Backoff, DedupWindow
+
+
+########################################
+# TimerQueue
+########################################
+def test_timers_fire_in_deadline_order_once_due():
+    timers = TimerQueue()
+    fired = []
+    timers.schedule(0.02, fired.append, "late")
+    timers.schedule(0.0, fired.append, "early")
+
+    assert timers.expired()
+    timers.run_expired()
+    assert fired == ["early"]
+
+    time.sleep(0.03)
+    timers.run_expired()
+    assert fired == ["early", "late"]
+    assert not timers.expired()
+
+
+def test_cancelled_timers_never_fire_and_do_not_shorten_the_poll():
+    timers = TimerQueue()
+    fired = []
+    entry = timers.schedule(0.0, fired.append, "cancelled")
+    timers.schedule(10, fired.append, "later")
+    timers.cancel(entry)
+
+    assert not timers.expired()
+    assert timers.poll_timeout(None) > 9000
+    timers.run_expired()
+    assert fired == []
+
+
+def test_poll_timeout_is_the_earlier_of_the_application_and_the_timers():
+    timers = TimerQueue()
+    assert timers.poll_timeout(None) is None
+    assert timers.poll_timeout(500) == 500
+
+    timers.schedule(0.1, lambda: None)
+    assert 0 < timers.poll_timeout(None) <= 100
+    assert timers.poll_timeout(20) == 20
+
+
+def test_the_last_timer_that_cares_sets_the_timeout():
+    timers = TimerQueue()
+    timers.schedule(0.0, lambda: 250)
+    timers.schedule(0.0, lambda: TimerQueue.KEEP)
+
+    assert timers.run_expired(1000) == 250
+
+    timers.schedule(0.0, lambda: TimerQueue.KEEP)
+    assert timers.run_expired(1000) == 1000
+
+
+########################################
+# Backoff
+########################################
+def test_backoff_doubles_up_to_the_cap_with_jitter():
+    backoff = Backoff(base=0.1, cap=0.5, factor=2.0)
+
+    for ceiling in (0.1, 0.2, 0.4, 0.5, 0.5):
+        delay = backoff.next_delay()
+        assert ceiling / 2 <= delay <= ceiling
+
+
+def test_backoff_starts_over_after_a_reset():
+    backoff = Backoff(base=0.1, cap=2.0)
+    for attempt in range(5):
+        backoff.next_delay()
+
+    backoff.reset()
+    assert 0.05 <= backoff.next_delay() <= 0.1
+
+
+########################################
+# DedupWindow
+########################################
+def test_duplicates_are_dropped():
+    window = DedupWindow(64)
+    assert window.accept(1)
+    assert window.accept(2)
+    assert not window.accept(1)
+    assert not window.accept(2)
+
+
+def test_out_of_order_arrivals_within_the_window_are_new_once():
+    window = DedupWindow(64)
+    assert window.accept(10)
+    assert window.accept(7)
+    assert window.accept(9)
+    assert not window.accept(7)
+    assert window.accept(8)
+    assert not window.accept(10)
+
+
+def test_the_window_slides_forgetting_the_oldest():
+    window = DedupWindow(64)
+    assert window.accept(0)
+    assert window.accept(63)
+
+    # 64 takes the bit of 0, which has fallen out of the window
+    assert window.accept(64)
+    assert not window.accept(0)
+    # still in the window
+    assert not window.accept(63)
+    assert window.accept(62)
+
+
+def test_a_jump_past_the_window_starts_it_over():
+    window = DedupWindow(64)
+    for seq in range(10):
+        window.accept(seq)
+
+    # the bits of the old ones must not be mistaken for the new ones
+    assert window.accept(1000)
+    assert window.accept(1000 - 64 + 1)
+    assert window.accept(999)
+    assert not window.accept(1000)
+    assert not window.accept(5)
+
+
+def test_the_size_is_rounded_up_to_whole_bytes():
+    window = DedupWindow(10)
+    assert window.size == 16
+    assert window.accept(20)
+    assert window.accept(5)
+    assert not window.accept(4)
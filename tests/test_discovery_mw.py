@@ -0,0 +1,100 @@
+###############################################
+#
+# Purpose: Tests of the discovery middleware's worker pool and event loop
+#
+# Created: Spring 2023
+#
+###############################################
+
+import os
+import sys
+import logging
+import threading
+import subprocess
+
+import pytest
+
+from CS6381_MW.DiscoveryMW import DiscoveryMW
+from CS6381_MW import discovery_pb2
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# a discovery on the in-process coordinator, whose registry is changed from
+# threads other than its event loop's, both by hand and by a registration
+# showing up in the coordinator, and which is then stopped. Its ZMQ context
+# only terminates once every socket is closed; it runs in a process of its
+# own, as the context is that of the whole process.
+SCRIPT = """
+import os, threading, time, logging, zmq
+from CS6381_MW.Common import use_inproc, advertise_registration, REGISTRY_PUBS
+from CS6381_MW import discovery_pb2
+import DiscoveryAppln
+
+use_inproc()
+logger = logging.getLogger("discovery")
+logger.setLevel(logging.WARNING)
+appln = DiscoveryAppln.DiscoveryAppln(logger)
+appln.configure(DiscoveryAppln.parseCmdLineArgs(["-a", "discovery", "-zka", "local", "-l", "30"]))
+published = []
+appln.publish_changes = lambda: published.append(threading.current_thread())
+announced = []
+announce_ready = appln.announce_ready
+appln.announce_ready = lambda: announced.append(threading.current_thread()) or announce_ready()
+loop = threading.Thread(target=appln.driver, daemon=True)
+loop.start()
+time.sleep(0.2)
+
+changers = [threading.Thread(target=appln.mw_obj.registry_changed) for _ in range(5)]
+for changer in changers:
+    changer.start()
+for changer in changers:
+    changer.join()
+advertise_registration(appln.coord, REGISTRY_PUBS, "pub1", "pub1", 5577, ["weather"])
+time.sleep(0.2)
+
+appln.mw_obj.disable_event_loop()
+loop.join(5)
+assert not loop.is_alive(), "event loop still running"
+assert published and all(thread is loop for thread in published), published
+assert announced and all(thread is loop for thread in announced), announced
+zmq.Context.instance().term()
+print("terminated")
+os._exit(0)
+"""
+
+
+def test_changes_are_published_on_the_event_loop_and_shutdown_closes_every_socket():
+    result = subprocess.run([sys.executable, "-c", SCRIPT], cwd=HERE, capture_output=True, text=True, timeout=30)
+    assert result.returncode == 0, result.stderr
+    assert "terminated" in result.stdout
+
+
+class Sent():
+    """ Stands in for the PUB socket, keeping what is sent """
+
+    def __init__(self):
+        self.sent = []
+
+    def send_multipart(self, frames):
+        self.sent.append(frames)
+
+
+def test_notify_takes_the_pub_socket_on_the_event_loop_thread_only():
+    mw = DiscoveryMW(logging.getLogger("test"))
+    mw.pub = Sent()
+    mw.loop_thread = threading.current_thread()
+    mw.notify("ready", discovery_pb2.DiscoveryResp())
+    assert [frames[0] for frames in mw.pub.sent] == [b"ready"]
+
+    raised = []
+
+    def off_loop():
+        with pytest.raises(Exception, match="off the event loop"):
+            mw.notify("ready", discovery_pb2.DiscoveryResp())
+        raised.append(True)
+
+    thread = threading.Thread(target=off_loop)
+    thread.start()
+    thread.join()
+    assert raised
+    assert len(mw.pub.sent) == 1
@@ -0,0 +1,191 @@
+###############################################
+#
+# Purpose: Tests of the in-process stand-in for ZooKeeper
+#
+# Created: Spring 2023
+#
+###############################################
+
+import time
+import queue
+import itertools
+import threading
+
+import pytest
+from kazoo.exceptions import NoChildrenForEphemeralsError
+
+from CS6381_MW.Coordination import make_coordinator
+from CS6381_MW.LocalCoordination import LocalCoordinator
+
+# every test gets an ensemble of its own
+ensembles = itertools.count()
+
+
+@pytest.fixture
+def hosts():
+    return "local:{}".format(next(ensembles))
+
+
+def session(hosts):
+    coord = make_coordinator(hosts)
+    coord.start()
+    return coord
+
+
+# what a watch is told, which happens on the thread of the ensemble
+def watched():
+    seen = queue.Queue()
+    return seen, seen.put
+
+
+########################################
+# sessions and znodes
+########################################
+def test_local_hosts_get_the_stand_in_and_share_its_znodes(hosts):
+    one, two = session(hosts), session(hosts)
+    other = session(hosts + "0")
+    assert isinstance(one, LocalCoordinator)
+
+    one.put_ephemeral("/curbroker", b"broker0 5570")
+    assert two.get("/curbroker") == b"broker0 5570"
+    assert other.get("/curbroker") is None
+
+
+def test_ephemeral_znodes_go_away_with_the_session(hosts):
+    owner, other = session(hosts), session(hosts)
+    owner.ensure_path("/numPubs")
+    owner.put_ephemeral("/numPubs/pub1")
+    owner.put_ephemeral("/curDiscovery", b"discovery0:5555")
+
+    owner.stop()
+    assert not other.exists("/numPubs/pub1")
+    assert not other.exists("/curDiscovery")
+    # persistent ones stay
+    assert other.exists("/numPubs")
+
+
+def test_ephemeral_znodes_have_no_children(hosts):
+    coord = session(hosts)
+    coord.put_ephemeral("/curbroker")
+    with pytest.raises(NoChildrenForEphemeralsError):
+        coord.put_ephemeral("/curbroker/child")
+
+
+def test_claim_replaces_the_znode_and_makes_it_ours(hosts):
+    old, new, other = session(hosts), session(hosts), session(hosts)
+    old.put_ephemeral("/curbroker", b"broker0 5570")
+    new.claim("/curbroker", b"broker1 5570")
+    assert other.get("/curbroker") == b"broker1 5570"
+
+    # gone with the claimant's session, not the old owner's
+    old.stop()
+    assert other.get("/curbroker") == b"broker1 5570"
+    new.stop()
+    assert other.get("/curbroker") is None
+
+
+def test_writes_are_coalesced_until_flushed(hosts):
+    coord = session(hosts)
+    coord.ensure_path("/numPubs")
+    for value in (b"1", b"2", b"3"):
+        coord.set("/numPubs", value)
+    coord.flush()
+    assert coord.get("/numPubs") == b"3"
+
+
+########################################
+# watches
+########################################
+def test_data_watches_see_the_value_and_then_every_change(hosts):
+    watcher, writer = session(hosts), session(hosts)
+    seen, callback = watched()
+    watcher.watch_data("/curDiscovery", callback)
+    assert seen.get(timeout=1) is None
+
+    writer.put_ephemeral("/curDiscovery", b"discovery0:5555")
+    writer.claim("/curDiscovery", b"discovery1:5555")
+    writer.stop()
+
+    assert seen.get(timeout=1) == b"discovery0:5555"
+    # a claim removes and creates in one go, and the watch sees both
+    assert seen.get(timeout=1) is None
+    assert seen.get(timeout=1) == b"discovery1:5555"
+    assert seen.get(timeout=1) is None
+
+
+def test_children_watches_see_arrivals_and_departures(hosts):
+    watcher, pub1, pub2 = session(hosts), session(hosts), session(hosts)
+    watcher.ensure_path("/numPubs")
+    seen, callback = watched()
+    watcher.watch_children("/numPubs", callback)
+    assert seen.get(timeout=1) == []
+
+    # the children are read once the watch is told, as from the cache of
+    # a Coordinator, so we let each change be seen before the next
+    pub1.put_ephemeral("/numPubs/pub1")
+    assert seen.get(timeout=1) == ["pub1"]
+    pub2.put_ephemeral("/numPubs/pub2")
+    assert seen.get(timeout=1) == ["pub1", "pub2"]
+    pub1.stop()
+    assert seen.get(timeout=1) == ["pub2"]
+
+
+########################################
+# elections
+########################################
+def campaign(coord, name, leading):
+    ''' stand for election as name, leading until stepdown is set '''
+    stepdown = threading.Event()
+    election = coord.election("/election/broker", name)
+
+    def lead():
+        leading.put(name)
+        stepdown.wait()
+
+    threading.Thread(target=election.run, args=(lead,), daemon=True).start()
+    return election, stepdown
+
+
+def test_the_first_candidate_leads_and_the_next_takes_over_when_it_steps_down(hosts):
+    first, second = session(hosts), session(hosts)
+    leading = queue.Queue()
+    election, stepdown = campaign(first, "broker0", leading)
+    assert leading.get(timeout=1) == "broker0"
+    campaign(second, "broker1", leading)
+
+    with pytest.raises(queue.Empty):
+        leading.get(timeout=0.1)
+    assert election.contenders() == ["broker0", "broker1"]
+
+    stepdown.set()
+    assert leading.get(timeout=1) == "broker1"
+    assert election.contenders() == ["broker1"]
+
+
+def test_the_next_candidate_takes_over_when_the_leader_loses_its_session(hosts):
+    first, second = session(hosts), session(hosts)
+    leading = queue.Queue()
+    campaign(first, "broker0", leading)
+    assert leading.get(timeout=1) == "broker0"
+    election, stepdown = campaign(second, "broker1", leading)
+
+    # the leader crashes without stepping down
+    first.stop()
+    assert leading.get(timeout=1) == "broker1"
+    assert election.contenders() == ["broker1"]
+
+
+def test_a_cancelled_candidate_leaves_the_queue(hosts):
+    first, second = session(hosts), session(hosts)
+    leading = queue.Queue()
+    election, stepdown = campaign(first, "broker0", leading)
+    assert leading.get(timeout=1) == "broker0"
+    waiting, unused = campaign(second, "broker1", leading)
+    while len(election.contenders()) < 2:
+        time.sleep(0.01)
+
+    waiting.cancel()
+    stepdown.set()
+    with pytest.raises(queue.Empty):
+        leading.get(timeout=0.2)
+    assert election.contenders() == []
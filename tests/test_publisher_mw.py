@@ -0,0 +1,102 @@
+###############################################
+#
+# Purpose: Tests of the retransmit rings of the publisher middleware and
+# the gap fills they answer
+#
+# Created: Spring 2023
+#
+###############################################
+
+import json
+import logging
+
+import zmq
+
+from CS6381_MW.PublisherMW import PublisherMW
+
+logger = logging.getLogger("test")
+
+
+class Sent():
+    """ Stands in for the PUB socket, keeping what is sent """
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, buf):
+        self.sent.append(buf)
+
+
+def publisher(retransmit, name="pub1"):
+    mw = PublisherMW(logger)
+    mw.addr = "10.0.0.1"
+    mw.seq = 100
+    mw.retransmit = retransmit
+    mw.registration = (name, ["weather", "humidity"])
+    mw.pub = Sent()
+    return mw
+
+
+# the sequence number a publication ends in
+def seq_of(publication):
+    return int(publication.rsplit(":", 1)[1])
+
+
+########################################
+# a broker asking the publisher for what it missed, over the gap-fill
+# ROUTER socket the way BrokerMW::request_gapfill does
+########################################
+def gapfill(mw, last_seen):
+    context = zmq.Context.instance()
+    endpoint = "inproc://gapfill-test-{}".format(id(mw))
+    mw.gapfill = context.socket(zmq.ROUTER)
+    mw.gapfill.bind(endpoint)
+    broker = context.socket(zmq.DEALER)
+    broker.connect(endpoint)
+    try:
+        broker.send(bytes(json.dumps(last_seen), "utf-8"))
+        assert mw.gapfill.poll(1000)
+        mw.handle_gapfill()
+
+        assert broker.poll(1000)
+        return [frame.decode("utf-8") for frame in broker.recv_multipart() if frame]
+    finally:
+        broker.close(linger=0)
+        mw.gapfill.close(linger=0)
+
+
+def test_the_ring_keeps_the_latest_publications_of_each_topic():
+    mw = publisher(retransmit=3)
+    for i in range(5):
+        mw.disseminate("pub1", "weather", "sunny")
+    mw.disseminate("pub1", "humidity", "dry")
+
+    assert [seq for seq, publication in mw.rings["weather"]] == [102, 103, 104]
+    assert [seq for seq, publication in mw.rings["humidity"]] == [105]
+    assert [seq_of(buf.decode("utf-8")) for buf in mw.pub.sent] == list(range(100, 106))
+
+
+def test_gapfill_resends_what_came_after_the_last_seen_in_order():
+    mw = publisher(retransmit=10)
+    for i in range(3):
+        mw.disseminate("pub1", "weather", "sunny")
+        mw.disseminate("pub1", "humidity", "dry")
+
+    resent = gapfill(mw, {"pub1": 102, "pub2": 999})
+    assert [seq_of(publication) for publication in resent] == [103, 104, 105]
+    assert resent == [buf.decode("utf-8") for buf in mw.pub.sent[3:]]
+
+
+def test_gapfill_for_a_broker_that_got_nothing_from_us_resends_all_we_have():
+    mw = publisher(retransmit=2)
+    for i in range(4):
+        mw.disseminate("pub1", "weather", "sunny")
+
+    assert [seq_of(publication) for publication in gapfill(mw, {})] == [102, 103]
+
+
+def test_gapfill_with_nothing_missed_answers_empty():
+    mw = publisher(retransmit=10)
+    mw.disseminate("pub1", "weather", "sunny")
+
+    assert gapfill(mw, {"pub1": 100}) == []
@@ -0,0 +1,192 @@
+###############################################
+#
+# Purpose: Tests of the registry of the discovery service
+#
+# Created: Spring 2023
+#
+###############################################
+
+from CS6381_MW import discovery_pb2
+from registry import Registry, ResponseCache
+
+PUB = discovery_pb2.ROLE_PUBLISHER
+SUB = discovery_pb2.ROLE_SUBSCRIBER
+
+
+def pub(name, port=5577):
+    return (name, "10.0.0.1", port)
+
+
+########################################
+# versions
+########################################
+def test_every_change_and_nothing_else_bumps_the_version():
+    registry = Registry()
+    start = registry.version
+
+    assert registry.register(PUB, pub("pub1"), ["weather"])
+    assert registry.version == start + 1
+
+    # a resent request leaves things as they are
+    assert not registry.register(PUB, pub("pub1"), ["weather"])
+    assert registry.version == start + 1
+
+    assert registry.register(PUB, pub("pub1"), ["weather", "humidity"])
+    assert registry.deregister("pub1")
+    assert not registry.deregister("pub1")
+    assert registry.version == start + 3
+
+
+def test_registering_again_replaces_the_earlier_registration():
+    registry = Registry()
+    registry.register(PUB, pub("pub1", 5577), ["weather", "humidity"])
+    registry.register(PUB, pub("pub1", 5578), ["humidity"])
+
+    assert registry.count(PUB) == 1
+    assert "weather" not in registry.view
+    assert registry.view["humidity"] == (pub("pub1", 5578),)
+    assert registry.pubs_view == (pub("pub1", 5578),)
+
+
+########################################
+# deltas
+########################################
+def test_delta_has_the_publishers_added_and_removed_since_a_version():
+    registry = Registry()
+    registry.register(PUB, pub("pub1"), ["weather"])
+    since = registry.version
+
+    registry.register(PUB, pub("pub2"), ["weather"])
+    registry.register(SUB, ("sub1", "10.0.0.2", 5800), ["weather"])
+    registry.deregister("pub1")
+
+    version, added, removed = registry.delta(since)
+    assert version == registry.version
+    assert added == [pub("pub2")]
+    assert removed == [pub("pub1")]
+
+
+def test_delta_is_limited_to_the_topics_asked_about():
+    registry = Registry()
+    since = registry.version
+    registry.register(PUB, pub("pub1"), ["weather"])
+    registry.register(PUB, pub("pub2"), ["humidity"])
+
+    version, added, removed = registry.delta(since, {"humidity"})
+    assert added == [pub("pub2")]
+    assert removed == []
+
+
+def test_an_entity_that_came_and_went_is_not_in_the_delta():
+    registry = Registry()
+    since = registry.version
+    registry.register(PUB, pub("pub1"), ["weather"])
+    registry.deregister("pub1")
+
+    assert registry.delta(since) == (registry.version, [], [])
+
+
+def test_no_delta_from_versions_we_do_not_know():
+    registry = Registry(history=2)
+    start = registry.version
+    for i in range(3):
+        registry.register(PUB, pub("pub{}".format(i)), ["weather"])
+
+    # fallen out of the history
+    assert registry.delta(start) is None
+    # from the future, e.g., of another discovery instance
+    assert registry.delta(registry.version + 1) is None
+    # still in the history
+    assert registry.delta(registry.version - 1) == (registry.version, [pub("pub2")], [])
+
+
+def test_changes_after_reports_the_floor_once_history_is_lost():
+    registry = Registry(history=2)
+    start = registry.version
+    for i in range(3):
+        registry.register(PUB, pub("pub{}".format(i)), ["weather"])
+
+    floor, version, changes = registry.changes_after(start)
+    assert floor > start
+    assert version == registry.version
+    assert [change[1] for change in changes] == ["pub1", "pub2"]
+
+
+########################################
+# views
+########################################
+def test_views_are_consistent_after_deregistering():
+    registry = Registry()
+    registry.register(PUB, pub("pub1"), ["weather", "humidity"])
+    registry.register(PUB, pub("pub2"), ["weather"])
+    registry.register(SUB, ("sub1", "10.0.0.2", 5800), ["weather"])
+    before = registry.view
+
+    registry.deregister("pub1")
+
+    assert registry.view == {"weather": (pub("pub2"),)}
+    assert registry.pubs_view == (pub("pub2"),)
+    assert registry.count(PUB) == 1
+    assert registry.count(SUB) == 1
+
+    # the view handed out earlier is left as it was
+    assert set(before) == {"weather", "humidity"}
+
+    registry.deregister("pub2")
+    assert registry.view == {}
+    assert registry.pubs_view == ()
+
+
+########################################
+# cached responses
+########################################
+def test_cached_responses_are_served_for_their_version_only():
+    cache = ResponseCache()
+    cache.put(7, "weather", b"seven")
+
+    assert cache.get(7, "weather") == b"seven"
+    assert cache.get(8, "weather") is None
+    assert cache.get(7, "humidity") is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_a_newer_version_invalidates_everything_cached():
+    cache = ResponseCache()
+    cache.put(7, "weather", b"seven")
+    cache.put(7, "humidity", b"seven")
+    cache.put(8, "weather", b"eight")
+
+    assert cache.get(8, "weather") == b"eight"
+    assert cache.get(8, "humidity") is None
+    assert cache.get(7, "weather") is None
+
+
+def test_responses_built_from_an_older_version_are_not_cached():
+    cache = ResponseCache()
+    cache.put(8, "weather", b"eight")
+    # a worker that read the registry before the change finishes late
+    cache.put(7, "weather", b"seven")
+    cache.put(7, "humidity", b"seven")
+
+    assert cache.get(8, "weather") == b"eight"
+    assert cache.get(7, "humidity") is None
+
+
+def test_the_cache_holds_no_more_than_its_capacity():
+    cache = ResponseCache(capacity=2)
+    for key in ("a", "b", "c"):
+        cache.put(1, key, key.encode())
+
+    assert cache.get(1, "a") == b"a"
+    assert cache.get(1, "c") is None
+    assert cache.hit_rate() == 0.5
+
+
+def test_registry_changes_move_cached_lookups_to_a_new_version():
+    registry = Registry()
+    cache = ResponseCache()
+    registry.register(PUB, pub("pub1"), ["weather"])
+    cache.put(registry.version, "weather", b"pub1")
+
+    registry.register(PUB, pub("pub2"), ["weather"])
+    assert cache.get(registry.version, "weather") is None
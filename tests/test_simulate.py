@@ -0,0 +1,102 @@
+###############################################
+#
+# Purpose: Whole-system tests, running simulate.py
+#
+# Created: Spring 2023
+#
+###############################################
+
+# simulate.py runs every entity as a thread of one process, sharing a ZMQ
+# context and the in-process stand-in for ZooKeeper, and leaves without
+# tearing them down. So each run gets a process of its own, and we go by
+# what it reports.
+
+import os
+import re
+import sys
+import subprocess
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENTITIES = re.compile(r"(\d+) entities \((\d+) discovery, (\d+) brokers, (\d+) publishers, (\d+) subscribers\), (\w+)")
+DELIVERED = re.compile(r"(\d+)/(\d+) delivered, (\d+) duplicates dropped, (\d+) subscribers short")
+CRASHED = re.compile(r"crashed, gone [\d.]+ ms later, (.+) leading ([\d.]+) ms after the crash")
+
+
+def simulate(*argv):
+    ''' what a run of simulate.py with argv reports '''
+    result = subprocess.run([sys.executable, "simulate.py"] + list(argv), cwd=HERE,
+                            capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+
+    entities = ENTITIES.search(result.stdout).groups()
+    delivered, expected, duplicates, short = map(int, DELIVERED.search(result.stdout).groups())
+    report = {"entities": int(entities[0]), "brokers": int(entities[2]), "strategy": entities[5],
+              "delivered": delivered, "expected": expected, "duplicates": duplicates, "short": short}
+    crashed = CRASHED.search(result.stdout)
+    if crashed:
+        report["successor"] = crashed.group(1)
+    return report
+
+
+def test_two_broker_paths_deliver_everything_twice():
+    report = simulate("-s", "Broker", "-B", "2", "-bp", "2", "-P", "3", "-S", "3", "-i", "20", "-f", "10")
+
+    assert report["delivered"] == report["expected"] == 3 * 20 * 3
+    assert report["short"] == 0
+    # the standby forwards as well; all but the first few, sent before the
+    # subscribers had connected to both, come in twice
+    assert report["duplicates"] >= report["delivered"] * 0.9
+
+
+def test_two_broker_paths_survive_the_leader_crashing():
+    report = simulate("-s", "Broker", "-B", "2", "-bp", "2", "-P", "3", "-S", "3", "-i", "20", "-f", "10",
+                      "-k", "broker")
+
+    assert report["successor"] == "broker1 5570"
+    assert report["delivered"] == report["expected"]
+    assert report["short"] == 0
+    assert report["duplicates"] > 0
+
+
+def test_brokers_count_only_in_the_broker_strategy():
+    report = simulate("-s", "Direct", "-B", "4", "-P", "2", "-S", "2", "-i", "5", "-f", "10")
+
+    assert report["strategy"] == "Direct"
+    assert report["brokers"] == 0
+    assert report["entities"] == 1 + 2 + 2
+    assert report["delivered"] == report["expected"]
+
+
+def test_direct_delivers_every_publication():
+    report = simulate("-s", "Direct", "-P", "3", "-S", "3", "-T", "2", "-i", "10", "-f", "10")
+
+    assert report["delivered"] == report["expected"] == 3 * 10 * 2 * 3
+    assert report["duplicates"] == 0
+    assert report["short"] == 0
+
+
+def test_broker_delivers_every_publication():
+    report = simulate("-s", "Broker", "-P", "3", "-S", "3", "-T", "2", "-i", "10", "-f", "10")
+
+    assert report["delivered"] == report["expected"] == 3 * 10 * 2 * 3
+    assert report["short"] == 0
+
+
+def test_delivery_survives_the_discovery_leader_crashing():
+    report = simulate("-s", "Direct", "-D", "3", "-P", "3", "-S", "3", "-i", "20", "-f", "10", "-k", "discovery")
+
+    assert report["successor"] == "inproc://discovery1:5555"
+    assert report["delivered"] == report["expected"]
+    assert report["short"] == 0
+
+
+def test_delivery_survives_the_leading_broker_crashing():
+    report = simulate("-s", "Broker", "-B", "2", "-P", "3", "-S", "3", "-i", "20", "-f", "10", "-k", "broker")
+
+    assert report["successor"] == "broker1 5570"
+    assert report["delivered"] == report["expected"]
+    assert report["short"] == 0
+    # the new leader replays what it kept while standing by once the
+    # subscribers have followed it, and they drop what they had already
+    assert report["duplicates"] > 0
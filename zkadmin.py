@@ -0,0 +1,143 @@
+###############################################
+#
+# Purpose: Lay out and check our subtree in ZooKeeper
+#
+# Created: Spring 2023
+#
+###############################################
+
+# zookeep.py used to create our znodes and then sleep forever, and some of
+# them were ephemeral, so that they went away whenever it did. Here we lay
+# out the persistent part of our subtree, check it and exit. Running it
+# again changes nothing, so it is safe to run whenever the system is
+# (re)started, e.g.,
+#
+#   python3 zkadmin.py            # create whatever is missing, then check
+#   python3 zkadmin.py --check    # just check
+#
+# The exit status is 1 if the check finds anything wrong.
+#
+# Everything else, i.e., /curDiscovery and /curbroker of the leaders, the
+# registrations, the memberships and the candidates of the elections, is
+# ephemeral and comes and goes with the entities.
+
+import sys  # for the exit status
+import argparse  # for argument parsing
+
+from kazoo.client import KazooClient
+from kazoo.exceptions import NoNodeError
+
+# the persistent znodes and where they live
+from CS6381_MW.Common import SCHEMA_PATHS
+from CS6381_MW.Coordination import ROOT, SCHEMA, SCHEMA_VERSION
+
+
+def parseCmdLineArgs():
+    parser = argparse.ArgumentParser(description="ZooKeeper bootstrap")
+
+    parser.add_argument("-c", "--check", action="store_true",
+                        help="only check the layout, create nothing")
+
+    parser.add_argument("-zkp", "--zkPort", type=int, default=2181,
+                        help="ZooKeeper server port, default 2181")
+
+    parser.add_argument("-zka", "--zkIPAddr", type=str, default="127.0.0.1",
+                        help="ZooKeeper server IP address, default 127.0.0.1")
+
+    return parser.parse_args()
+
+
+########################################
+# the znodes still to create, parents before their children
+########################################
+def missing(zk):
+    paths = []
+    for path in SCHEMA_PATHS:
+        parts = path.strip("/").split("/")
+        for i in range(1, len(parts) + 1):
+            prefix = "/" + "/".join(parts[:i])
+            if prefix not in paths and not zk.exists(prefix):
+                paths.append(prefix)
+
+    if not zk.exists(SCHEMA):
+        paths.append(SCHEMA)
+
+    return paths
+
+
+########################################
+# create whatever is missing
+#
+# all in one transaction, so that the layout is either complete or
+# untouched. Should another bootstrap get in first, ours fails as a whole
+# and we look again at what is left to do
+########################################
+def bootstrap(zk):
+    # the root itself, since we are chrooted to it
+    zk.ensure_path("/")
+
+    for attempt in range(3):
+        paths = missing(zk)
+        if not paths:
+            return
+
+        transaction = zk.transaction()
+        for path in paths:
+            value = bytes(str(SCHEMA_VERSION), "utf-8") if path == SCHEMA else b""
+            transaction.create(path, value)
+
+        if not any(isinstance(result, Exception) for result in transaction.commit()):
+            print("created {}".format(", ".join(paths)))
+            return
+
+
+########################################
+# what is wrong with the layout, if anything
+########################################
+def validate(zk):
+    problems = []
+
+    try:
+        data, stat = zk.get(SCHEMA)
+    except NoNodeError:
+        data = None
+
+    if data is None:
+        problems.append("{} is missing".format(SCHEMA))
+    elif data != bytes(str(SCHEMA_VERSION), "utf-8"):
+        problems.append("{} holds version {}, expected {}".format(SCHEMA, data.decode("utf-8"), SCHEMA_VERSION))
+
+    for path in SCHEMA_PATHS:
+        stat = zk.exists(path)
+        if stat is None:
+            problems.append("{} is missing".format(path))
+        elif stat.ephemeralOwner:
+            problems.append("{} is ephemeral and goes away with its session".format(path))
+
+    return problems
+
+
+def main():
+    args = parseCmdLineArgs()
+
+    # chrooted to where everything of ours lives
+    zk = KazooClient(args.zkIPAddr + ":" + str(args.zkPort) + ROOT)
+    zk.start()
+
+    if not args.check:
+        bootstrap(zk)
+
+    problems = validate(zk)
+    for problem in problems:
+        print(problem)
+    if not problems:
+        print("{} is laid out as of schema {}".format(ROOT, SCHEMA_VERSION))
+
+    zk.stop()
+    zk.close()
+
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()